@@ -0,0 +1,199 @@
+"""aggregates.py – precomputed month × category × merchant × currency cube
+========================================================================
+
+The sidebar stats, the pie chart and the AI context all need the same handful
+of sums.  Instead of running pandas ``groupby`` on the request path, this
+module aggregates the dataset **once** into a small cube of cells (one per
+month / category / merchant / currency combination) and keeps per‑month views
+derived from it.  Appending transactions merges only the new rows into the
+cube and refreshes the views of the months they touch.
+
+Spend totals use ``amount_base`` (every amount in the base currency, see
+:mod:`fx`), so they add up across currencies; only :meth:`currency_totals`
+reports native amounts per currency.  CO₂ rollups sum ``co2_kg`` (the
+footprint normalised to kilograms at ingest) along the same keys.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+cube = AggregateCube(df)
+cube.month_summary("2024-02")["total"]
+cube.category_totals("2024-02")      # sorted descending
+cube.co2_by_category("2024-02")      # kg, sorted descending
+cube.append(new_rows)
+```
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+KEYS: List[str] = ["month", "category", "merchant", "currency"]
+MEASURES: Dict[str, str] = {
+    "amount_sum": "sum",
+    "base_sum": "sum",
+    "base_min": "min",
+    "base_max": "max",
+    "count": "sum",
+    "amount_min": "min",
+    "amount_max": "max",
+    "co2_sum": "sum",
+    "unconverted": "sum",
+}
+UNKNOWN = "Unknown"
+
+_EMPTY_SUMMARY: Dict[str, Any] = {
+    "total": 0.0, "count": 0, "min": None, "max": None, "co2": 0.0, "unconverted": 0,
+}
+_EMPTY_SERIES = pd.Series(dtype="float64")
+
+
+class AggregateCube:
+    """Additive aggregates of the transaction frame with O(1) per‑month lookups."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self._cells = _aggregate(df)
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._by_category: Dict[str, pd.Series] = {}
+        self._by_merchant: Dict[str, pd.Series] = {}
+        self._by_currency: Dict[str, pd.Series] = {}
+        self._co2_by_category: Dict[str, pd.Series] = {}
+        self._co2_by_merchant: Dict[str, pd.Series] = {}
+        self._month_category: Optional[pd.DataFrame] = None
+        self._monthly_co2: Optional[pd.Series] = None
+        self._refresh(self._cells.index.get_level_values("month").unique())
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def cells(self) -> pd.DataFrame:
+        """The raw cube, indexed by ``KEYS``."""
+        return self._cells
+
+    def month_summary(self, month: Optional[str]) -> Dict[str, Any]:
+        """``total``, ``count``, ``min``, ``max`` (base currency) and ``co2`` for **month**.
+
+        ``unconverted`` counts rows whose currency had no FX rate, so they are missing from ``total``.
+        """
+        summary = self._summaries.get(str(month))
+        return summary if summary is not None else dict(_EMPTY_SUMMARY)
+
+    def category_totals(self, month: Optional[str]) -> pd.Series:
+        """Spend per category in **month**, largest first."""
+        return self._by_category.get(str(month), _EMPTY_SERIES)
+
+    def merchant_totals(self, month: Optional[str]) -> pd.Series:
+        """Spend per merchant in **month**, largest first."""
+        return self._by_merchant.get(str(month), _EMPTY_SERIES)
+
+    def currency_totals(self, month: Optional[str]) -> pd.Series:
+        """Native spend per currency in **month** (not converted), largest first."""
+        return self._by_currency.get(str(month), _EMPTY_SERIES)
+
+    def co2_by_category(self, month: Optional[str]) -> pd.Series:
+        """CO₂ footprint (kg) per category in **month**, largest first."""
+        return self._co2_by_category.get(str(month), _EMPTY_SERIES)
+
+    def co2_by_merchant(self, month: Optional[str]) -> pd.Series:
+        """CO₂ footprint (kg) per merchant in **month**, largest first."""
+        return self._co2_by_merchant.get(str(month), _EMPTY_SERIES)
+
+    def monthly_co2(self) -> pd.Series:
+        """CO₂ footprint (kg) per month, oldest first."""
+        if self._monthly_co2 is None:
+            self._monthly_co2 = self._cells["co2_sum"].groupby(level="month").sum().sort_index()
+        return self._monthly_co2
+
+    def month_category_table(self) -> pd.DataFrame:
+        """Months × categories spend table (rows are months, oldest first)."""
+        if self._month_category is None:
+            self._month_category = (
+                self._cells["base_sum"]
+                .groupby(level=["month", "category"]).sum()
+                .unstack(fill_value=0)
+                .astype(float)
+                .round(2)
+                .sort_index()
+            )
+        return self._month_category
+
+    # ------------------------------------------------------------------ updates
+    def append(self, rows: pd.DataFrame) -> None:
+        """Merge freshly appended **rows** into the cube in place."""
+        new = _aggregate(rows)
+        if new.empty:
+            return
+        touched = self._cells.index.isin(new.index)
+        merged = (
+            pd.concat([self._cells[touched], new])
+            .groupby(level=KEYS, sort=False)
+            .agg(MEASURES)
+        )
+        self._cells = pd.concat([self._cells[~touched], merged])
+        self._month_category = None
+        self._monthly_co2 = None
+        self._refresh(new.index.get_level_values("month").unique())
+
+    def _refresh(self, months: Iterable[str]) -> None:
+        """Rebuild the derived per‑month views for **months** from the cells."""
+        months = list(months)
+        if not months:
+            return
+        part = self._cells[self._cells.index.get_level_values("month").isin(months)]
+        per_month = part.groupby(level="month").agg(MEASURES)
+        views = [
+            (self._by_category, part["base_sum"].groupby(level=["month", "category"]).sum()),
+            (self._by_merchant, part["base_sum"].groupby(level=["month", "merchant"]).sum()),
+            (self._by_currency, part["amount_sum"].groupby(level=["month", "currency"]).sum()),
+            (self._co2_by_category, part["co2_sum"].groupby(level=["month", "category"]).sum()),
+            (self._co2_by_merchant, part["co2_sum"].groupby(level=["month", "merchant"]).sum()),
+        ]
+        for month in months:
+            row = per_month.loc[month]
+            self._summaries[month] = {
+                "total": float(row["base_sum"]),
+                "count": int(row["count"]),
+                "min": float(row["base_min"]),
+                "max": float(row["base_max"]),
+                "co2": float(row["co2_sum"]),
+                "unconverted": int(row["unconverted"]),
+            }
+            for store, series in views:
+                store[month] = series.xs(month, level="month").sort_values(ascending=False)
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _aggregate(df: pd.DataFrame) -> pd.DataFrame:
+    """Group **df** into cube cells keyed by plain strings (not categoricals)."""
+    if df.empty:
+        index = pd.MultiIndex.from_arrays([[] for _ in KEYS], names=KEYS)
+        return pd.DataFrame({name: pd.Series(dtype="float64") for name in MEASURES}, index=index)
+    # Amounts that had no FX rate (see fx.py): absent from base sums, so count them
+    df = df.assign(_unconverted=df["amount_base"].isna() & df["amount"].notna())
+    cells = (
+        df.groupby(KEYS, observed=True, dropna=False, sort=False)
+        .agg(
+            amount_sum=("amount", "sum"),
+            base_sum=("amount_base", "sum"),
+            base_min=("amount_base", "min"),
+            base_max=("amount_base", "max"),
+            count=("amount", "size"),
+            amount_min=("amount", "min"),
+            amount_max=("amount", "max"),
+            co2_sum=("co2_kg", "sum"),
+            unconverted=("_unconverted", "sum"),
+        )
+    )
+    cells.index = pd.MultiIndex.from_arrays(
+        [
+            pd.Index(cells.index.get_level_values(i).astype(object)).fillna(UNKNOWN).astype(str)
+            for i in range(len(KEYS))
+        ],
+        names=KEYS,
+    )
+    if not cells.index.is_unique:
+        cells = cells.groupby(level=KEYS, sort=False).agg(MEASURES)
+    return cells
@@ -0,0 +1,369 @@
+"""anomalies.py – vectorised anomaly flags kept up to date on ingest
+=================================================================
+
+The assistant is supposed to "spot anomalies", but the model only ever saw a
+few hundred rows.  :class:`AnomalyDetector` flags suspicious transactions for
+the whole dataset up front, with three checks:
+
+* **unusual amount** – the base‑currency amount sits far above the median of
+  its merchant (or its category, or everything, when the merchant has fewer
+  than :data:`MIN_GROUP_SIZE` transactions), measured in robust z‑scores:
+  ``(amount − median) / (1.4826 · MAD)``, *and* above the
+  :data:`ROLLING_QUANTILE` of that group's last :data:`ROLLING_WINDOW`
+  amounts – a merchant you now pay more every time stops being flagged;
+* **unusual location** – the shop is far from the user's usual whereabouts
+  (the median coordinate), by the same robust score on the distance and at
+  least :data:`LOCATION_MIN_KM` away;
+* **possible duplicate** – same merchant, amount and currency charged again
+  within :data:`DUPLICATE_MINUTES`.
+
+Flags live in a ``uint8`` bit mask aligned with the dataset's rows.
+
+Statistics are kept as counts, so appending rows costs O(new rows + groups
+they touch), never a pass over the history:
+
+* amounts are counted per merchant, per category and overall in log‑spaced
+  buckets (relative error :data:`SKETCH_ERROR`), and a group's median/MAD is a
+  weighted median over its buckets;
+* coordinates are counted in cells of :data:`LOCATION_DECIMALS` decimals, and
+  the home location and distance statistics are weighted medians over cells;
+* each group keeps a ring of its last :data:`ROLLING_WINDOW` amounts for the
+  rolling quantile.
+
+Counts add up, so the statistics after an append equal those of a fresh
+build.  Flags are a stream: only appended rows are scored, and a flag records
+how unusual a transaction looked when it arrived – appends never change
+earlier flags (a rebuild, which judges every row with hindsight, may).
+
+Environment
+-----------
+``TAPIX_ANOMALY_Z`` – robust z‑score threshold, default ``3.5``.
+``TAPIX_ANOMALY_MIN_GROUP`` – transactions needed for per‑merchant stats, default ``5``.
+``TAPIX_ANOMALY_MIN_KM`` – minimum distance for a location flag, default ``500``.
+``TAPIX_ANOMALY_WINDOW`` / ``TAPIX_ANOMALY_QUANTILE`` – rolling window and quantile, default ``20`` / ``0.95``.
+``TAPIX_DUPLICATE_MINUTES`` – window for duplicate charges, default ``10``.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+detector = AnomalyDetector(df)
+detector.flags[lo:hi]                 # bit mask per row
+detector.append(df, start=old_len)    # after rows were appended to df
+```
+"""
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from geo import distance_km
+
+FLAG_AMOUNT = 1
+FLAG_LOCATION = 2
+FLAG_DUPLICATE = 4
+REASONS: Dict[int, str] = {
+    FLAG_AMOUNT: "unusual amount",
+    FLAG_LOCATION: "unusual location",
+    FLAG_DUPLICATE: "possible duplicate",
+}
+
+Z_THRESHOLD = float(os.getenv("TAPIX_ANOMALY_Z", "3.5"))
+MIN_GROUP_SIZE = int(os.getenv("TAPIX_ANOMALY_MIN_GROUP", "5"))
+LOCATION_MIN_KM = float(os.getenv("TAPIX_ANOMALY_MIN_KM", "500"))
+ROLLING_WINDOW = int(os.getenv("TAPIX_ANOMALY_WINDOW", "20"))
+ROLLING_QUANTILE = float(os.getenv("TAPIX_ANOMALY_QUANTILE", "0.95"))
+DUPLICATE_MINUTES = float(os.getenv("TAPIX_DUPLICATE_MINUTES", "10"))
+
+# Amount statistics, most specific first; each falls back to the next and finally to OVERALL
+AMOUNT_GROUPS: List[str] = ["merchantUid", "category"]
+OVERALL = "overall"
+SKETCH_ERROR = 0.01  # relative error of a bucketed amount
+LOCATION_DECIMALS = 2  # ~1 km cells for the home location
+
+_MAD_SCALE = 1.4826  # MAD → standard deviation for normal data
+_STATS_COLUMNS = ["median", "mad", "count"]
+_GAMMA = (1 + SKETCH_ERROR) / (1 - SKETCH_ERROR)
+_LOG_GAMMA = math.log(_GAMMA)
+_TINY = 0.005  # amounts below half a cent count as zero
+_OFFSET = int(math.ceil(-math.log(_TINY) / _LOG_GAMMA)) + 1  # keeps non‑zero bucket ids ≥ 1
+_NO_VALUES = np.empty(0, dtype=float)
+
+Stats = Tuple[float, float, int]  # median, MAD, count
+Counts = Dict[Any, int]
+
+
+class AnomalyDetector:
+    """Incremental robust statistics and the anomaly bit mask of one dataset."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.flags = np.zeros(len(df), dtype=np.uint8)
+        self.scores = np.zeros(len(df), dtype=np.float32)
+        levels = AMOUNT_GROUPS + [OVERALL]
+        self._buckets: Dict[str, Dict[Any, Counts]] = {level: {} for level in levels}
+        self._recent: Dict[str, Dict[Any, np.ndarray]] = {level: {} for level in levels}
+        self._groups: Dict[str, pd.DataFrame] = {level: _weighted_stats([], _NO_VALUES, _NO_VALUES) for level in levels}
+        self._cells: Counts = {}
+        self._home: Tuple[float, float] = (np.nan, np.nan)
+        self._distance: Stats = (np.nan, np.nan, 0)
+        self._update_stats(df)
+        self._score(df, 0)
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def nbytes(self) -> int:
+        buckets = sum(len(counts) for table in self._buckets.values() for counts in table.values())
+        recent = sum(ring.nbytes for table in self._recent.values() for ring in table.values())
+        groups = sum(int(stats.memory_usage(deep=True).sum()) for stats in self._groups.values())
+        return self.flags.nbytes + self.scores.nbytes + 64 * (buckets + len(self._cells)) + recent + groups
+
+    @property
+    def home(self) -> Tuple[float, float]:
+        """The user's usual location (median lat/long)."""
+        return self._home
+
+    def stats(self, level: str = OVERALL) -> pd.DataFrame:
+        """Median, MAD and count of amounts per group of **level** (``merchantUid``, ``category`` or ``overall``)."""
+        return self._groups[level]
+
+    # ------------------------------------------------------------------ updates
+    def append(self, df: pd.DataFrame, start: int) -> None:
+        """Score ``df.iloc[start:]`` – rows just appended to **df** – and update the statistics."""
+        new = df.iloc[start:]
+        if new.empty:
+            return
+        self._update_stats(new)
+        self.flags = np.concatenate([self.flags[:start], np.zeros(len(new), dtype=np.uint8)])
+        self.scores = np.concatenate([self.scores[:start], np.zeros(len(new), dtype=np.float32)])
+        self._score(df, start)
+
+    # ------------------------------------------------------------------ helpers
+    def _update_stats(self, rows: pd.DataFrame) -> None:
+        """Count **rows** into the amount buckets and coordinate cells, then refresh what they touch."""
+        amounts = rows["amount_base"].to_numpy(dtype=float)
+        finite = np.isfinite(amounts)
+        buckets = _buckets(np.where(finite, amounts, 0.0))
+        for level in AMOUNT_GROUPS + [OVERALL]:
+            touched = _count(self._buckets[level], _level_keys(rows, level, finite), buckets)
+            if len(touched):
+                fresh = self._bucket_stats(level, touched)
+                self._groups[level] = pd.concat([self._groups[level].drop(fresh.index, errors="ignore"), fresh])
+        cells = rows[["lat", "long"]].astype(float).round(LOCATION_DECIMALS).value_counts(sort=False)
+        for cell, n in cells.items():  # NaN coordinates are dropped
+            self._cells[cell] = self._cells.get(cell, 0) + int(n)
+        if len(cells):
+            self._update_location()
+
+    def _bucket_stats(self, level: str, keys) -> pd.DataFrame:
+        table = self._buckets[level]
+        group, bucket, count = [], [], []
+        for key in keys:
+            counts = table[key]
+            group.extend([key] * len(counts))
+            bucket.extend(counts)
+            count.extend(counts.values())
+        return _weighted_stats(group, _bucket_values(np.asarray(bucket, dtype=np.int64)), np.asarray(count, dtype=float))
+
+    def _update_location(self) -> None:
+        """Home location and distance statistics, as weighted medians over the coordinate cells."""
+        lat, long = (np.array(values, dtype=float) for values in zip(*self._cells))
+        weights = np.fromiter(self._cells.values(), dtype=float, count=len(self._cells))
+        one = np.zeros(len(weights), dtype=np.int64)
+        self._home = (float(_weighted_stats(one, lat, weights)["median"].iloc[0]),
+                      float(_weighted_stats(one, long, weights)["median"].iloc[0]))
+        distance = _weighted_stats(one, distance_km(lat, long, *self._home), weights).iloc[0]
+        self._distance = (float(distance["median"]), float(distance["mad"]), int(distance["count"]))
+
+    def _score(self, df: pd.DataFrame, start: int) -> None:
+        """Set flags and scores of rows ``start:`` and push their amounts into the rolling windows."""
+        rows = df.iloc[start:]
+        amounts = rows["amount_base"].to_numpy(dtype=float)
+        finite = np.isfinite(amounts)
+        overall = self._groups[OVERALL]
+        median = np.full(len(rows), overall["median"].iloc[0] if len(overall) else np.nan)
+        mad = np.full(len(rows), overall["mad"].iloc[0] if len(overall) else np.nan)
+        level = np.full(len(rows), len(AMOUNT_GROUPS))  # index into AMOUNT_GROUPS + [OVERALL]
+        for i, col in reversed(list(enumerate(AMOUNT_GROUPS))):
+            stats = self._groups[col].reindex(rows[col].astype(object))
+            usable = stats["count"].to_numpy(dtype=float) >= MIN_GROUP_SIZE
+            median[usable] = stats["median"].to_numpy(dtype=float)[usable]
+            mad[usable] = stats["mad"].to_numpy(dtype=float)[usable]
+            level[usable] = i
+        z = _robust_z(amounts, median, mad)
+        # Only rows above the z threshold need their group's rolling quantile
+        high = np.full(len(rows), np.nan)
+        for i, name in enumerate(AMOUNT_GROUPS + [OVERALL]):
+            wanted = (level == i) & (z > Z_THRESHOLD)
+            quantile = _rolling_quantile(_level_keys(rows, name, finite), amounts, self._recent[name], wanted)
+            high[wanted] = quantile[wanted]
+        # Within the group's recent range (NaN: too little history) is not unusual
+        flags = np.where((z > Z_THRESHOLD) & ~(amounts <= high), FLAG_AMOUNT, 0).astype(np.uint8)
+
+        distance = distance_km(rows["lat"].to_numpy(dtype=float), rows["long"].to_numpy(dtype=float), *self._home)
+        far = _robust_z(distance, self._distance[0], self._distance[1], floor=LOCATION_MIN_KM / Z_THRESHOLD)
+        flags |= np.where((far > Z_THRESHOLD) & (distance >= LOCATION_MIN_KM), FLAG_LOCATION, 0).astype(np.uint8)
+
+        # Duplicates can pair with rows just before **start**, so look back one window
+        window_ns = int(DUPLICATE_MINUTES * 60 * 10**9)
+        stamps = _stamps(df)
+        lo = int(np.searchsorted(stamps, stamps[start] - window_ns, side="left")) if start < len(stamps) else start
+        duplicate = _duplicate_mask(df.iloc[lo:], window_ns)[start - lo:]
+        flags |= np.where(duplicate, FLAG_DUPLICATE, 0).astype(np.uint8)
+
+        self.flags[start:] = flags
+        self.scores[start:] = np.nan_to_num(np.maximum(z, far), nan=0.0, posinf=0.0)
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def describe(flags: int) -> List[str]:
+    """Human reasons for one row's bit mask."""
+    return [reason for bit, reason in REASONS.items() if int(flags) & bit]
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _buckets(values: np.ndarray) -> np.ndarray:
+    """Signed log bucket id of each amount: ``±i`` covers ``(γ^(i−1−offset), γ^(i−offset)]``, 0 is zero."""
+    magnitude = np.abs(values)
+    index = np.ceil(np.log(np.fmax(magnitude, _TINY)) / _LOG_GAMMA).astype(np.int64) + _OFFSET
+    return np.where(magnitude < _TINY, 0, np.sign(values).astype(np.int64) * index)
+
+
+def _bucket_values(buckets: np.ndarray) -> np.ndarray:
+    """Representative amount of each bucket, within :data:`SKETCH_ERROR` of everything in it."""
+    magnitude = 2 * _GAMMA ** (np.abs(buckets) - _OFFSET).astype(float) / (_GAMMA + 1)
+    return np.where(buckets == 0, 0.0, np.sign(buckets) * magnitude)
+
+
+def _count(table: Dict[Any, Counts], keys: np.ndarray, buckets: np.ndarray) -> List[Any]:
+    """Add one to ``table[key][bucket]`` per row (``None``/NaN keys skipped); returns the keys touched."""
+    pairs = pd.DataFrame({"key": keys, "bucket": buckets}).value_counts(sort=False)
+    touched = {}
+    for (key, bucket), n in pairs.items():
+        counts = table.setdefault(key, {})
+        counts[bucket] = counts.get(bucket, 0) + int(n)
+        touched[key] = None
+    return list(touched)
+
+
+def _weighted_stats(groups, values: np.ndarray, weights: np.ndarray) -> pd.DataFrame:
+    """Median, MAD and count per group of **values** repeated **weights** times, vectorised over groups."""
+    codes, uniques = pd.factorize(pd.Series(groups, dtype=object))
+    median = _weighted_median(codes, values, weights, len(uniques))
+    mad = _weighted_median(codes, np.abs(values - median[codes]), weights, len(uniques))
+    count = np.bincount(codes, weights=weights, minlength=len(uniques)).astype(np.int64)
+    return pd.DataFrame({"median": median, "mad": mad, "count": count}, index=pd.Index(uniques, dtype=object))[_STATS_COLUMNS]
+
+
+def _weighted_median(codes: np.ndarray, values: np.ndarray, weights: np.ndarray, n_groups: int) -> np.ndarray:
+    """Lower weighted median of **values** per group code."""
+    if not n_groups:
+        return _NO_VALUES
+    order = np.lexsort((values, codes))
+    codes, values, weights = codes[order], values[order], weights[order]
+    totals = np.bincount(codes, weights=weights, minlength=n_groups)
+    before = np.concatenate([[0.0], np.cumsum(totals)[:-1]])
+    within = np.cumsum(weights) - before[codes]
+    reached = np.flatnonzero(within >= totals[codes] / 2)
+    first = reached[np.concatenate([[True], codes[reached][1:] != codes[reached][:-1]])]
+    return values[first]
+
+
+def _level_keys(rows: pd.DataFrame, level: str, finite: np.ndarray) -> np.ndarray:
+    """Group key of each row at **level**; ``None`` where the amount is missing."""
+    keys = rows[level].astype(object).to_numpy() if level != OVERALL else np.zeros(len(rows), dtype=object)
+    return np.where(finite, keys, None)
+
+
+def _rolling_quantile(keys: np.ndarray, amounts: np.ndarray, rings: Dict[Any, np.ndarray],
+                      wanted: np.ndarray) -> np.ndarray:
+    """:data:`ROLLING_QUANTILE` of the :data:`ROLLING_WINDOW` amounts before each **wanted** row in its group.
+
+    **rings** holds each group's last amounts from earlier calls and gets
+    these rows' amounts pushed in.  NaN for rows not wanted, without a key, or
+    whose group has fewer than :data:`MIN_GROUP_SIZE` earlier amounts.
+    """
+    key_codes, touched = pd.factorize(keys)  # −1: no key
+    past = [rings.get(key, _NO_VALUES) for key in touched]
+    n_past = sum(len(ring) for ring in past)
+    codes = np.concatenate([np.repeat(np.arange(len(touched)), [len(ring) for ring in past]), key_codes])
+    values = np.concatenate(past + [amounts])
+    # Group by group, oldest first: a row's window is the W entries before it in its run
+    order = np.argsort(codes, kind="stable")
+    codes_sorted, values_sorted = codes[order], values[order]
+    run_start = np.searchsorted(codes_sorted, codes_sorted, side="left")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    result = np.full(len(keys), np.nan)
+    rows = np.flatnonzero(wanted & (codes[n_past:] >= 0))
+    if len(rows):
+        at = rank[n_past + rows]
+        window = at[:, None] - ROLLING_WINDOW + np.arange(ROLLING_WINDOW)[None, :]
+        inside = window >= run_start[at][:, None]
+        samples = np.where(inside, values_sorted[np.clip(window, 0, None)], np.nan)
+        enough = inside.sum(axis=1) >= MIN_GROUP_SIZE
+        if enough.any():
+            result[rows[enough]] = _row_quantile(samples[enough], ROLLING_QUANTILE)
+
+    # Keep the last W amounts of every touched group
+    keyed = codes_sorted >= 0
+    run_end = np.searchsorted(codes_sorted, codes_sorted, side="right")
+    tail = keyed & (run_end - np.arange(len(order)) <= ROLLING_WINDOW)
+    tail_codes, tail_values = codes_sorted[tail], values_sorted[tail]
+    if len(tail_values):  # every touched group has a run, in code order
+        for key, ring in zip(touched, np.split(tail_values, np.flatnonzero(np.diff(tail_codes)) + 1)):
+            rings[key] = ring
+    return result
+
+
+def _row_quantile(samples: np.ndarray, q: float) -> np.ndarray:
+    """Linear‑interpolated **q** quantile of each row, ignoring NaN (``np.nanquantile`` loops over rows)."""
+    ordered = np.sort(samples, axis=1)  # NaN last
+    position = q * (np.isfinite(ordered).sum(axis=1) - 1)
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, ordered.shape[1] - 1)
+    below = np.take_along_axis(ordered, lo[:, None], axis=1)[:, 0]
+    above = np.take_along_axis(ordered, hi[:, None], axis=1)[:, 0]
+    fraction = position - lo
+    return np.where(fraction > 0, below + (above - below) * fraction, below)
+
+
+def _robust_z(values: np.ndarray, median, mad, *, floor: float = 1.0) -> np.ndarray:
+    """One‑sided robust z‑score; the scale never drops below **floor** or 10 % of the median."""
+    scale = np.fmax(_MAD_SCALE * np.asarray(mad, dtype=float), np.fmax(0.1 * np.abs(median), floor))
+    with np.errstate(invalid="ignore"):
+        return np.nan_to_num((values - median) / scale, nan=0.0)
+
+
+def _stamps(df: pd.DataFrame) -> np.ndarray:
+    return df["transactionTimestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def _duplicate_mask(df: pd.DataFrame, window_ns: int) -> np.ndarray:
+    """Rows repeating an earlier charge (merchant, amount, currency) within **window_ns**."""
+    mask = np.zeros(len(df), dtype=bool)
+    if len(df) < 2:
+        return mask
+    merchant, _ = pd.factorize(df["merchantUid"])
+    currency, _ = pd.factorize(df["currency"])
+    amount = df["amount"].to_numpy(dtype=float)
+    merchant[~np.isfinite(amount)] = -1  # no amount, nothing to compare
+    cents = np.round(np.nan_to_num(amount) * 100).astype(np.int64)
+    stamps = _stamps(df)
+    order = np.lexsort((stamps, cents, currency, merchant))
+    m, c, cur, s = merchant[order], cents[order], currency[order], stamps[order]
+    repeat = (
+        (m[1:] == m[:-1]) & (m[1:] >= 0) & (c[1:] == c[:-1])
+        & (cur[1:] == cur[:-1]) & (s[1:] - s[:-1] <= window_ns)
+    )
+    mask[order[1:][repeat]] = True
+    return mask
@@ -0,0 +1,193 @@
+"""answers.py – answer common finance questions locally, without the LLM
+========================================================================
+
+Questions such as *"What did I spend the most on this month?"* are plain
+aggregations over the dataset.  :func:`answer_locally` routes them to the
+aggregate cube / month index and returns a deterministic Markdown reply; it
+returns ``None`` for anything open‑ended so the caller falls back to the model.
+
+The handlers only know the period selected in the dashboard, so a question
+that names its own scope – a month, year or date, a relative period such as
+*last year*, a merchant (*at Lidl*) or *all time* – is left to the model too
+rather than answered for the wrong rows.
+
+Usage (inside app.py)
+---------------------
+```python
+reply = answer_locally(question, dataset, selected_month)
+if reply is None:
+    ...  # ask the model
+```
+"""
+from __future__ import annotations
+
+import re
+from typing import Callable, List, Match, Optional, Pattern, Tuple
+
+import pandas as pd
+
+from dataset import TransactionDataset, period_label
+from fx import BASE_CURRENCY
+
+TOP_N_TRANSACTIONS = 5
+_MONTH = re.compile(r"^\d{4}-\d{2}$")
+MAX_TRANSACTIONS_LISTED = 50
+
+Handler = Callable[[TransactionDataset, str, Match[str]], Optional[str]]
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def answer_locally(
+    question: str, dataset: TransactionDataset, selected_month: Optional[str]
+) -> Optional[str]:
+    """Return a ready reply for a recognised aggregation question, else ``None``.
+
+    **selected_month** may be any period string understood by
+    :meth:`TransactionDataset.bounds` (month, ``last-30d``, custom range).
+    """
+    if not question or not selected_month or dataset.empty:
+        return None
+    text = question.casefold()
+    for pattern, handler in _INTENTS:
+        match = pattern.search(text)
+        if match:
+            if _names_scope(text, handler):
+                return None  # the question is about other rows than the selected period's
+            return handler(dataset, selected_month, match)  # None: let the model answer
+    return None
+
+
+# ----------------------------------------------------------------------------------
+# Intent handlers
+# ----------------------------------------------------------------------------------
+
+def _top_category(dataset: TransactionDataset, month: str, match: Match[str]) -> str:
+    totals = dataset.category_totals(month)
+    if totals.empty:
+        return f"I couldn't find any transactions in {_month_label(month)}."
+    currency = BASE_CURRENCY
+    grand_total = totals.sum()
+    if not grand_total > 0:  # only refunds / zero amounts: shares would be nan%
+        return f"There was no spending in {_month_label(month)}."
+    lines = [
+        f"In {_month_label(month)} you spent the most on **{totals.index[0]}**: "
+        f"{_money(totals.iloc[0], currency)} ({totals.iloc[0] / grand_total:.0%} of "
+        f"{_money(grand_total, currency)}).",
+        "",
+        "| Category | Spent | Share |",
+        "|---|---:|---:|",
+    ]
+    for name, value in totals.head(5).items():
+        lines.append(f"| {name} | {_money(value, currency)} | {value / grand_total:.0%} |")
+    return "\n".join(lines)
+
+
+def _largest_transactions(dataset: TransactionDataset, month: str, match: Match[str]) -> str:
+    month_df = dataset.month_frame(month)
+    if month_df.empty:
+        return f"I couldn't find any transactions in {_month_label(month)}."
+    n = int(match.group("n")) if match.group("n") else TOP_N_TRANSACTIONS
+    top = month_df.nlargest(min(max(n, 1), MAX_TRANSACTIONS_LISTED), "amount_base")
+    lines = [
+        f"Your {len(top)} largest transactions in {_month_label(month)}:",
+        "",
+        "| Date | Merchant | Category | Amount |",
+        "|---|---|---|---:|",
+    ]
+    for stamp, merchant, category, amount, currency in zip(
+        top["transactionTimestamp"], top["merchant"], top["category"], top["amount"], top["currency"]
+    ):
+        lines.append(f"| {stamp:%b %d} | {merchant} | {category} | {_money(amount, currency)} |")
+    return "\n".join(lines)
+
+
+def _compare_previous(dataset: TransactionDataset, month: str, match: Match[str]) -> Optional[str]:
+    if not _MONTH.match(month):
+        return None
+    previous = str(pd.Period(month, freq="M") - 1)
+    current_total = dataset.cube.month_summary(month)["total"]
+    previous_total = dataset.cube.month_summary(previous)["total"]
+    currency = BASE_CURRENCY
+    if not previous_total:
+        return (
+            f"You spent {_money(current_total, currency)} in {_month_label(month)}, "
+            f"but there are no transactions in {_month_label(previous)} to compare with."
+        )
+    change = current_total - previous_total
+    direction = "more" if change > 0 else "less"
+    lines = [
+        f"You spent {_money(current_total, currency)} in {_month_label(month)} vs "
+        f"{_money(previous_total, currency)} in {_month_label(previous)} – "
+        f"{_money(abs(change), currency)} {direction} ({change / previous_total:+.0%}).",
+    ]
+    deltas = (
+        dataset.cube.category_totals(month)
+        .sub(dataset.cube.category_totals(previous), fill_value=0)
+    )
+    deltas = deltas[deltas != 0]
+    if not deltas.empty:
+        lines += ["", "Biggest changes by category:", "", "| Category | Change |", "|---|---:|"]
+        for name, value in deltas.reindex(deltas.abs().sort_values(ascending=False).index).head(5).items():
+            sign = "+" if value > 0 else "−"
+            lines.append(f"| {name} | {sign}{_money(abs(value), currency)} |")
+    return "\n".join(lines)
+
+
+def _month_total(dataset: TransactionDataset, month: str, match: Match[str]) -> str:
+    summary = dataset.summary(month)
+    if not summary["count"]:
+        return f"I couldn't find any transactions in {_month_label(month)}."
+    currency = BASE_CURRENCY
+    return (
+        f"In {_month_label(month)} you spent {_money(summary['total'], currency)} across "
+        f"{summary['count']:,} transactions (largest {_money(summary['max'], currency)}, "
+        f"smallest {_money(summary['min'], currency)})."
+    )
+
+
+# Checked in order; first match wins
+_INTENTS: List[Tuple[Pattern[str], Handler]] = [
+    (re.compile(r"\b(compare|compared|vs\.?|versus)\b.*\b(last|previous|prior)\s+month\b"
+                r"|\b(last|previous|prior)\s+month\b.*\b(compare|vs\.?|versus)\b"), _compare_previous),
+    (re.compile(r"\b(largest|biggest|most expensive|top)\s+(?:(?P<n>\d+)\s+)?(transactions?|purchases?|payments?)\b"),
+     _largest_transactions),
+    (re.compile(r"\b(spend|spent)\s+(the\s+)?most\s+on\b|\b(top|biggest|largest)\s+(spending\s+)?categor"),
+     _top_category),
+    (re.compile(r"\bhow much\b.*\b(spend|spent)\b(?!.*\bon\b)"), _month_total),
+]
+
+
+# A period, merchant or "all time" the question picks itself; "this month" means the selected one
+_SELECTED = r"(?:this|the\s+selected|the\s+current|current|selected)\s+(?:month|period)\b"
+_SCOPE = re.compile(
+    r"\b(?:19|20)\d{2}\b|\b\d{1,2}[./-]\d{1,2}\b"
+    r"|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b|\bin\s+may\b|\bmay\s+\d"
+    r"|\b(?:last|previous|prior|past|next)\s+(?:\d+\s+)?(?:days?|weeks?|months?|years?|quarters?)\b"
+    r"|\b(?:yesterday|today|tonight|days|weeks?|weekends?|months|years?|quarters?|ytd|annual|yearly"
+    r"|monthly|weekly|daily|per|each|every|ever|overall|lifetime|all[\s-]+time|so\s+far)\b"
+    r"|\b(?:at|from|with|for|during|since|before|after|between|until|till)\s+(?!" + _SELECTED + r")\w"
+)
+_COMPARED_MONTH = re.compile(r"\b(?:last|previous|prior)\s+month\b")
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _names_scope(text: str, handler: Handler) -> bool:
+    """Does **text** ask about another period or a merchant than the selected period's rows?"""
+    if handler is _compare_previous:
+        text = _COMPARED_MONTH.sub(" ", text)  # the month it compares with is part of the intent
+    return bool(_SCOPE.search(text))
+
+
+def _month_label(month: str) -> str:
+    label = period_label(month)
+    return f"the {label.lower()}" if label.startswith("Last ") else label
+
+
+def _money(value: float, currency: str) -> str:
+    return f"{float(value):,.2f} {currency}".strip()
@@ -5,44 +5,79 @@ from datetime import datetime
 import calendar
 from dotenv import load_dotenv
 load_dotenv()
+import numpy as np
 import pandas as pd
 import dash
-from dash import dcc, html, Input, Output, State, callback_context, MATCH, ALL
+from flask import jsonify
+from dash import dcc, html, Input, Output, State, Patch, callback_context, MATCH, ALL
 from dash_echarts import DashECharts
 import dash_bootstrap_components as dbc
-# from backend import generate_ai_response  # Uncomment if backend.py exists
+from dataset import RANGE_PRESETS, period_label
+from tenants import DEFAULT_TENANT, TENANT_DIR, TenantCache, partition_loader
+from backend import astream_ai_response, asummarize_conversation, prewarm_responses, summarize_conversation
+from history import ConversationMemory
+import chat_jobs
+from context import build_extra_context
+from answers import answer_locally
+from tools import TransactionTools
+from maps import map_locations, maps_enabled, prefetch_maps, register_routes, static_map_url
+import logos
+from logos import logo_url
+from fx import BASE_CURRENCY
+from anomalies import describe
+from geo import LEVELS, WORLD, tile_bbox, tile_grid
 import random
+import threading
 
 # 1. Initialize Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# WSGI entry point for production: `gunicorn app:server` (see gunicorn.conf.py)
+server = app.server
 
-# 2. Load your data
-try:
-    df = pd.read_csv('Tapix enriched data sample')
-except FileNotFoundError:
-    df = pd.DataFrame(columns=[
-        'date', 'amount', 'category', 'merchant', 'currency', 'tags',
-        'merchant_logo', 'category_logo', 'address', 'lat', 'long',
-        'co2FootprintValue', 'co2FootprintUnit', 'url'
-    ])
-    df['month'] = pd.Series(dtype='str')
+# 2. Load your data (parsed once, then memory-mapped from the Arrow cache)
+DATA_PATH = Path(os.getenv("TAPIX_DATA_PATH", Path(__file__).with_name("Tapix enriched data sample.csv")))
+# Let the model query the full history through function calling (0 = inline rows instead)
+AI_TOOLS = os.getenv("TAPIX_AI_TOOLS", "1") == "1"
+# Each user's dataset (+ query tools), loaded on demand into a memory-bounded LRU
+tenants = TenantCache(partition_loader(TENANT_DIR, DATA_PATH), toolbox_factory=TransactionTools if AI_TOOLS else None)
+# Loaded at import, so under gunicorn the master's copy is shared by all workers
+default_dataset = tenants.get(DEFAULT_TENANT).dataset
+
+@server.route("/metrics/tenants")
+def tenant_metrics():
+    """Hit/miss/eviction counters and resident size of the tenant LRU (per worker)."""
+    return jsonify(tenants.stats())
+
+# Static map images for the transaction modal, served from a disk cache (only the user's own shops)
+register_routes(server, lambda lat, long: (lat, long) in map_locations(tenants.current().dataset))
+# Logo thumbnails, resolved against the requesting user's dataset
+logos.register_routes(server, lambda kind, key: logos.logo_sources(tenants.current().dataset).get((kind, key)))
+# Last turns verbatim + rolling summary of older ones, shared by all sessions
+memory = ConversationMemory(summarize_conversation, asummarize_conversation)
 
 # 3. Define variables before layout
-if not df.empty:
-    default_month = df['month'].max()
-else:
-    default_month = "2024-01"
-
-month_options = [
-    {"label": "January 2024", "value": "2024-01"},
-    {"label": "February 2024", "value": "2024-02"},
-    # Add more months as needed
-]
+def latest_month(dataset):
+    """The period a page opens on: the dataset's latest month."""
+    return dataset.months()[-1] if not dataset.empty else "2024-01"
+
+def period_options(dataset):
+    """Rolling windows first, then every month present in **dataset**, newest first."""
+    return [
+        {"label": period_label(p), "value": p} for p in RANGE_PRESETS
+    ] + [
+        {"label": period_label(m), "value": m} for m in reversed(dataset.months())
+    ]
 
 initial_chat = [
     {"role": "assistant", "content": "Hello! I'm your AI finance assistant. How can I help you analyze your spending today?"}
 ]
 
+# How often the chat polls a streaming reply for new tokens
+STREAM_POLL_MS = int(os.getenv("TAPIX_STREAM_POLL_MS", "150"))
+
+# Transactions rendered per page of the transaction list
+TX_PAGE_SIZE = int(os.getenv("TAPIX_TX_PAGE_SIZE", "25"))
+
 suggested_questions = [
     "What did I spend the most on this month?",
     "Show me my largest transactions",
@@ -50,181 +85,265 @@ suggested_questions = [
     "What categories should I focus on reducing?"
 ]
 
+def _prewarm_suggested_questions():
+    """Answer every month's suggested questions ahead of time into the reply cache.
+
+    Questions :func:`answer_locally` handles never reach the model, so they are skipped.
+    """
+    tenant = tenants.get(DEFAULT_TENANT)
+    dataset = tenant.dataset
+    def conversations():
+        for month in dataset.months():
+            questions = [q for q in suggested_questions if answer_locally(q, dataset, month) is None]
+            if not questions:
+                continue
+            extra_context = build_extra_context(dataset, month, include_transactions=not AI_TOOLS)
+            for q in questions:
+                yield initial_chat + [{"role": "user", "content": q}], extra_context
+    prewarm_responses(conversations(), tools=tenant.toolbox)
+
+def start_prewarm():
+    """Prewarm in the background if ``TAPIX_PREWARM_SUGGESTED=1`` (once per server)."""
+    if os.getenv("TAPIX_PREWARM_SUGGESTED") == "1" and not default_dataset.empty:
+        threading.Thread(target=_prewarm_suggested_questions, name="prewarm-suggested", daemon=True).start()
+
 # 4. (Optional) Reminder for CSS
 # Make sure you have your glassmorphism styles in assets/styles.css
 
 from dash import html
 # Add a dcc.Store to track dropdown open/close and selected value
-_layout = html.Div([
-    html.Div([
-        html.Div(className="orb orb-1"),
-        html.Div(className="orb orb-2"),
-        html.Div(className="orb orb-3"),
-    ], className="glass-background", **{"aria-hidden": "true"}),
-    dcc.Store(id="month-dropdown-store", data={"open": False, "value": default_month}),
-    dcc.Store(id="theme-store", data="light"),
-    dcc.Store(id="selected-transaction"),
-    html.Div([
-        dbc.Container([
-            dbc.Row([
-                # Quick Snapshot Sidebar (left)
-                dbc.Col([
-                    html.Div([
+def serve_layout():
+    """Page layout, built per request so the period list is the requesting user's."""
+    dataset = tenants.current().dataset
+    default_month = latest_month(dataset)
+    month_options = period_options(dataset)
+    stamps = dataset.df["transactionTimestamp"]
+    first_day, last_day = (f"{stamps.iloc[0]:%Y-%m-%d}", f"{stamps.iloc[-1]:%Y-%m-%d}") if len(stamps) else (None, None)
+    return html.Div([
+        html.Div([
+            html.Div(className="orb orb-1"),
+            html.Div(className="orb orb-2"),
+            html.Div(className="orb orb-3"),
+        ], className="glass-background", **{"aria-hidden": "true"}),
+        dcc.Store(id="month-dropdown-store", data={"open": False, "value": default_month}),
+        dcc.Store(id="theme-store", data="light"),
+        dcc.Store(id="selected-transaction"),
+        html.Div([
+            dbc.Container([
+                dbc.Row([
+                    # Quick Snapshot Sidebar (left)
+                    dbc.Col([
                         html.Div([
-                            html.H3("Quick Snapshot", className="glass-metrics-heading", style={"fontSize": "2.5rem", "textAlign": "left", "margin": 0}),
                             html.Div([
+                                html.H3("Quick Snapshot", className="glass-metrics-heading", style={"fontSize": "2.5rem", "textAlign": "left", "margin": 0}),
                                 html.Div([
-                                    html.Span([
-                                        next((o["label"] for o in month_options if o["value"] == default_month), default_month),
-                                        html.Span(
-                                            html.Span("", id="month-chevron", style={"display": "inline-block", "marginLeft": "0.7em", "transition": "transform 0.3s"}),
-                                            style={"display": "inline-block", "verticalAlign": "middle"}
-                                        )
-                                    ], id="month-dropdown-selected", n_clicks=0, style={
-                                        "background": "rgba(255,255,255,0.15)",
-                                        "backdropFilter": "blur(10px)",
-                                        "borderRadius": "16px",
-                                        "padding": "16px 20px",
-                                        "fontWeight": 500,
-                                        "color": "#fff",
-                                        "border": "1.5px solid rgba(255,255,255,0.2)",
-                                        "boxShadow": "0 2px 8px rgba(56,217,150,0.10)",
-                                        "cursor": "pointer",
-                                        "outline": "none",
-                                        "position": "relative",
-                                        "width": "100%",
-                                        "transition": "all 0.3s ease"
-                                    }),
-                                    html.Ul([
-                                        html.Li(o["label"], id={"type": "month-dropdown-option", "value": o["value"]}, n_clicks=0, style={
-                                            "padding": "12px 20px",
-                                            "fontSize": "18px",
+                                    html.Div([
+                                        html.Span([
+                                            next((o["label"] for o in month_options if o["value"] == default_month), default_month),
+                                            html.Span(
+                                                html.Span("", id="month-chevron", style={"display": "inline-block", "marginLeft": "0.7em", "transition": "transform 0.3s"}),
+                                                style={"display": "inline-block", "verticalAlign": "middle"}
+                                            )
+                                        ], id="month-dropdown-selected", n_clicks=0, style={
+                                            "background": "rgba(255,255,255,0.15)",
+                                            "backdropFilter": "blur(10px)",
+                                            "borderRadius": "16px",
+                                            "padding": "16px 20px",
+                                            "fontWeight": 500,
                                             "color": "#fff",
-                                            "background": "rgba(40,60,90,0.85)",
-                                            "borderBottom": "1px solid rgba(255,255,255,0.08)",
+                                            "border": "1.5px solid rgba(255,255,255,0.2)",
+                                            "boxShadow": "0 2px 8px rgba(56,217,150,0.10)",
                                             "cursor": "pointer",
-                                            "transition": "background 0.2s, color 0.2s",
-                                            "fontWeight": 500
-                                        }) for o in month_options
-                                    ], id="month-dropdown-list", style={
-                                        "position": "absolute",
-                                        "top": "calc(100% + 6px)",
-                                        "left": 0,
-                                        "right": 0,
-                                        "zIndex": 100,
-                                        "background": "rgba(40,60,90,0.97)",
-                                        "borderRadius": "16px",
-                                        "boxShadow": "0 8px 32px rgba(56,217,150,0.10)",
-                                        "border": "1.5px solid #a5d8ff",
-                                        "overflowY": "auto",
-                                        "maxHeight": "260px",
-                                        "margin": 0,
-                                        "padding": 0,
-                                        "pointerEvents": "none",
-                                        "transition": "opacity 0.3s, transform 0.3s",
-                                        "transform": "translateY(-10px)"
-                                    }, **{"data-simplebar": "true"})
-                                ], style={"position": "relative", "width": "100%"})
-                            ], id="month-dropdown-container", style={"width": "100%", "marginBottom": "0", "textAlign": "left", "paddingTop": 0})
-                        ], style={"marginLeft": "auto"})
-                        ], style={"display": "flex", "flexDirection": "row", "alignItems": "center", "justifyContent": "space-between", "marginBottom": "1.2em", "width": "100%"}),
-                        html.Div([
-                            html.Div(id="stats-block", style={"flex": "0 0 auto", "margin": 0, "padding": 0}),
+                                            "outline": "none",
+                                            "position": "relative",
+                                            "width": "100%",
+                                            "transition": "all 0.3s ease"
+                                        }),
+                                        html.Ul([
+                                            html.Li(o["label"], id={"type": "month-dropdown-option", "value": o["value"]}, n_clicks=0, style={
+                                                "padding": "12px 20px",
+                                                "fontSize": "18px",
+                                                "color": "#fff",
+                                                "background": "rgba(40,60,90,0.85)",
+                                                "borderBottom": "1px solid rgba(255,255,255,0.08)",
+                                                "cursor": "pointer",
+                                                "transition": "background 0.2s, color 0.2s",
+                                                "fontWeight": 500
+                                            }) for o in month_options
+                                        ], id="month-dropdown-list", style={
+                                            "position": "absolute",
+                                            "top": "calc(100% + 6px)",
+                                            "left": 0,
+                                            "right": 0,
+                                            "zIndex": 100,
+                                            "background": "rgba(40,60,90,0.97)",
+                                            "borderRadius": "16px",
+                                            "boxShadow": "0 8px 32px rgba(56,217,150,0.10)",
+                                            "border": "1.5px solid #a5d8ff",
+                                            "overflowY": "auto",
+                                            "maxHeight": "260px",
+                                            "margin": 0,
+                                            "padding": 0,
+                                            "pointerEvents": "none",
+                                            "transition": "opacity 0.3s, transform 0.3s",
+                                            "transform": "translateY(-10px)"
+                                        }, **{"data-simplebar": "true"})
+                                    ], style={"position": "relative", "width": "100%"})
+                                ], id="month-dropdown-container", style={"width": "100%", "marginBottom": "0", "textAlign": "left", "paddingTop": 0})
+                            ], style={"marginLeft": "auto"})
+                            ], style={"display": "flex", "flexDirection": "row", "alignItems": "center", "justifyContent": "space-between", "marginBottom": "1.2em", "width": "100%"}),
+                            # Custom from/to range, written into the period store as YYYY-MM-DD..YYYY-MM-DD
+                            dcc.DatePickerRange(
+                                id="period-date-range",
+                                min_date_allowed=first_day,
+                                max_date_allowed=last_day,
+                                initial_visible_month=last_day,
+                                start_date_placeholder_text="From",
+                                end_date_placeholder_text="To",
+                                display_format="MMM D, YYYY",
+                                clearable=True,
+                                style={"marginBottom": "1.2em"},
+                            ),
                             html.Div([
-                                # pie_chart reference removed from top-level layout
-                            ], id="pie-block", style={
-                                "width": "100%",
-                                "height": "100%",
-                                "minHeight": "320px",
-                                "flex": 1,
-                                "boxSizing": "border-box",
-                                "display": "flex",
-                                "flexDirection": "column",
-                                "overflow": "visible",
-                                "background": "rgba(30,41,59,0.95)",
-                                "borderRadius": "1em",
-                                "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
-                                "border": "1px solid rgba(56,217,150,0.2)"
-                            }),
-                        ], style={"display": "flex", "flexDirection": "column", "height": "100%", "flex": 1}),
-                    ], className="glass-metrics", style={
-                        "padding": "1em",
+                                html.Div(id="stats-block", style={"flex": "0 0 auto", "margin": 0, "padding": 0}),
+                                html.Div([
+                                    # pie_chart reference removed from top-level layout
+                                ], id="pie-block", style={
+                                    "width": "100%",
+                                    "height": "100%",
+                                    "minHeight": "320px",
+                                    "flex": 1,
+                                    "boxSizing": "border-box",
+                                    "display": "flex",
+                                    "flexDirection": "column",
+                                    "overflow": "visible",
+                                    "background": "rgba(30,41,59,0.95)",
+                                    "borderRadius": "1em",
+                                    "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
+                                    "border": "1px solid rgba(56,217,150,0.2)"
+                                }),
+                            ], style={"display": "flex", "flexDirection": "column", "height": "100%", "flex": 1}),
+                        ], className="glass-metrics", style={
+                            "padding": "1em",
+                            "display": "flex",
+                            "flexDirection": "column",
+                            "justifyContent": "flex-start",
+                            "flex": 1,
+                            "height": "100%",
+                            "width": "100%",
+                            "boxSizing": "border-box",
+                            "marginBottom": 0
+                        })
+                    ],
+                    style={
+                        "background": "rgba(30,41,59,0.95)",
+                        "borderRadius": "1em",
+                        "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
+                        "flex": 1,
                         "display": "flex",
                         "flexDirection": "column",
-                        "justifyContent": "flex-start",
-                        "flex": 1,
                         "height": "100%",
-                        "width": "100%",
-                        "boxSizing": "border-box",
-                        "marginBottom": 0
-                    })
-                ],
-                style={
-                    "background": "rgba(30,41,59,0.95)",
-                    "borderRadius": "1em",
-                    "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
-                    "flex": 1,
-                    "display": "flex",
-                    "flexDirection": "column",
-                    "height": "100%",
-                    "minWidth": "350px",
-                    "padding": "2.5em 2em 2em 2em"
-                }),
-                # Chat container (middle)
-                dbc.Col([
-                    dcc.Store(id="chat-store", data=initial_chat),
-                    dcc.Store(id="loading-store", data=False),
-                    html.Div([
-                        html.Div(id="chat-history", style={"padding": "2vw", "height": "60vh", "minHeight": "250px", "maxHeight": "70vh", "overflowY": "auto", "background": "transparent", "fontSize": "1.2em", "wordBreak": "break-word"}),
+                        "minWidth": "350px",
+                        "padding": "2.5em 2em 2em 2em"
+                    }),
+                    # Chat container (middle)
+                    dbc.Col([
+                        dcc.Store(id="chat-store", data=initial_chat),
+                        dcc.Store(id="loading-store", data=False),
+                        dcc.Store(id="stream-store"),
+                        dcc.Store(id="stream-text-store", data=""),
+                        dcc.Interval(id="stream-interval", interval=STREAM_POLL_MS, disabled=True),
                         html.Div([
-                            dbc.Row([
-                                dbc.Col([
-                                    dcc.Textarea(id="chat-input", placeholder="Type your question and press Enter...", className="glass-input", style={"width": "100%", "height": "2.5em", "resize": "none", "minHeight": "2em", "maxHeight": "6em", "fontSize": "1.1em", "padding": "0.5em"}, title="Chat input"),
-                                ], width=9),
-                                dbc.Col([
-                                    dbc.Button([
-                                        html.Span("✈️", className="send-icon", style={"marginRight": "0.5em", "fontSize": "1.2em"}),
-                                        "Send"
-                                    ], id="send-btn", color="primary", n_clicks=0, className="glass-button", style={"width": "100%", "height": "2.5em", "minHeight": "2em", "maxHeight": "6em", "fontSize": "1.1em", "padding": "0.5em"}, title="Send message")
-                                ], width=3)
-                            ], style={"margin": "0 2rem 2rem 2rem"}),
+                            dcc.Store(id="chat-rendered-store", data=0),
+                            html.Div([
+                                html.Div(id="chat-messages"),
+                                html.Div(id="chat-pending"),
+                            ], id="chat-history", style={"padding": "2vw", "height": "60vh", "minHeight": "250px", "maxHeight": "70vh", "overflowY": "auto", "background": "transparent", "fontSize": "1.2em", "wordBreak": "break-word"}),
                             html.Div([
-                                dbc.Button(q, id={"type": "suggested-btn", "index": i}, n_clicks=0, className="glass-button glass-pill suggested-btn", style={"marginRight": "0.5rem", "marginBottom": "0.5rem", "fontSize": "1.18em", "minWidth": "220px", "padding": "0.7em 1.2em", "whiteSpace": "normal", "wordBreak": "break-word"}, title=f"Suggested question: {q}")
-                                for i, q in enumerate(suggested_questions)
-                            ], className="suggested-btn-row", style={"margin": "0 2vw 1vw 2vw", "display": "flex", "flexWrap": "wrap"}),
-                        ]),
-                    ], className="glass-card", style={
+                                dbc.Row([
+                                    dbc.Col([
+                                        dcc.Textarea(id="chat-input", placeholder="Type your question and press Enter...", className="glass-input", style={"width": "100%", "height": "2.5em", "resize": "none", "minHeight": "2em", "maxHeight": "6em", "fontSize": "1.1em", "padding": "0.5em"}, title="Chat input"),
+                                    ], width=9),
+                                    dbc.Col([
+                                        dbc.Button([
+                                            html.Span("✈️", className="send-icon", style={"marginRight": "0.5em", "fontSize": "1.2em"}),
+                                            "Send"
+                                        ], id="send-btn", color="primary", n_clicks=0, className="glass-button", style={"width": "100%", "height": "2.5em", "minHeight": "2em", "maxHeight": "6em", "fontSize": "1.1em", "padding": "0.5em"}, title="Send message")
+                                    ], width=3)
+                                ], style={"margin": "0 2rem 2rem 2rem"}),
+                                html.Div([
+                                    dbc.Button(q, id={"type": "suggested-btn", "index": i}, n_clicks=0, className="glass-button glass-pill suggested-btn", style={"marginRight": "0.5rem", "marginBottom": "0.5rem", "fontSize": "1.18em", "minWidth": "220px", "padding": "0.7em 1.2em", "whiteSpace": "normal", "wordBreak": "break-word"}, title=f"Suggested question: {q}")
+                                    for i, q in enumerate(suggested_questions)
+                                ], className="suggested-btn-row", style={"margin": "0 2vw 1vw 2vw", "display": "flex", "flexWrap": "wrap"}),
+                            ]),
+                        ], className="glass-card", style={
+                            "background": "rgba(30,41,59,0.95)",
+                            "borderRadius": "1em",
+                            "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
+                            "flex": 1,
+                            "display": "flex",
+                            "flexDirection": "column",
+                            "height": "100%"
+                        })
+                    ],
+                    style={
                         "background": "rgba(30,41,59,0.95)",
                         "borderRadius": "1em",
                         "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
                         "flex": 1,
                         "display": "flex",
                         "flexDirection": "column",
-                        "height": "100%"
-                    })
-                ],
-                style={
-                    "background": "rgba(30,41,59,0.95)",
-                    "borderRadius": "1em",
-                    "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
-                    "flex": 1,
-                    "display": "flex",
-                    "flexDirection": "column",
-                    "height": "100%",
-                    "minWidth": "350px",
-                    "padding": "2.5em 2em 2em 2em"
-                }),
-                # Transaction history (right)
-                dbc.Col([
-                    html.Div([
-                        html.H3("Transactions", className="glass-metrics-heading", style={"marginTop": "1.5rem", "fontSize": "2.5rem", "textAlign": "left", "paddingLeft": "1.2em"}),
-                        html.Div(id="transaction-list-block", style={
-                            "height": "100%",
-                            "overflowY": "auto",
+                        "height": "100%",
+                        "minWidth": "350px",
+                        "padding": "2.5em 2em 2em 2em"
+                    }),
+                    # Transaction history (right)
+                    dbc.Col([
+                        html.Div([
+                            html.Div([
+                                html.H3("Transactions", className="glass-metrics-heading", style={"marginTop": "1.5rem", "fontSize": "2.5rem", "textAlign": "left", "paddingLeft": "1.2em"}),
+                                html.Div([
+                                    dbc.Button("🗺 Map", id="spend-map-btn", n_clicks=0, className="glass-button", title="Where you spend"),
+                                    dbc.Button("🔁 Subscriptions", id="subscriptions-btn", n_clicks=0, className="glass-button", title="Recurring charges"),
+                                ], style={"display": "flex", "gap": "0.5em"}),
+                            ], style={"display": "flex", "alignItems": "center", "justifyContent": "space-between", "gap": "1em"}),
+                            html.Div([
+                                dcc.Input(
+                                    id="tx-search",
+                                    type="search",
+                                    debounce=True,
+                                    placeholder="Search merchants, tags, categories, streets…",
+                                    className="glass-input",
+                                    style={"flex": 2, "padding": "0.5em 1em", "fontSize": "1.1em"},
+                                ),
+                                # Options (with each tag's spend) follow the selected period
+                                dcc.Dropdown(id="tx-tag-filter", options=[], placeholder="All tags", clearable=True, style={"flex": 1, "minWidth": "12em"}),
+                            ], style={"display": "flex", "gap": "0.5em", "alignItems": "center", "margin": "0.5em 1.2em 0 1.2em"}),
+                            html.Div(id="transaction-list-block", style={
+                                "height": "100%",
+                                "overflowY": "auto",
+                                "display": "flex",
+                                "flexDirection": "column"
+                            }),
+                            dcc.Store(id="tx-page-store", data={"month": default_month, "query": "", "tag": None, "page": 0}),
+                            html.Div([
+                                dbc.Button("‹ Prev", id="tx-prev-btn", n_clicks=0, disabled=True, className="glass-button", title="Previous page"),
+                                html.Span(id="tx-page-label", style={"color": "#a5d8ff", "fontWeight": 600, "fontSize": "1.1em"}),
+                                dbc.Button("Next ›", id="tx-next-btn", n_clicks=0, disabled=True, className="glass-button", title="Next page"),
+                            ], id="tx-pager", style={"display": "flex", "alignItems": "center", "justifyContent": "space-between", "gap": "1em", "padding": "0.5em 1.2em 0 1.2em"}),
+                        ], className="glass-metrics", style={
+                            "background": "rgba(30,41,59,0.95)",
+                            "borderRadius": "1em",
+                            "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
+                            "flex": 1,
                             "display": "flex",
-                            "flexDirection": "column"
-                        }),
-                    ], className="glass-metrics", style={
+                            "flexDirection": "column",
+                            "height": "100%",
+                            "minWidth": "350px",
+                            "padding": "2.5em 2em 2em 2em"
+                        })
+                    ],
+                    style={
                         "background": "rgba(30,41,59,0.95)",
                         "borderRadius": "1em",
                         "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
@@ -235,55 +354,60 @@ _layout = html.Div([
                         "minWidth": "350px",
                         "padding": "2.5em 2em 2em 2em"
                     })
-                ],
-                style={
-                    "background": "rgba(30,41,59,0.95)",
-                    "borderRadius": "1em",
-                    "boxShadow": "0 8px 32px rgba(0,0,0,0.4)",
-                    "flex": 1,
+                ], style={
+                    "height": "90vh",
                     "display": "flex",
-                    "flexDirection": "column",
-                    "height": "100%",
-                    "minWidth": "350px",
-                    "padding": "2.5em 2em 2em 2em"
-                })
-            ], style={
-                "height": "90vh",
-                "display": "flex",
-                "alignItems": "stretch",
-                "gap": "3vw",
-                "padding": "2vw 0",
-                "maxWidth": "1600px",
-                "margin": "0 auto"
-            }),
-            # Transaction Details Modal (hidden by default)
-            dbc.Modal([
-                dbc.ModalHeader(dbc.ModalTitle("Transaction Details"), close_button=True),
-                dbc.ModalBody(id="transaction-details-body"),
-            ], id="transaction-details-modal", is_open=False, size="xl", centered=True, backdrop=True),
-        ])
-    ], id="theme-content")
-
-app.layout = _layout
+                    "alignItems": "stretch",
+                    "gap": "3vw",
+                    "padding": "2vw 0",
+                    "maxWidth": "1600px",
+                    "margin": "0 auto"
+                }),
+                # Transaction Details Modal (hidden by default)
+                dbc.Modal([
+                    dbc.ModalHeader(dbc.ModalTitle("Transaction Details"), close_button=True),
+                    dbc.ModalBody(id="transaction-details-body"),
+                ], id="transaction-details-modal", is_open=False, size="xl", centered=True, backdrop=True),
+                # Subscriptions Modal
+                dbc.Modal([
+                    dbc.ModalHeader(dbc.ModalTitle("Subscriptions"), close_button=True),
+                    dbc.ModalBody(id="subscriptions-body"),
+                ], id="subscriptions-modal", is_open=False, size="lg", centered=True, backdrop=True),
+                # Spending Map Modal (click a tile or brush an area to zoom in)
+                dbc.Modal([
+                    dbc.ModalHeader(dbc.ModalTitle("Spending Map"), close_button=True),
+                    dbc.ModalBody([
+                        html.Div([
+                            html.Div(id="spend-map-summary", style={"color": "#a5d8ff", "fontWeight": 600}),
+                            dbc.Button("Reset view", id="spend-map-reset-btn", n_clicks=0, className="glass-button", size="sm"),
+                        ], style={"display": "flex", "alignItems": "center", "justifyContent": "space-between", "marginBottom": "0.5em"}),
+                        DashECharts(id="spend-map", option={}, style={"width": "100%", "height": "60vh", "background": "transparent"}),
+                        dcc.Store(id="spend-map-view"),
+                    ]),
+                ], id="spend-map-modal", is_open=False, size="xl", centered=True, backdrop=True),
+            ])
+        ], id="theme-content")
+
+# Built per page load (see serve_layout), so each tenant gets its own months
+app.layout = serve_layout
 
 # Sidebar callbacks for stats and pie chart
 @app.callback(
     Output("stats-block", "children"),
     Output("pie-block", "children"),
-    Output("transaction-list-block", "children"),
     Input("month-dropdown-store", "data")
 )
 def update_sidebar(month_store):
     selected_month = month_store.get("value") if month_store else None
-    if not selected_month or df.empty:
-        return [html.P("No data available.")], [], []
-    # Use string comparison for month to match dropdown value
-    month_df = df[df["month"].astype(str) == selected_month]
-    month_total = month_df["amount"].sum()
-    top_cat = month_df.groupby("category")["amount"].sum().sort_values(ascending=False).head(1)
-    top_cat_name = str(top_cat.index[0]) if not top_cat.empty else "–"
-    # Localized currency formatting for sidebar
-    sidebar_currency = month_df["currency"].iloc[0] if not month_df.empty else "USD"
+    dataset = tenants.current().dataset
+    if not selected_month or dataset.empty:
+        return [html.P("No data available.")], []
+    month_summary = dataset.summary(selected_month)
+    cat_summary = dataset.category_totals(selected_month)
+    month_total = month_summary["total"]
+    top_cat_name = str(cat_summary.index[0]) if not cat_summary.empty else "–"
+    # Localized currency formatting for sidebar (totals are converted to the base currency)
+    sidebar_currency = BASE_CURRENCY
     currency_symbols = {
         "GBP": "£", "EUR": "€", "USD": "$", "CZK": "Kč", "PLN": "zł", "HUF": "Ft", "RON": "lei", "AUD": "$", "CAD": "$", "CHF": "Fr.", "SEK": "kr", "NOK": "kr", "DKK": "kr", "JPY": "¥", "CNY": "¥", "SGD": "$", "INR": "₹"
     }
@@ -302,13 +426,18 @@ def update_sidebar(month_store):
         dbc.Row([
             dbc.Col(html.Div([
                 html.Span("\ud83d\udcb8", className="sidebar-stat-icon", style={"fontSize": "2em", "marginRight": "0.5em"}),
-                html.Span("This Month's Spend", style={"fontWeight": 700, "fontSize": "1.3em", "color": "#fff"}),
+                html.Span("This Month's Spend" if selected_month in dataset.months() else "Period Spend", style={"fontWeight": 700, "fontSize": "1.3em", "color": "#fff"}),
             ], style={"display": "flex", "alignItems": "center"}), width=7, style={"display": "flex", "alignItems": "center"}),
             dbc.Col(html.Div([
                 html.Span(f"{sidebar_amount_str}", style={"fontWeight": 900, "fontSize": "2em", "color": "#38d996", "textAlign": "right", "marginRight": "0.2em", "display": "inline-block"}),
                 html.Span(symbol, style={"fontWeight": 900, "fontSize": "2em", "color": "#38d996", "textAlign": "right", "display": "inline-block"}),
             ], style={"textAlign": "right", "display": "flex", "alignItems": "center", "justifyContent": "flex-end"}), width=5, style={"display": "flex", "alignItems": "center", "justifyContent": "flex-end"})
         ], style={"marginBottom": "0.7em", "alignItems": "center"}),
+        # Rows in currencies without an FX rate are missing from the total, say so
+        html.Div(
+            f"⚠ {month_summary.get('unconverted', 0):,} transaction(s) without an FX rate to {BASE_CURRENCY} are not included",
+            style={"color": "#ffd43b", "fontSize": "0.95em", "marginBottom": "0.7em"},
+        ) if month_summary.get("unconverted") else None,
         dbc.Row([
             dbc.Col(html.Div([
                 html.Span("🛒", className="sidebar-stat-icon", style={"fontSize": "2em", "marginRight": "0.5em"}),
@@ -324,7 +453,17 @@ def update_sidebar(month_store):
                 html.Span("Transactions", style={"fontWeight": 700, "fontSize": "1.3em", "color": "#fff"}),
             ], style={"display": "flex", "alignItems": "center"}), width=7),
             dbc.Col(html.Div([
-                html.Span(f"{len(month_df):,}", style={"fontWeight": 900, "fontSize": "2em", "color": "#ffd6a5", "textAlign": "right"}),
+                html.Span(f"{month_summary['count']:,}", style={"fontWeight": 900, "fontSize": "2em", "color": "#ffd6a5", "textAlign": "right"}),
+            ], style={"textAlign": "right"}), width=5)
+        ], style={"marginBottom": "0.7em", "alignItems": "center"}),
+        dbc.Row([
+            dbc.Col(html.Div([
+                html.Span("🌱", className="sidebar-stat-icon", style={"fontSize": "2em", "marginRight": "0.5em"}),
+                html.Span("CO₂ Footprint", style={"fontWeight": 700, "fontSize": "1.3em", "color": "#fff"}),
+            ], style={"display": "flex", "alignItems": "center"}), width=7),
+            dbc.Col(html.Div([
+                html.Span(f"{month_summary['co2']:,.1f}", style={"fontWeight": 900, "fontSize": "2em", "color": "#b2f2bb", "textAlign": "right", "marginRight": "0.2em"}),
+                html.Span("kg", style={"fontWeight": 700, "fontSize": "1.2em", "color": "#b2f2bb"}),
             ], style={"textAlign": "right"}), width=5)
         ], style={"marginBottom": "0.7em", "alignItems": "center"})
     ]
@@ -334,8 +473,7 @@ def update_sidebar(month_store):
     ]
     pie_chart = html.Div()
     legend_block = html.Div()
-    if not month_df.empty:
-        cat_summary = month_df.groupby("category")['amount'].sum().sort_values(ascending=False)
+    if not cat_summary.empty:
         pie_data = [
             {"value": float(v), "name": str(k)} for k, v in zip(cat_summary.index, cat_summary.values)
         ]
@@ -357,7 +495,7 @@ def update_sidebar(month_store):
                 "formatter": (
                     '<div style="line-height:1.6; padding: 0.2em 0;">'
                     '<span style="font-weight:700; color:#fff; font-size:1.15em;">{b}</span><br>'
-                    '<span style="font-weight:700; color:#38d996; font-size:1.2em;">£{c:.2f}</span><br>'
+                    '<span style="font-weight:700; color:#38d996; font-size:1.2em;">' + symbol + '{c:.2f}</span><br>'
                     '<span style="font-size:1.05em; color:#a5d8ff; font-weight:500;">({d}% of total)</span>'
                     '</div>'
                 )
@@ -427,7 +565,7 @@ def update_sidebar(month_store):
                     "marginRight": "1.2em",
                     "fontFamily": "Inter, Arial, sans-serif"
                 }),
-                html.Span(f"£{d['value']:,.2f}", style={
+                html.Span(f"{symbol}{d['value']:,.2f}" if symbol in ["£", "€", "$", "¥", "₹"] else f"{d['value']:,.2f} {symbol}", style={
                     "color": "#38d996",
                     "fontWeight": 700,
                     "fontSize": "1.13em",
@@ -457,10 +595,34 @@ def update_sidebar(month_store):
             "boxShadow": "none",
             "border": "none"
         })
+    # Footprint per category, straight from the CO2 rollups
+    co2_chart = html.Div()
+    co2_by_category = dataset.co2_totals(selected_month).head(6)
+    if not co2_by_category.empty and co2_by_category.sum() > 0:
+        co2_option = {
+            "backgroundColor": "rgba(40,60,90,0.0)",
+            "title": {"text": "CO₂ by category (kg)", "left": "center", "textStyle": {"color": "#b2f2bb", "fontSize": 15, "fontWeight": 700}},
+            "tooltip": {"trigger": "axis", "axisPointer": {"type": "shadow"}, "valueFormatter": "{value} kg"},
+            "grid": {"left": "3%", "right": "6%", "top": 36, "bottom": 8, "containLabel": True},
+            "xAxis": {"type": "value", "axisLabel": {"color": "#a5d8ff"}, "splitLine": {"lineStyle": {"color": "rgba(255,255,255,0.08)"}}},
+            "yAxis": {"type": "category", "inverse": True, "data": [str(k) for k in co2_by_category.index], "axisLabel": {"color": "#fff", "fontWeight": 600}},
+            "series": [{
+                "type": "bar",
+                "data": [round(float(v), 2) for v in co2_by_category.values],
+                "itemStyle": {"color": "#38d996", "borderRadius": [0, 8, 8, 0]},
+                "barWidth": "60%",
+            }],
+        }
+        co2_chart = DashECharts(
+            option=co2_option,
+            style={"width": "100%", "height": "220px", "background": "transparent"},
+            id=f"echarts-co2-{selected_month}"
+        )
     # Wrap pie chart and legend in a single container for seamless look
     pie_block = html.Div([
         pie_chart,
-        legend_block
+        legend_block,
+        co2_chart
     ], style={
         "width": "100%",
         "background": "rgba(30,41,59,0.95)",
@@ -474,38 +636,116 @@ def update_sidebar(month_store):
         "justifyContent": "flex-start",
         "border": "none"
     })
-    # Transaction list (scrollable, show 5 at a time)
-    tx_rows = []
-    for idx, (_, row) in enumerate(month_df.reset_index(drop=True).iterrows()):
-        # Format tags as a clean, comma-separated list
-        tags = str(row['tags'])
-        tags = tags.strip('{}[]')
-        tags = tags.replace('"', '').replace("'", "")
-        tags = ', '.join([t.strip() for t in tags.split(',') if t.strip()])
-        tx_rows.append(
-            dbc.Button([
-                html.Img(src=row["merchant_logo"], style={"height": "2em", "width": "2em", "objectFit": "contain", "marginRight": "1em", "verticalAlign": "middle", "borderRadius": "8px", "background": "#fff"}),
-                html.Div([
-                    html.Div(row['merchant'], style={"fontWeight": 600, "fontSize": "1.1em"}),
-                    html.Div(f"{row['category']}", style={"fontSize": "1em", "color": "#a5d8ff"}),
-                ], style={"flex": 2}),
-                html.Div(f"{row['amount']} {row['currency']}", style={"flex": 1, "fontWeight": 500, "fontSize": "1.1em", "textAlign": "right", "marginRight": "1em"}),
-                html.Div(tags, style={"flex": 2, "fontStyle": "italic", "color": "#b2f2bb", "fontSize": "1em", "textAlign": "right"})
-            ],
-            id={"type": "transaction-btn", "index": idx},
-            n_clicks=0,
-            className="transaction-row-btn",
-            style={
-                "display": "flex", "alignItems": "center", "marginBottom": "0.5em", "background": "rgba(255,255,255,0.07)", "borderRadius": "8px", "padding": "1em 2em", "gap": "1em", "borderBottom": "1px solid rgba(255,255,255,0.10)", "width": "100%", "textAlign": "left"
-            })
+    return stats, pie_block
+
+# Tag filter options: the period's tags with their spend, largest first
+@app.callback(
+    Output("tx-tag-filter", "options"),
+    Input("month-dropdown-store", "data"),
+)
+def update_tag_filter_options(month_store):
+    selected_month = month_store.get("value") if month_store else None
+    tag_totals = tenants.current().dataset.tag_totals(selected_month)
+    return [
+        {"label": f"{tag} · {total:,.0f} {BASE_CURRENCY}", "value": tag}
+        for tag, total in tag_totals["total"].items()
+    ]
+
+# Transaction list: one page at a time, paged server-side through the month index,
+# through the tag index when a tag is picked, or through the search index while
+# the search box has a query (across all months)
+@app.callback(
+    Output("transaction-list-block", "children"),
+    Output("tx-page-store", "data"),
+    Output("tx-page-label", "children"),
+    Output("tx-prev-btn", "disabled"),
+    Output("tx-next-btn", "disabled"),
+    Input("month-dropdown-store", "data"),
+    Input("tx-search", "value"),
+    Input("tx-tag-filter", "value"),
+    Input("tx-prev-btn", "n_clicks"),
+    Input("tx-next-btn", "n_clicks"),
+    State("tx-page-store", "data"),
+)
+def update_transaction_list(month_store, query, tag, prev_clicks, next_clicks, page_store):
+    selected_month = month_store.get("value") if month_store else None
+    query = (query or "").strip()
+    tag = tag or None
+    page_store = page_store or {}
+    view = {"month": selected_month, "query": query, "tag": tag}
+    same_view = all(page_store.get(k) == v for k, v in view.items())
+    page = page_store.get("page", 0) if same_view else 0
+    trigger_id = callback_context.triggered[0]["prop_id"].split(".")[0] if callback_context.triggered else None
+    if trigger_id == "tx-prev-btn":
+        page -= 1
+    elif trigger_id == "tx-next-btn":
+        page += 1
+    dataset = tenants.current().dataset
+    month_label = period_label(selected_month)
+
+    def fetch(page):
+        if query:
+            return dataset.search(query, page, TX_PAGE_SIZE, tag=tag)
+        return dataset.tag_page(selected_month, tag, page, TX_PAGE_SIZE)
+
+    if query or tag:
+        n_rows, page_df = fetch(max(page, 0))
+    else:
+        n_rows = len(dataset.month_positions(selected_month))
+    n_pages = max(-(-n_rows // TX_PAGE_SIZE), 1)
+    page = min(max(page, 0), n_pages - 1)
+    if query or tag:
+        if len(page_df) == 0 and n_rows:  # paged past the end, show the last page
+            _, page_df = fetch(page)
+        # Index holds absolute positions; "@" tells the modal they are not month offsets
+        positions = page_df.index.to_numpy()
+        flags = dataset.anomalies.flags[positions]
+        row_keys = [f"@{pos}" for pos in positions]
+        if query:
+            heading = f"{n_rows:,} result{'s' if n_rows != 1 else ''} for “{query}”" + (f" tagged {tag}" if tag else "")
+        else:
+            heading = f"{month_label} · {tag}"
+    else:
+        if trigger_id not in ("tx-prev-btn", "tx-next-btn") and maps_enabled():
+            # Warm the map cache for this month's shops so modal opens are local hits
+            lo, hi = dataset.bounds(selected_month)
+            prefetch_maps(zip(dataset.df["lat"].to_numpy()[lo:hi], dataset.df["long"].to_numpy()[lo:hi]))
+        page_df = dataset.month_page(selected_month, page, TX_PAGE_SIZE)
+        # Anomaly flags of the page's rows (index = offset within the period)
+        flags = dataset.anomaly_flags(selected_month)[page_df.index]
+        row_keys = list(page_df.index)
+        positions = dataset.bounds(selected_month)[0] + page_df.index.to_numpy()
+        heading = month_label
+    # Display fields formatted column-wise for the whole page; tags come pre-parsed from the tag index
+    tags = dataset.tag_labels(positions)
+    amounts = page_df["amount"].round(2).astype(str) + " " + page_df["currency"].astype(str)
+    tx_rows = [
+        dbc.Button([
+            html.Img(src=logo_url("merchant", uid, logo), style={"height": "2em", "width": "2em", "objectFit": "contain", "marginRight": "1em", "verticalAlign": "middle", "borderRadius": "8px", "background": "#fff"}),
+            html.Div([
+                html.Div(merchant, style={"fontWeight": 600, "fontSize": "1.1em"}),
+                html.Div(f"{category}", style={"fontSize": "1em", "color": "#a5d8ff"}),
+            ], style={"flex": 2}),
+            html.Div(amount, style={"flex": 1, "fontWeight": 500, "fontSize": "1.1em", "textAlign": "right", "marginRight": "1em"}),
+            html.Span("⚠", title=", ".join(describe(flag)).capitalize(), style={"color": "#ffd43b", "fontSize": "1.2em"}) if flag else None,
+            html.Div(tag_str, style={"flex": 2, "fontStyle": "italic", "color": "#b2f2bb", "fontSize": "1em", "textAlign": "right"})
+        ],
+        id={"type": "transaction-btn", "index": idx},
+        n_clicks=0,
+        className="transaction-row-btn",
+        style={
+            "display": "flex", "alignItems": "center", "marginBottom": "0.5em", "background": "rgba(255,255,255,0.07)", "borderRadius": "8px", "padding": "1em 2em", "gap": "1em", "borderBottom": "1px solid rgba(255,255,255,0.10)", "width": "100%", "textAlign": "left"
+        })
+        for idx, uid, logo, merchant, category, amount, tag_str, flag in zip(
+            row_keys, page_df["merchantUid"], page_df["merchant_logo"], page_df["merchant"], page_df["category"], amounts, tags, flags
         )
-    # Get the formatted month label for the selected month
-    month_label = next((o["label"] for o in month_options if o["value"] == selected_month), selected_month)
+    ]
     tx_list = html.Div([
-        html.H5(month_label, style={"margin": "0.7em 0 0.3em 0", "color": "#fff", "fontSize": "1.3rem", "paddingLeft": "1.2em"}),
+        html.H5(heading, style={"margin": "0.7em 0 0.3em 0", "color": "#fff", "fontSize": "1.3rem", "paddingLeft": "1.2em"}),
         html.Div(tx_rows, style={"height": "100%", "flex": 1, "padding": "0.5em"})
     ], style={"marginTop": "1em", "marginBottom": "1em", "height": "100%", "display": "flex", "flexDirection": "column", "flex": 1})
-    return stats, pie_block, tx_list
+    page_label = f"Page {page + 1} of {n_pages}"
+    return tx_list, {**view, "page": page}, page_label, page <= 0, page >= n_pages - 1
 
 # --- Step 1: Add user message and set loading to True immediately ---
 @app.callback(
@@ -522,76 +762,101 @@ def add_user_message(n_clicks, user_input, chat_history):
     chat_history = chat_history + [{"role": "user", "content": user_input}]
     return chat_history, True
 
-# --- Step 2: When chat-store or loading-store changes, get AI response if loading is True ---
+# --- Step 2: When loading turns on after a user message, queue the reply on the job loop ---
 @app.callback(
-    [Output("chat-store", "data", allow_duplicate=True), Output("loading-store", "data", allow_duplicate=True)],
-    [Input("chat-store", "data"), Input("loading-store", "data"), Input("month-dropdown-store", "data")],
+    [Output("stream-store", "data"), Output("stream-interval", "disabled")],
+    [Input("chat-store", "data"), Input("loading-store", "data")],
+    State("month-dropdown-store", "data"),
     prevent_initial_call=True,
 )
 def get_ai_response(chat_history, loading, month_store):
     selected_month = month_store.get("value") if month_store else None
-    ctx = callback_context
     # Only run if loading is True and last message is from user
     if not loading or not chat_history or chat_history[-1]["role"] != "user":
         raise dash.exceptions.PreventUpdate
-    # Prepare extra context for AI: all transactions and summary by month/category
-    extra_context = {}
-    if not df.empty:
-        # All transactions (as records, but limit to 500 for safety)
-        extra_context["all_transactions"] = df.head(500).to_dict('records')
-        # Summary by month and category
-        month_cat_summary = (
-            df.groupby([df["transactionTimestamp"].dt.to_period("M"), "category"])["amount"].sum()
-            .unstack(fill_value=0)
-            .astype(float)
-            .round(2)
-        )
-        extra_context["month_category_summary"] = month_cat_summary.reset_index().astype(str).to_dict('records')
-    # Also keep the old context for the selected month
-    if selected_month and not df.empty:
-        month_df = df[df["month"].astype(str) == selected_month]
-        extra_context.update({
-            "total_transactions": len(month_df),
-            "date_range": f"{month_df['transactionTimestamp'].min().strftime('%Y-%m-%d')} to {month_df['transactionTimestamp'].max().strftime('%Y-%m-%d')}",
-            "total_spent": f"${month_df['amount'].sum():,.2f}",
-            "categories": month_df['category'].unique().tolist(),
-            "recent_transactions": month_df.head(10).to_dict('records')
-        })
-    try:
-        reply = generate_ai_response(chat_history, extra_context=extra_context)
-    except Exception as e:
-        reply = f"⚠️ Sorry, I couldn't reach the AI service right now. Error: {str(e)}"
+    tenant = tenants.current()
+    dataset = tenant.dataset
+    # Pure aggregation questions are answered from the dataset, no model round trip
+    local_reply = answer_locally(chat_history[-1]["content"], dataset, selected_month)
+    if local_reply is not None:
+        return chat_jobs.start(lambda: iter([local_reply])), False
+    # Month summary only when the model has query tools, else the compact transaction table
+    extra_context = build_extra_context(dataset, selected_month, include_transactions=not AI_TOOLS)
+    # The job loop runs outside the request, so hand it the tenant's tools directly
+    job_id = chat_jobs.start(lambda: _stream_reply(chat_history, extra_context, tenant.toolbox))
+    return job_id, False
+
+async def _stream_reply(chat_history, extra_context, toolbox):
+    """Bound the history (summarising turns that fell out of the window), then stream."""
+    history = await memory.acompact(chat_history)
+    async for delta in astream_ai_response(history, extra_context=extra_context, tools=toolbox):
+        yield delta
+
+# --- Step 3: Poll the stream, grow the active bubble, commit the reply when done ---
+@app.callback(
+    [Output("chat-store", "data", allow_duplicate=True), Output("loading-store", "data", allow_duplicate=True),
+     Output("stream-text-store", "data"), Output("stream-interval", "disabled", allow_duplicate=True)],
+    Input("stream-interval", "n_intervals"),
+    [State("stream-store", "data"), State("chat-store", "data"), State("stream-text-store", "data")],
+    prevent_initial_call=True,
+)
+def poll_ai_response(n_intervals, job_id, chat_history, shown_text):
+    text, done = chat_jobs.poll(job_id)
+    if not done:
+        if text == shown_text:
+            raise dash.exceptions.PreventUpdate
+        return dash.no_update, dash.no_update, text, False
+    reply = text.strip() or "⚠️ Sorry, I couldn't reach the AI service right now."
     chat_history = chat_history + [{"role": "assistant", "content": reply}]
-    return chat_history, False
+    return chat_history, False, "", True
+
+def _chat_row(avatar, bubble, animate=True):
+    return html.Div([
+        html.Div(avatar, className="chat-avatar"),
+        bubble
+    ], className="chat-row slide-up" if animate else "chat-row", style={"display": "flex", "alignItems": "flex-end", "marginBottom": "0.5rem"})
+
+def _chat_bubble(msg):
+    if msg["role"] == "user":
+        return _chat_row("🧑", html.Div(dcc.Markdown(msg["content"], dangerously_allow_html=True), className="chat-bubble glass-user fade-in"))
+    return _chat_row("🤖", html.Div(dcc.Markdown(msg["content"], dangerously_allow_html=True), className="chat-bubble glass-assistant fade-in"))
 
+# Committed messages: append only the bubbles not yet on the page (partial update)
 @app.callback(
-    Output("chat-history", "children"),
-    [Input("chat-store", "data"), Input("loading-store", "data")]
+    [Output("chat-messages", "children"), Output("chat-rendered-store", "data")],
+    Input("chat-store", "data"),
+    State("chat-rendered-store", "data"),
 )
-def render_chat(chat_history, loading):
-    bubbles = []
-    for msg in chat_history:
-        if msg["role"] == "user":
-            bubble_cls = "chat-bubble glass-user fade-in"
-            avatar = html.Div("🧑", className="chat-avatar")
-        else:
-            bubble_cls = "chat-bubble glass-assistant fade-in"
-            avatar = html.Div("🤖", className="chat-avatar")
-        bubbles.append(html.Div([
-            avatar,
-            html.Div(dcc.Markdown(msg["content"], dangerously_allow_html=True), className=bubble_cls)
-        ], className="chat-row slide-up", style={"display": "flex", "alignItems": "flex-end", "marginBottom": "0.5rem"}))
-    if loading:
-        # Add animated loading bubble
-        bubbles.append(html.Div([
-            html.Div("🤖", className="chat-avatar"),
-            html.Div([
-                html.Span(".", className="dot dot1"),
-                html.Span(".", className="dot dot2"),
-                html.Span(".", className="dot dot3")
-            ], className="chat-bubble glass-assistant loading-bubble fade-in")
-        ], className="chat-row slide-up", style={"display": "flex", "alignItems": "flex-end", "marginBottom": "0.5rem"}))
-    return bubbles
+def render_chat(chat_history, rendered):
+    chat_history = chat_history or []
+    rendered = rendered or 0
+    if not rendered or rendered > len(chat_history):
+        # First paint, or history was reset/replaced: render everything once
+        return [_chat_bubble(msg) for msg in chat_history], len(chat_history)
+    if rendered == len(chat_history):
+        raise dash.exceptions.PreventUpdate
+    patch = Patch()
+    for msg in chat_history[rendered:]:
+        patch.append(_chat_bubble(msg))
+    return patch, len(chat_history)
+
+# Pending reply: dot-dot-dot or the streamed text so far, without touching the history
+@app.callback(
+    Output("chat-pending", "children"),
+    [Input("loading-store", "data"), Input("stream-text-store", "data")]
+)
+def render_pending_reply(loading, stream_text):
+    if not loading:
+        return None
+    if stream_text:
+        # Reply is streaming in: show what has arrived so far
+        return _chat_row("🤖", html.Div(dcc.Markdown(stream_text, dangerously_allow_html=True), className="chat-bubble glass-assistant"), animate=False)
+    # Add animated loading bubble
+    return _chat_row("🤖", html.Div([
+        html.Span(".", className="dot dot1"),
+        html.Span(".", className="dot dot2"),
+        html.Span(".", className="dot dot3")
+    ], className="chat-bubble glass-assistant loading-bubble fade-in"))
 
 # Add callback for suggested question buttons
 from dash.dependencies import ALL
@@ -648,15 +913,22 @@ def open_transaction_modal(n_clicks_list, month_store):
     if not triggered:
         raise dash.exceptions.PreventUpdate
     try:
-        triggered_idx = int(eval(triggered)['index'])
+        triggered_idx = eval(triggered)['index']
+        # "@<n>" is an absolute row position (search results), else an offset within the month
+        by_position = isinstance(triggered_idx, str) and triggered_idx.startswith("@")
+        clicked_idx = int(triggered_idx[1:] if by_position else triggered_idx)
     except Exception:
         raise dash.exceptions.PreventUpdate
-    clicked_idx = triggered_idx
-    # Get the transaction data for the clicked index
-    month_df = df[df["month"].astype(str) == selected_month].reset_index(drop=True)
-    if clicked_idx >= len(month_df):
+    dataset = tenants.current().dataset
+    if not by_position:
+        lo, hi = dataset.bounds(selected_month)
+        clicked_idx = lo + clicked_idx if 0 <= clicked_idx < hi - lo else -1
+    row = dataset.row_at(clicked_idx)
+    if row is None:
         raise dash.exceptions.PreventUpdate
-    tx_data = month_df.iloc[clicked_idx].to_dict()
+    tx_data = row.to_dict()
+    tx_data["anomalies"] = describe(dataset.anomalies.flags[clicked_idx])
+    tx_data["tag_list"] = dataset.row_tags(clicked_idx)
     tx_data = make_json_safe(tx_data)
     return tx_data, True
 
@@ -674,29 +946,21 @@ def render_transaction_details(tx_data):
     currency = tx_data.get('currency', '')
     date = tx_data.get('transactionTimestamp', '')
     address = tx_data.get('address', tx_data.get('description', ''))
-    logo = tx_data.get('merchant_logo', '')
     category = tx_data.get('category', 'N/A')
-    category_logo = tx_data.get('category_logo', '')
+    logo = logo_url("merchant", tx_data.get('merchantUid'), tx_data.get('merchant_logo', ''), size=128)
+    category_logo = logo_url("category", category, tx_data.get('category_logo', ''))
     lat = tx_data.get('lat', None)
     long = tx_data.get('long', None)
-    co2 = tx_data.get('co2FootprintValue', None)
-    co2_unit = tx_data.get('co2FootprintUnit', '')
+    # Footprint normalised to kg at ingest, whatever unit the export used
+    co2 = tx_data.get('co2_kg', None)
     url = tx_data.get('url', None)
-    tags = tx_data.get('tags', '')
-    # Debug print for map
-    print(f"DEBUG: lat={lat}, long={long}")
-    GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+    tag_list = tx_data.get('tag_list') or []
     map_img = None
-    if lat and long and GOOGLE_MAPS_API_KEY:
+    map_url = static_map_url(lat, long) if lat is not None and long is not None else None
+    if map_url:
         try:
             lat_f = float(lat)
             long_f = float(long)
-            map_url = (
-                f"https://maps.googleapis.com/maps/api/staticmap"
-                f"?center={lat_f},{long_f}&zoom=15&size=416x234"
-                f"&markers=color:red%7C{lat_f},{long_f}&key={GOOGLE_MAPS_API_KEY}"
-            )
-            print(f"DEBUG: map_url={map_url}")
             map_link = f"https://www.google.com/maps/search/?api=1&query={lat_f},{long_f}"
             map_img = html.A(
                 html.Img(
@@ -769,17 +1033,38 @@ def render_transaction_details(tx_data):
         display_amount = f"{amount_str} {symbol}"
     else:
         display_amount = f"{amount_str} {symbol}"
+    # Foreign-currency purchases also show the converted amount used in the totals
+    amount_base = tx_data.get('amount_base')
+    base_note = None
+    if currency and currency != BASE_CURRENCY and amount_base is not None and amount_base == amount_base:
+        base_note = html.Div(f"≈ {float(amount_base):,.2f} {BASE_CURRENCY}", style={"color": "#b0c4de", "fontSize": "1em"})
+    # Why the transaction was flagged, if it was
+    anomaly_note = None
+    if tx_data.get('anomalies'):
+        anomaly_note = html.Div(
+            "⚠ " + ", ".join(tx_data['anomalies']).capitalize(),
+            style={"color": "#ffd43b", "fontWeight": 600, "fontSize": "1em", "marginBottom": "0.3em"},
+        )
     # Map embed (OpenStreetMap Static Image)
     # CO2 badge
     co2_badge = None
-    if co2 is not None:
+    if co2 is not None and co2 == co2:
         co2_badge = html.Div([
             html.Span("🌱", style={"fontSize": "1.3em", "marginRight": "0.3em"}),
-            html.Span(f"{co2} {co2_unit} CO₂", style={"fontWeight": 600})
+            html.Span(f"{float(co2):,.2f} kg CO₂", style={"fontWeight": 600})
         ], style={"color": "#38d996", "background": "#1e293b", "padding": "0.4em 1em", "borderRadius": "1em", "display": "inline-flex", "alignItems": "center", "marginBottom": "1em", "fontSize": "1.1em"})
     # Tags
-    tag_list = [t.strip() for t in tags.replace('{','').replace('}','').replace('"','').replace("'","").split(',') if t.strip()]
     tag_badges = [dbc.Badge(t, color="info", className="me-1", style={"fontSize": "1em", "background": "#4f8cff", "color": "#fff"}) for t in tag_list]
+    # Other places the user shopped around this one (grid index lookup)
+    nearby_note = None
+    if lat is not None and long is not None and lat == lat and long == long:
+        nearby = tenants.current().dataset.nearby(float(lat), float(long), radius_km=1.0, limit=6)
+        nearby = nearby[nearby["merchant"] != merchant].head(5)
+        if not nearby.empty:
+            nearby_note = html.Div(
+                "Also nearby: " + " · ".join(f"{m} ({d:.1f} km)" for m, d in zip(nearby["merchant"], nearby["distance_km"])),
+                style={"color": "#b0c4de", "fontSize": "0.95em", "marginBottom": "0.3em"},
+            )
     # --- Redesigned Transaction Details Layout ---
     # Left column: Amount, merchant, date, category, CO2, tags
     left_col = [
@@ -792,6 +1077,8 @@ def render_transaction_details(tx_data):
                 }
             ) if logo else None,
         ], style={"display": "flex", "alignItems": "center", "gap": "1em", "marginBottom": "0.2em"}),
+        base_note,
+        anomaly_note,
         html.H2(merchant, style={"color": "#fff", "fontWeight": 800, "fontSize": "1.3em", "margin": 0, "marginBottom": "0.1em", "lineHeight": "1.1"}),
         html.Div(date_str, style={"color": "#b0c4de", "fontSize": "1em", "marginBottom": "0.3em"}),
         html.Div([
@@ -800,6 +1087,7 @@ def render_transaction_details(tx_data):
         ], style={"display": "inline-flex", "alignItems": "center", "marginBottom": "0.2em", "background": "rgba(56,217,150,0.08)", "borderRadius": "0.7em", "padding": "0.2em 0.7em", "width": "fit-content"}) if category else None,
         html.Div(co2_badge, style={"width": "fit-content"}) if co2_badge else None,
         html.Div(tag_badges, style={"marginBottom": "0.3em"}) if tag_badges else None,
+        nearby_note,
     ]
     # Right column: Small map, action buttons below
     right_col = [
@@ -832,6 +1120,116 @@ def render_transaction_details(tx_data):
         })
     ], style={"background": "none", "padding": "0.5em 0 0 0"})
 
+@app.callback(
+    [Output('subscriptions-body', 'children'), Output('subscriptions-modal', 'is_open')],
+    Input('subscriptions-btn', 'n_clicks'),
+    prevent_initial_call=True
+)
+def open_subscriptions(n_clicks):
+    if not n_clicks:
+        raise dash.exceptions.PreventUpdate
+    subs = tenants.current().dataset.subscriptions(active_only=False)
+    if subs.empty:
+        return html.Div("No recurring charges found yet.", style={"color": "#b0c4de"}), True
+    active = subs[subs["active"]]
+    rows = [
+        html.Div([
+            html.Div([
+                html.Div(merchant, style={"fontWeight": 600, "fontSize": "1.1em"}),
+                html.Div(f"{category} · {cadence} · {charges} charges", style={"color": "#a5d8ff"}),
+            ], style={"flex": 2}),
+            html.Div([
+                html.Div(f"{amount:,.2f} {currency}", style={"fontWeight": 600}),
+                html.Div(f"next {next_charge:%b %d, %Y}" if is_active else f"last {last_charge:%b %d, %Y}", style={"color": "#b0c4de", "fontSize": "0.9em"}),
+            ], style={"flex": 1, "textAlign": "right"}),
+        ], style={"display": "flex", "alignItems": "center", "gap": "1em", "padding": "0.7em 1em", "marginBottom": "0.5em", "borderRadius": "8px", "background": "rgba(255,255,255,0.07)", "opacity": 1 if is_active else 0.55})
+        for merchant, category, cadence, charges, amount, currency, next_charge, last_charge, is_active in zip(
+            subs["merchant"], subs["category"], subs["cadence"], subs["charges"], subs["amount"], subs["currency"], subs["next_charge"], subs["last_charge"], subs["active"]
+        )
+    ]
+    header = html.H5(f"≈ {active['monthly_cost'].sum():,.2f} {BASE_CURRENCY} per month across {len(active)} active", style={"color": "#38d996", "marginBottom": "1em"})
+    return html.Div([header] + rows), True
+
+@app.callback(
+    [Output('spend-map', 'option'), Output('spend-map-summary', 'children'), Output('spend-map-modal', 'is_open'), Output('spend-map-view', 'data')],
+    [Input('spend-map-btn', 'n_clicks'), Input('spend-map-reset-btn', 'n_clicks'), Input('spend-map', 'click_data'), Input('spend-map', 'brush_data')],
+    [State('month-dropdown-store', 'data'), State('spend-map-view', 'data')],
+    prevent_initial_call=True
+)
+def update_spend_map(open_clicks, reset_clicks, click_data, brush_data, month_store, view):
+    selected_month = month_store.get("value") if month_store else None
+    trigger_id = callback_context.triggered[0]["prop_id"] if callback_context.triggered else ""
+    dataset = tenants.current().dataset
+    bbox = None
+    if trigger_id == "spend-map.click_data":
+        # A clicked tile carries [column, row, spend, count, south, west, level]: zoom to it and its neighbours
+        value = (click_data or {}).get("data", {}).get("value")
+        if value and len(value) == 7:
+            bbox = tile_bbox(value[4], value[5], int(value[6]))
+    elif trigger_id == "spend-map.brush_data":
+        bbox = _brushed_bbox(brush_data, view)
+        if bbox is None:
+            raise dash.exceptions.PreventUpdate
+    if bbox is None:
+        _, world_tiles = dataset.spend_tiles(selected_month, WORLD)
+        if world_tiles.empty:
+            return {}, "No located transactions in this period.", True, None
+        # Fit the first view to where the user actually spends
+        bbox = (
+            max(world_tiles["lat"].min() - 2, -90.0), max(world_tiles["long"].min() - 2, -180.0),
+            min(world_tiles["lat"].max() + 2, 90.0), min(world_tiles["long"].max() + 2, 180.0),
+        )
+    # The viewport picks the pyramid level: wider views read coarser pre-binned tiles
+    level, tiles = dataset.spend_tiles(selected_month, bbox)
+    option, view = _spend_heatmap(tiles, bbox, level)
+    cell_km = LEVELS[level] * 111
+    summary = f"{period_label(selected_month)} · {tiles['spend'].sum():,.2f} {BASE_CURRENCY} in view · ~{cell_km:,.0f} km tiles"
+    return option, summary, True, view
+
+
+def _spend_heatmap(tiles, bbox, level):
+    """ECharts heatmap of the binned **tiles** on the **level** grid over **bbox**, and the grid it used."""
+    size = LEVELS[level]
+    souths, wests = tile_grid(bbox, level)
+    columns = np.rint((tiles["west"].to_numpy() - wests[0]) / size).astype(int)
+    rows = np.rint((tiles["south"].to_numpy() - souths[0]) / size).astype(int)
+    max_spend = float(tiles["spend"].max()) if not tiles.empty else 0.0
+    cells = [
+        {
+            "name": f"{place if isinstance(place, str) else 'Unknown'} · {spend:,.2f} {BASE_CURRENCY} · {count} tx",
+            "value": [int(column), int(row), round(float(spend), 2), int(count), float(south), float(west), level],
+        }
+        for column, row, spend, count, place, south, west in zip(
+            columns, rows, tiles["spend"], tiles["count"], tiles["place"], tiles["south"], tiles["west"]
+        )
+    ]
+    axis_style = {"axisLabel": {"color": "#a5d8ff"}, "splitArea": {"show": False}}
+    option = {
+        "backgroundColor": "rgba(40,60,90,0.0)",
+        "tooltip": {"trigger": "item", "formatter": "{b}"},
+        "grid": {"left": 60, "right": 40, "top": 30, "bottom": 60},
+        "toolbox": {"right": 10, "feature": {"brush": {"type": ["rect", "clear"], "title": {"rect": "Zoom to area", "clear": "Clear"}}}},
+        "brush": {"xAxisIndex": 0, "yAxisIndex": 0, "throttleType": "debounce", "throttleDelay": 300},
+        "xAxis": {"type": "category", "name": "Longitude", "data": [f"{west:g}" for west in wests], **axis_style},
+        "yAxis": {"type": "category", "name": "Latitude", "data": [f"{south:g}" for south in souths], **axis_style},
+        "visualMap": {"type": "continuous", "dimension": 2, "min": 0, "max": round(max_spend, 2) or 1, "calculable": True, "orient": "horizontal", "left": "center", "bottom": 0, "text": ["More", "Less"], "textStyle": {"color": "#fff"}, "inRange": {"color": ["#a5d8ff", "#ffd6a5", "#ff6b6b"]}},
+        "series": [{"type": "heatmap", "data": cells, "emphasis": {"itemStyle": {"borderColor": "#fff", "borderWidth": 1}}}],
+    }
+    return option, {"level": level, "south": float(souths[0]), "west": float(wests[0])}
+
+
+def _brushed_bbox(brush_data, view):
+    """Bounding box of a rectangle brushed over the heatmap grid described by **view**."""
+    areas = (brush_data or {}).get("areas") or []
+    if not view or not areas or len(areas[-1].get("coordRange") or []) != 2:
+        return None
+    (x0, x1), (y0, y1) = areas[-1]["coordRange"]
+    size = LEVELS[int(view["level"])]
+    return (
+        view["south"] + round(min(y0, y1)) * size, view["west"] + round(min(x0, x1)) * size,
+        view["south"] + (round(max(y0, y1)) + 1) * size, view["west"] + (round(max(x0, x1)) + 1) * size,
+    )
+
 # Add a callback to toggle the dropdown open/close
 @app.callback(
     Output("month-dropdown-store", "data"),
@@ -849,8 +1247,10 @@ def toggle_month_dropdown(n_clicks, store):
 
 # Add a callback to select a month and close the dropdown, and reset n_clicks for all options
 @app.callback(
-    [Output("month-dropdown-store", "data", allow_duplicate=True)] +
-    [Output({"type": "month-dropdown-option", "value": o["value"]}, "n_clicks") for o in month_options],
+    Output("month-dropdown-store", "data", allow_duplicate=True),
+    Output({"type": "month-dropdown-option", "value": ALL}, "n_clicks"),
+    Output("period-date-range", "start_date"),
+    Output("period-date-range", "end_date"),
     Input({"type": "month-dropdown-option", "value": ALL}, "n_clicks"),
     State("month-dropdown-store", "data"),
     prevent_initial_call=True
@@ -858,7 +1258,7 @@ def toggle_month_dropdown(n_clicks, store):
 def select_month_dropdown(option_clicks, store):
     ctx = callback_context
     if not ctx.triggered or not store:
-        return [dash.no_update] + [0 for _ in option_clicks]
+        return dash.no_update, [0 for _ in option_clicks], dash.no_update, dash.no_update
     # Find which option was clicked
     for i, n in enumerate(option_clicks):
         if n:
@@ -867,9 +1267,26 @@ def select_month_dropdown(option_clicks, store):
             store = store.copy()
             store["value"] = value
             store["open"] = False
-            # Reset all n_clicks to 0
-            return [store] + [0 for _ in option_clicks]
-    return [dash.no_update] + [0 for _ in option_clicks]
+            # Reset all n_clicks to 0, and clear a custom range picked earlier
+            return store, [0 for _ in option_clicks], None, None
+    return dash.no_update, [0 for _ in option_clicks], dash.no_update, dash.no_update
+
+# A picked from/to range becomes the selected period (same store as the month list)
+@app.callback(
+    Output("month-dropdown-store", "data", allow_duplicate=True),
+    Input("period-date-range", "start_date"),
+    Input("period-date-range", "end_date"),
+    State("month-dropdown-store", "data"),
+    prevent_initial_call=True
+)
+def select_date_range(start_date, end_date, store):
+    if not start_date or not end_date:
+        raise dash.exceptions.PreventUpdate
+    start, end = sorted([str(start_date)[:10], str(end_date)[:10]])
+    store = dict(store or {})
+    store["value"] = f"{start}..{end}"
+    store["open"] = False
+    return store
 
 # Add a callback to update the selected month label in the dropdown
 @app.callback(
@@ -879,7 +1296,7 @@ def select_month_dropdown(option_clicks, store):
 )
 def update_month_dropdown_label(store):
     value = store.get("value") if store else None
-    label = next((o["label"] for o in month_options if o["value"] == value), value)
+    label = period_label(value)
     # Chevron span (keep as before)
     chevron = html.Span(
         html.Span("", id="month-chevron", style={"display": "inline-block", "marginLeft": "0.7em", "transition": "transform 0.3s"}),
@@ -908,4 +1325,7 @@ def update_dropdown_list_style(store, base_style):
 
 
 if __name__ == "__main__":
+    # Under gunicorn the first worker calls start_prewarm() instead, so no
+    # thread is running in the master when it forks
+    start_prewarm()
     app.run(debug=True)
\ No newline at end of file
@@ -8,22 +8,55 @@ Streamlit Cloud setup
 ---------------------
 Set ``OPENAI_API_KEY`` via the Secrets manager or as an env var.
 ``OPENAI_MODEL`` – optional, default ``gpt-4o-mini``.
+``OPENAI_BASE_URL`` – optional, point at a local stub endpoint for offline tests.
+``OPENAI_TIMEOUT`` / ``OPENAI_CONNECT_TIMEOUT`` – seconds, default ``30`` / ``5``.
+``OPENAI_MAX_RETRIES`` – retries on 429/5xx/connection errors, default ``3``.
+``OPENAI_MAX_CONCURRENCY`` – in‑flight requests per worker, default ``8``.
+``OPENAI_POOL_SIZE`` – keep‑alive connections per worker, default ``20``.
+``TAPIX_RESPONSE_CACHE_TTL`` / ``TAPIX_RESPONSE_CACHE_SIZE`` – reply cache, default ``3600`` s / ``512``.
+``TAPIX_RESPONSE_CACHE_DIR`` – optional on‑disk tier for the reply cache.
 
 Usage (inside app.py)
 ---------------------
 ```python
 from backend import generate_ai_response
 assistant_reply = generate_ai_response(session_messages)
+
+for delta in stream_ai_response(session_messages):  # token by token
+    ...
+
+reply = await agenerate_ai_response(session_messages)  # from an event loop
 ```
 """
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import os
-from typing import List, Dict, Any, Optional
+import random
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Protocol,
+    Tuple, TypeVar,
+)
 
 try:
     # openai ≥ 1.0 interface
-    from openai import OpenAI, OpenAIError  # type: ignore
+    from openai import (  # type: ignore
+        APIConnectionError,
+        APIStatusError,
+        AsyncOpenAI,
+        InternalServerError,
+        OpenAI,
+        OpenAIError,
+        RateLimitError,
+    )
 except ImportError as exc:  # pragma: no cover
     raise ImportError(
         "The 'openai' package is not installed. Add 'openai' to your "
@@ -34,15 +67,279 @@ except ImportError as exc:  # pragma: no cover
 # Configuration helpers
 # ----------------------------------------------------------------------------------
 
+BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+
+# Backoff: full jitter, i.e. sleep U(0, min(cap, base * 2**attempt))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+_inflight = threading.BoundedSemaphore(MAX_CONCURRENCY)
+# Async clients and semaphores are bound to the event loop that created them
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_async_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+T = TypeVar("T")
+
+
 def _get_client() -> OpenAI:
-    """Return an OpenAI client using env vars or Streamlit secrets."""
-    api_key = os.getenv("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY")
+    """Return the process‑wide OpenAI client (one keep‑alive pool per worker)."""
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=_api_key(),
+                base_url=BASE_URL,
+                timeout=_timeout(),
+                max_retries=0,  # retries are handled by _with_retries
+                http_client=_http_client(),
+            )
+    return _client
+
+
+def _get_async_client() -> AsyncOpenAI:
+    """Return the AsyncOpenAI client of the running event loop (one pool per loop)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncOpenAI(
+            api_key=_api_key(),
+            base_url=BASE_URL,
+            timeout=_timeout(),
+            max_retries=0,  # retries are handled by _awith_retries
+            http_client=_http_client(async_=True),
+        )
+    return client
+
+
+def reset_client() -> None:
+    """Drop the cached clients, e.g. after changing env vars in tests or post‑fork."""
+    global _client
+    with _client_lock:
+        _client = None
+        _async_clients.clear()
+        _async_inflight.clear()
+
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY") or _streamlit_secret("OPENAI_API_KEY")
+    if not api_key and BASE_URL:
+        api_key = "local-stub"  # stub endpoints don't check keys
     if not api_key:
         raise RuntimeError(
             "Missing OPENAI_API_KEY. Add it via Streamlit secrets or set the environment variable."
         )
-    return OpenAI(api_key=api_key)
+    return api_key
+
+
+def _async_semaphore() -> asyncio.Semaphore:
+    """The async counterpart of ``_inflight`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _async_inflight.get(loop)
+    if semaphore is None:
+        semaphore = _async_inflight[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return semaphore
+
+
+def _streamlit_secret(name: str) -> Optional[str]:
+    try:
+        import streamlit as st  # type: ignore
+
+        return st.secrets.get(name)
+    except Exception:
+        return None
+
+
+def _timeout() -> Any:
+    try:
+        import httpx
+
+        return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+    except ImportError:  # pragma: no cover
+        return REQUEST_TIMEOUT
+
+
+def _http_client(async_: bool = False) -> Any:
+    """httpx client with a bounded keep‑alive pool, or ``None`` for the SDK default."""
+    try:
+        import httpx
+        from openai import DefaultAsyncHttpxClient, DefaultHttpxClient  # type: ignore
+    except ImportError:  # pragma: no cover
+        return None
+    factory = DefaultAsyncHttpxClient if async_ else DefaultHttpxClient
+    return factory(
+        limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        timeout=_timeout(),
+    )
+
+
+def _with_retries(call: Callable[[], T]) -> T:
+    """Run **call**, retrying 429/5xx/connection errors with jittered backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+async def _awith_retries(call: Callable[[], Awaitable[T]]) -> T:
+    """Async :func:`_with_retries`; backs off without blocking the event loop."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await call()
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+    raise AssertionError("unreachable")  # pragma: no cover
+
 
+def _retry_delay(e: Exception, attempt: int) -> float:
+    """Honour ``Retry-After`` when the server sends one, else full jitter."""
+    if isinstance(e, APIStatusError):
+        retry_after = e.response.headers.get("retry-after")
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# ----------------------------------------------------------------------------------
+# Response cache
+# ----------------------------------------------------------------------------------
+
+RESPONSE_CACHE_TTL = float(os.getenv("TAPIX_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("TAPIX_RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_DIR = os.getenv("TAPIX_RESPONSE_CACHE_DIR") or None
+
+
+class ResponseCache:
+    """Thread‑safe LRU of assistant replies with a TTL and optional disk tier."""
+
+    def __init__(self, maxsize: int, ttl: float, directory: Optional[str] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = Path(directory) if directory else None
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            self._remember(key, entry)
+            return entry[1]
+        return None
+
+    def put(self, key: str, reply: str) -> None:
+        entry = (time.time(), reply)
+        self._remember(key, entry)
+        self._disk_put(key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, entry: Tuple[float, str]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        if self.directory is None:
+            return None
+        try:
+            data = json.loads(self._path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if now - data["created"] > self.ttl:
+            return None
+        return data["created"], data["reply"]
+
+    def _disk_put(self, key: str, entry: Tuple[float, str]) -> None:
+        if self.directory is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"created": entry[0], "reply": entry[1]}), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:  # pragma: no cover - the memory tier still works
+            pass
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DIR)
+
+
+def fingerprint(
+    messages: List[Dict[str, str]],
+    *,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    tools_key: Optional[str] = None,
+) -> str:
+    """Stable cache key; whitespace and user‑message case don't change it."""
+    normalized = []
+    for msg in messages:
+        content = re.sub(r"\s+", " ", str(msg.get("content", ""))).strip()
+        if msg.get("role") == "user":
+            content = content.casefold()
+        normalized.append([msg.get("role"), content])
+    payload = json.dumps(
+        [normalized, model, round(float(temperature), 3), int(max_tokens), tools_key],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ----------------------------------------------------------------------------------
+# Tool calling
+# ----------------------------------------------------------------------------------
+
+class ToolBox(Protocol):
+    """What :func:`generate_ai_response` needs from a set of local tools."""
+
+    specs: List[Dict[str, Any]]
+
+    @property
+    def cache_key(self) -> str: ...
+
+    def call(self, name: str, arguments: str) -> str: ...
+
+
+# Tool‑call round trips per reply before the model must answer in prose
+MAX_TOOL_ROUNDS = int(os.getenv("TAPIX_MAX_TOOL_ROUNDS", "4"))
+TOOLS_PROMPT = (
+    "You can call tools that query the user's complete transaction history. "
+    "Prefer them over guessing; the context above is only a summary."
+)
 
 DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 SYSTEM_PROMPT = (
@@ -50,6 +347,13 @@ SYSTEM_PROMPT = (
     "transactions, spot anomalies, and give budgeting tips in simple language."
 )
 
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and a personal "
+    "finance assistant. Keep facts, numbers, months and the user's goals or "
+    "preferences; drop pleasantries. Reply with the updated summary only, in at "
+    "most a few short bullet points."
+)
+
 # ----------------------------------------------------------------------------------
 # Public API
 # ----------------------------------------------------------------------------------
@@ -61,6 +365,7 @@ def generate_ai_response(
     model: str = DEFAULT_MODEL,
     max_tokens: int = 512,
     temperature: float = 0.4,
+    tools: Optional[ToolBox] = None,
 ) -> str:
     """Return assistant reply for the given **chat_history**.
 
@@ -72,34 +377,307 @@ def generate_ai_response(
         Optional dict merged into the system prompt (e.g. Tapix data).
     model, max_tokens, temperature
         Usual OpenAI generation knobs.
+    tools
+        Optional local query tools (see *tools.py*) offered to the model via
+        function calling; calls are executed here until the model answers.
     """
+    messages = _build_messages(chat_history, extra_context, tools)
+    key = fingerprint(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                      tools_key=tools.cache_key if tools else None)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
     client = _get_client()
 
-    # ----- Build full message list -------------------------------------------------
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": _build_system_prompt(extra_context)},
-    ] + chat_history
+    try:
+        with _inflight:
+            for round_no in range(MAX_TOOL_ROUNDS + 1):
+                request = _request(messages, tools, round_no, model=model, max_tokens=max_tokens,
+                                   temperature=temperature)
+                response = _with_retries(lambda: client.chat.completions.create(**request))
+                message = response.choices[0].message
+                if not message.tool_calls:
+                    break
+                calls = [
+                    {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+                    for call in message.tool_calls
+                ]
+                _run_tool_calls(messages, tools, calls, message.content)
+    except OpenAIError as e:  # pragma: no cover
+        return _error_reply(e)
+
+    reply = (message.content or "").strip()
+    response_cache.put(key, reply)
+    return reply
+
 
+def stream_ai_response(
+    chat_history: List[Dict[str, str]],
+    *,
+    extra_context: Optional[Dict[str, Any]] = None,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 512,
+    temperature: float = 0.4,
+    tools: Optional[ToolBox] = None,
+) -> Iterator[str]:
+    """Like :func:`generate_ai_response` but yield the reply as text deltas.
+
+    The first delta arrives as soon as the model starts generating, so the UI
+    can paint it long before the full reply is done.  Tool calls are collected
+    from the stream, executed, and the conversation continues in a new stream.
+    Errors are yielded as a final delta rather than raised.
+    """
+    messages = _build_messages(chat_history, extra_context, tools)
+    key = fingerprint(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                      tools_key=tools.cache_key if tools else None)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    client = _get_client()
+
+    parts: List[str] = []
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,  # type: ignore[arg-type]
-            max_tokens=max_tokens,
-            temperature=temperature,
+        # The slot is held until the stream is drained; only opening it is retried
+        with _inflight:
+            for round_no in range(MAX_TOOL_ROUNDS + 1):
+                request = _request(messages, tools, round_no, model=model, max_tokens=max_tokens,
+                                   temperature=temperature, stream=True)
+                stream = _with_retries(lambda: client.chat.completions.create(**request))
+                round_parts: List[str] = []
+                calls: Dict[int, Dict[str, str]] = {}
+                for chunk in stream:
+                    text = _collect_delta(chunk, calls)
+                    if text:
+                        round_parts.append(text)
+                        yield text
+                parts.extend(round_parts)
+                if not calls:
+                    break
+                _run_tool_calls(messages, tools, [calls[i] for i in sorted(calls)], "".join(round_parts) or None)
+    except OpenAIError as e:  # pragma: no cover
+        yield _error_reply(e)
+        return
+    response_cache.put(key, "".join(parts).strip())
+
+
+async def agenerate_ai_response(
+    chat_history: List[Dict[str, str]],
+    *,
+    extra_context: Optional[Dict[str, Any]] = None,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 512,
+    temperature: float = 0.4,
+    tools: Optional[ToolBox] = None,
+) -> str:
+    """Async :func:`generate_ai_response` built on ``AsyncOpenAI``.
+
+    Many replies can be in flight on one event loop without tying up a web
+    worker each; tool calls run in the default executor.
+    """
+    parts = [
+        delta async for delta in astream_ai_response(
+            chat_history, extra_context=extra_context, model=model,
+            max_tokens=max_tokens, temperature=temperature, tools=tools,
         )
+    ]
+    return "".join(parts).strip()
+
+
+async def astream_ai_response(
+    chat_history: List[Dict[str, str]],
+    *,
+    extra_context: Optional[Dict[str, Any]] = None,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 512,
+    temperature: float = 0.4,
+    tools: Optional[ToolBox] = None,
+) -> AsyncIterator[str]:
+    """Async :func:`stream_ai_response`: yield text deltas as they arrive."""
+    messages = _build_messages(chat_history, extra_context, tools)
+    key = fingerprint(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                      tools_key=tools.cache_key if tools else None)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    client = _get_async_client()
+
+    parts: List[str] = []
+    try:
+        async with _async_semaphore():
+            for round_no in range(MAX_TOOL_ROUNDS + 1):
+                request = _request(messages, tools, round_no, model=model, max_tokens=max_tokens,
+                                   temperature=temperature, stream=True)
+                stream = await _awith_retries(lambda: client.chat.completions.create(**request))
+                round_parts: List[str] = []
+                calls: Dict[int, Dict[str, str]] = {}
+                async for chunk in stream:
+                    text = _collect_delta(chunk, calls)
+                    if text:
+                        round_parts.append(text)
+                        yield text
+                parts.extend(round_parts)
+                if not calls:
+                    break
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _run_tool_calls, messages, tools,
+                    [calls[i] for i in sorted(calls)], "".join(round_parts) or None,
+                )
     except OpenAIError as e:  # pragma: no cover
-        return (
-            "⚠️ Sorry, I ran into an error talking to OpenAI: "
-            f"{e.__class__.__name__}: {e}.  Please try again later."
+        yield _error_reply(e)
+        return
+    response_cache.put(key, "".join(parts).strip())
+
+
+def prewarm_responses(
+    conversations: Iterable[Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]],
+    **kwargs: Any,
+) -> int:
+    """Fill the reply cache for (chat_history, extra_context) pairs; return misses filled.
+
+    Meant to run in a background thread after ingest, e.g. for the suggested
+    questions of every month.  Errors are skipped so one bad month doesn't stop
+    the rest.
+    """
+    filled = 0
+    for chat_history, extra_context in conversations:
+        tools = kwargs.get("tools")
+        messages = _build_messages(chat_history, extra_context, tools)
+        key = fingerprint(
+            messages,
+            model=kwargs.get("model", DEFAULT_MODEL),
+            temperature=kwargs.get("temperature", 0.4),
+            max_tokens=kwargs.get("max_tokens", 512),
+            tools_key=tools.cache_key if tools else None,
         )
+        if response_cache.get(key) is not None:
+            continue
+        try:
+            generate_ai_response(chat_history, extra_context=extra_context, **kwargs)
+        except Exception:  # pragma: no cover
+            continue
+        filled += response_cache.get(key) is not None
+    return filled
 
-    return response.choices[0].message.content.strip()
+
+def summarize_conversation(
+    previous_summary: str,
+    messages: List[Dict[str, str]],
+    *,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 256,
+) -> str:
+    """Fold **messages** into **previous_summary** (used by *history.py*).
+
+    Raises on API errors so the caller can fall back to a local summary.
+    """
+    client = _get_client()
+    request = _summary_request(previous_summary, messages, model=model, max_tokens=max_tokens)
+    with _inflight:
+        response = _with_retries(lambda: client.chat.completions.create(**request))
+    return (response.choices[0].message.content or "").strip()
+
+
+async def asummarize_conversation(
+    previous_summary: str,
+    messages: List[Dict[str, str]],
+    *,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 256,
+) -> str:
+    """Async :func:`summarize_conversation`."""
+    client = _get_async_client()
+    request = _summary_request(previous_summary, messages, model=model, max_tokens=max_tokens)
+    async with _async_semaphore():
+        response = await _awith_retries(lambda: client.chat.completions.create(**request))
+    return (response.choices[0].message.content or "").strip()
 
 
 # ----------------------------------------------------------------------------------
 # Helpers
 # ----------------------------------------------------------------------------------
 
+def _build_messages(
+    chat_history: List[Dict[str, str]],
+    extra: Optional[Dict[str, Any]],
+    tools: Optional[ToolBox] = None,
+) -> List[Dict[str, Any]]:
+    """System prompt (with **extra** context) followed by **chat_history**."""
+    system_prompt = _build_system_prompt(extra)
+    if tools is not None:
+        system_prompt += f"\n\n{TOOLS_PROMPT}"
+    return [{"role": "system", "content": system_prompt}] + list(chat_history)
+
+
+def _request(
+    messages: List[Dict[str, Any]], tools: Optional[ToolBox], round_no: int, **kwargs: Any
+) -> Dict[str, Any]:
+    """Keyword args for ``chat.completions.create``; the last round may not call tools."""
+    request: Dict[str, Any] = {"messages": messages, **kwargs}
+    if tools is not None:
+        request["tools"] = tools.specs
+        if round_no >= MAX_TOOL_ROUNDS:
+            request["tool_choice"] = "none"
+    return request
+
+
+def _summary_request(
+    previous_summary: str, messages: List[Dict[str, str]], **kwargs: Any
+) -> Dict[str, Any]:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = f"Summary so far:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+    return {
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.0,
+        **kwargs,
+    }
+
+
+def _collect_delta(chunk: Any, calls: Dict[int, Dict[str, str]]) -> Optional[str]:
+    """Return the text in a stream **chunk**; merge tool‑call fragments into **calls**."""
+    if not chunk.choices:
+        return None
+    delta = chunk.choices[0].delta
+    for call in delta.tool_calls or []:
+        slot = calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+        slot["id"] = call.id or slot["id"]
+        if call.function is not None:
+            slot["name"] += call.function.name or ""
+            slot["arguments"] += call.function.arguments or ""
+    return delta.content or None
+
+
+def _run_tool_calls(
+    messages: List[Dict[str, Any]],
+    tools: Optional[ToolBox],
+    calls: List[Dict[str, str]],
+    content: Optional[str],
+) -> None:
+    """Append the assistant's tool calls and their local results to **messages**."""
+    messages.append({
+        "role": "assistant",
+        "content": content,
+        "tool_calls": [
+            {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+            for c in calls
+        ],
+    })
+    for c in calls:
+        result = tools.call(c["name"], c["arguments"]) if tools else "{}"
+        messages.append({"role": "tool", "tool_call_id": c["id"], "content": result})
+
+
+def _error_reply(e: Exception) -> str:
+    return (
+        "⚠️ Sorry, I ran into an error talking to OpenAI: "
+        f"{e.__class__.__name__}: {e}.  Please try again later."
+    )
+
+
 def _build_system_prompt(extra: Optional[Dict[str, Any]]) -> str:
     """Merge **extra** context into the SYSTEM_PROMPT."""
     if not extra:
@@ -107,6 +685,10 @@ def _build_system_prompt(extra: Optional[Dict[str, Any]]) -> str:
 
     context_lines = ["Here is additional context you can use:"]
     for key, value in extra.items():
-        context_lines.append(f"- {key}: {value}")
+        if isinstance(value, str) and "\n" in value:
+            # Tables from context.py go on their own lines
+            context_lines.append(f"- {key}:\n{value}")
+        else:
+            context_lines.append(f"- {key}: {value}")
 
     return f"{SYSTEM_PROMPT}\n\n" + "\n".join(context_lines)
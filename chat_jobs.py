@@ -0,0 +1,191 @@
+"""chat_jobs.py – local job queue for assistant replies the Dash UI can poll
+==========================================================================
+
+A Dash callback must return before the browser sees anything, and a web
+worker that waits on OpenAI for the whole reply can't serve anyone else.
+:func:`start` therefore hands the reply to a background event loop (one
+thread per process) and returns a job id at once; a ``dcc.Interval``
+callback then calls :func:`poll` and appends whatever has arrived to the
+active chat bubble.
+
+All LLM calls of a worker are multiplexed on that loop, so web threads only
+ever run fast UI callbacks.  Plain (sync) iterators are accepted too and are
+drained in the loop's executor.
+
+Under gunicorn the poll may land on a different worker process than the one
+running the job, so every job is also mirrored to a small JSON file in
+:data:`JOBS_DIR` (rewritten at most every :data:`FLUSH_SECONDS`, and once
+more when it finishes).  :func:`poll` answers from memory when the job is
+local and from that file otherwise.
+
+Environment
+-----------
+``TAPIX_CACHE_DIR`` – job files live in its ``chat-jobs`` folder (see *ingest.py*).
+
+Usage (inside app.py)
+---------------------
+```python
+job_id = chat_jobs.start(lambda: astream_ai_response(history, extra_context=ctx))
+text, done = chat_jobs.poll(job_id)
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from ingest import DEFAULT_CACHE_DIR
+
+# Jobs nobody polled for this long are dropped (browser tab closed mid‑reply)
+JOB_TTL_SECONDS = 600
+# Shared with the other worker processes, see module docs
+JOBS_DIR = Path(DEFAULT_CACHE_DIR) / "chat-jobs"
+FLUSH_SECONDS = 0.1
+
+StreamFactory = Callable[[], Union[Iterable[str], AsyncIterable[str]]]
+
+
+class _Job:
+    __slots__ = ("job_id", "parts", "done", "updated", "flushed")
+
+    def __init__(self, job_id: str) -> None:
+        self.job_id = job_id
+        self.parts: List[str] = []
+        self.done = False
+        self.updated = time.monotonic()
+        self.flushed = 0.0
+
+
+_jobs: Dict[str, _Job] = {}
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid = 0
+
+
+def start(stream_factory: StreamFactory) -> str:
+    """Queue **stream_factory()** on the background loop; return the job id to poll."""
+    job_id = uuid.uuid4().hex
+    job = _Job(job_id)
+    with _lock:
+        _expire()
+        _jobs[job_id] = job
+    _flush(job)
+    asyncio.run_coroutine_threadsafe(_run(job, stream_factory), _event_loop())
+    return job_id
+
+
+def poll(job_id: Optional[str]) -> Tuple[str, bool]:
+    """Return ``(text so far, finished)``; finished jobs are forgotten."""
+    if not job_id:
+        return "", True
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            text = "".join(job.parts)
+            if job.done:
+                del _jobs[job_id]
+                _job_path(job_id).unlink(missing_ok=True)
+            return text, job.done
+    # Started by another worker process: read its mirror
+    try:
+        state = json.loads(_job_path(job_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return "", True
+    if state["done"]:
+        _job_path(job_id).unlink(missing_ok=True)
+    return state["text"], state["done"]
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+async def _run(job: _Job, stream_factory: StreamFactory) -> None:
+    def append(delta: str) -> None:
+        with _lock:
+            job.parts.append(delta)
+            job.updated = time.monotonic()
+        if job.updated - job.flushed >= FLUSH_SECONDS:
+            _flush(job)
+
+    try:
+        stream = stream_factory()
+        if hasattr(stream, "__aiter__"):
+            async for delta in stream:  # type: ignore[union-attr]
+                append(delta)
+        else:
+            def drain() -> None:
+                for delta in stream:  # type: ignore[union-attr]
+                    append(delta)
+
+            await asyncio.get_running_loop().run_in_executor(None, drain)
+    except Exception as e:  # surface the failure in the bubble, never hang it
+        append(f"⚠️ Sorry, I couldn't reach the AI service right now. Error: {e}")
+    finally:
+        with _lock:
+            job.done = True
+        _flush(job)
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The process' job loop, started lazily (and again after a fork)."""
+    with _lock:
+        if _loop is None or not _loop.is_running() or _loop_pid != os.getpid():
+            _start_loop()
+        assert _loop is not None
+        return _loop
+
+
+def _start_loop() -> None:
+    global _loop, _loop_pid
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run() -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    threading.Thread(target=run, name="chat-jobs-loop", daemon=True).start()
+    ready.wait()
+    _loop, _loop_pid = loop, os.getpid()
+
+
+def _job_path(job_id: str) -> Path:
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def _flush(job: _Job) -> None:
+    """Atomically mirror **job** to its file for polls served by other workers."""
+    with _lock:
+        state = {"text": "".join(job.parts), "done": job.done}
+        job.flushed = time.monotonic()
+    try:
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        path = _job_path(job.job_id)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError:  # pragma: no cover - polls on this worker still work from memory
+        pass
+
+
+def _expire() -> None:
+    cutoff = time.monotonic() - JOB_TTL_SECONDS
+    for job_id in [k for k, j in _jobs.items() if j.updated < cutoff]:
+        del _jobs[job_id]
+        _job_path(job_id).unlink(missing_ok=True)
+    # Files left by jobs of other (possibly restarted) workers
+    wall_cutoff = time.time() - JOB_TTL_SECONDS
+    try:
+        for path in JOBS_DIR.glob("*.json"):
+            if path.stat().st_mtime < wall_cutoff:
+                path.unlink(missing_ok=True)
+    except OSError:
+        pass
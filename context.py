@@ -0,0 +1,229 @@
+"""context.py – compact, token‑budgeted AI context for generate_ai_response
+=========================================================================
+
+Turns the transaction dataset into the ``extra_context`` dict handed to
+:func:`backend.generate_ai_response`.  Instead of Python reprs of full
+records (S3 logo URLs, Google place URLs, 64‑char ``sourceId`` hashes…) the
+transactions are emitted as a compact table:
+
+```
+merchants: m0=Peek & Cloppenburg; m1=Nordsee
+categories: c0=Fashion; c1=Food And Drink
+date|merchant|category|amount|currency
+2024-01-15|m0|c0|46.00|EUR
+```
+
+Rows are added until the configured token budget is used up.  The selected
+period's anomaly flags (see :mod:`anomalies`) are listed separately, most
+anomalous first, so the model sees them even when the rows themselves are
+cut or only available through tools.  Active subscriptions (see
+:mod:`recurring`) are summarised as one line each.
+
+Environment
+-----------
+``TAPIX_CONTEXT_TOKENS`` – optional, default ``2000``.
+``TAPIX_CONTEXT_ANOMALIES`` – flagged transactions listed, default ``10``.
+"""
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset import TransactionDataset, period_label
+from fx import BASE_CURRENCY
+from recurring import describe_subscriptions
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("TAPIX_CONTEXT_TOKENS", "2000"))
+
+# Columns worth showing to the model; everything else is dropped
+CONTEXT_COLUMNS: List[str] = ["transactionTimestamp", "merchant", "category", "amount", "currency"]
+_HEADER_NAMES = {"transactionTimestamp": "date"}
+_DICT_COLUMNS = {"merchant": "m", "category": "c"}
+
+# Upper bound on rows considered before the budget cut, keeps encoding O(k)
+MAX_CANDIDATE_ROWS = 5000
+# Flagged transactions listed per period
+MAX_ANOMALIES = int(os.getenv("TAPIX_CONTEXT_ANOMALIES", "10"))
+# Subscriptions listed (largest monthly cost first)
+MAX_SUBSCRIPTIONS = 15
+
+# ----------------------------------------------------------------------------------
+# Token counting
+# ----------------------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken  # type: ignore
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # pragma: no cover - tiktoken missing or offline
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of **text** (tiktoken if available, else ~4 chars/token)."""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // 4)
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def build_extra_context(
+    dataset: TransactionDataset,
+    selected_month: Optional[str],
+    *,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    include_transactions: bool = True,
+) -> Dict[str, Any]:
+    """Return the ``extra_context`` dict for one chat turn within **token_budget**.
+
+    With ``include_transactions=False`` only the month summary is sent; used
+    when the model can fetch rows itself through the tools in *tools.py*.
+    """
+    if dataset.empty:
+        return {}
+    context: Dict[str, Any] = {}
+    if selected_month:
+        lo, hi = dataset.bounds(selected_month)
+        if hi > lo:
+            summary = dataset.summary(selected_month)
+            currencies = dataset.currency_totals(selected_month)
+            # Rows are time‑sorted, so the period's first and last rows bound it
+            stamps = dataset.df["transactionTimestamp"]
+            context.update({
+                "selected_month": selected_month if selected_month in dataset.months() else period_label(selected_month),
+                "total_transactions": summary["count"],
+                "date_range": f"{stamps.iloc[lo]:%Y-%m-%d} to {stamps.iloc[hi - 1]:%Y-%m-%d}",
+                "base_currency": BASE_CURRENCY,
+                "total_spent": f"{summary['total']:,.2f} {BASE_CURRENCY}",
+                "categories": ", ".join(dataset.category_totals(selected_month).index),
+                "co2_footprint": f"{summary['co2']:,.1f} kg (" + ", ".join(
+                    f"{k} {v:,.1f}" for k, v in dataset.co2_totals(selected_month).head(5).items()
+                ) + ")",
+                "top_tags": ", ".join(
+                    f"{k} {v:,.0f}" for k, v in dataset.tag_totals(selected_month)["total"].head(8).items()
+                ),
+            })
+            if len(currencies) > 1 or (len(currencies) == 1 and currencies.index[0] != BASE_CURRENCY):
+                context["spent_by_currency"] = ", ".join(f"{v:,.2f} {k}" for k, v in currencies.items())
+            n_flagged = int(np.count_nonzero(dataset.anomaly_flags(selected_month)))
+            if n_flagged:
+                context["anomalies"] = encode_anomalies(dataset.flagged(selected_month, MAX_ANOMALIES), n_flagged)
+    subscriptions = describe_subscriptions(dataset.subscriptions(), BASE_CURRENCY, MAX_SUBSCRIPTIONS)
+    if subscriptions:
+        context["subscriptions"] = subscriptions
+    if not include_transactions:
+        context["months_available"] = f"{dataset.months()[0]} to {dataset.months()[-1]}"
+        return context
+    context["month_category_summary"] = encode_month_category(dataset.cube.month_category_table())
+
+    used = count_tokens("\n".join(f"{k}: {v}" for k, v in context.items()))
+    rows = _candidate_rows(dataset, selected_month)
+    table = encode_transactions(rows, max_tokens=token_budget - used)
+    if table:
+        context["transactions"] = table
+    return context
+
+
+def encode_transactions(
+    df: pd.DataFrame,
+    *,
+    columns: List[str] = CONTEXT_COLUMNS,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """Encode **df** as a dictionary‑compressed table, cut to **max_tokens**."""
+    if df.empty or (max_tokens is not None and max_tokens <= 0):
+        return ""
+    lines = _row_lines(df, columns)
+    n_rows = len(lines)
+    if max_tokens is not None:
+        # Cheap per‑line estimate first, then shrink until the real count fits
+        costs = np.cumsum([count_tokens(line) + 1 for line in lines])
+        n_rows = int(np.searchsorted(costs, max_tokens * 0.8, side="right"))
+        while n_rows > 0:
+            text = _render(df.iloc[:n_rows], lines[:n_rows], columns)
+            if count_tokens(text) <= max_tokens:
+                return text
+            n_rows = int(n_rows * 0.9)
+        return ""
+    return _render(df, lines, columns)
+
+
+def encode_month_category(table: pd.DataFrame) -> str:
+    """Months × categories spend table (base currency) as ``|``‑separated rows of whole numbers."""
+    if table.empty:
+        return ""
+    header = "month|" + "|".join(map(str, table.columns))
+    body = [
+        f"{month}|" + "|".join(str(int(round(v))) for v in values)
+        for month, values in zip(table.index, table.to_numpy())
+    ]
+    return "\n".join([header] + body)
+
+
+def encode_anomalies(flagged: pd.DataFrame, total: int) -> str:
+    """Flagged rows (from :meth:`TransactionDataset.flagged`) as a ``|``‑separated table."""
+    lines = [f"{total} flagged, showing {len(flagged)}", "date|merchant|amount|currency|reasons"]
+    lines += [
+        f"{stamp:%Y-%m-%d}|{merchant}|{amount:.2f}|{currency}|{reasons}"
+        for stamp, merchant, amount, currency, reasons in zip(
+            flagged["transactionTimestamp"], flagged["merchant"], flagged["amount"],
+            flagged["currency"], flagged["reasons"],
+        )
+    ]
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _candidate_rows(dataset: TransactionDataset, selected_month: Optional[str]) -> pd.DataFrame:
+    """Selected period first, then the most recent other transactions."""
+    lo, hi = dataset.bounds(selected_month)
+    n = len(dataset.df)
+    # Rows are time‑sorted: the most recent are simply the tail, newest first
+    recent = np.arange(n - 1, max(n - 1 - MAX_CANDIDATE_ROWS - (hi - lo), -1), -1)
+    recent = recent[(recent < lo) | (recent >= hi)]
+    positions = np.concatenate([np.arange(lo, hi), recent])[:MAX_CANDIDATE_ROWS]
+    return dataset.df.take(positions).reset_index(drop=True)
+
+
+def _row_lines(df: pd.DataFrame, columns: List[str]) -> List[str]:
+    """Render every row as a ``|``‑joined line, column‑wise."""
+    parts = []
+    for col in columns:
+        values = df[col]
+        if col == "transactionTimestamp":
+            values = values.dt.strftime("%Y-%m-%d")
+        elif col in _DICT_COLUMNS:
+            codes, _ = pd.factorize(values)
+            values = pd.Series(codes, index=df.index).map(lambda c, p=_DICT_COLUMNS[col]: f"{p}{c}")
+        elif col == "amount":
+            values = values.round(2).map("{:.2f}".format)
+        parts.append(values.astype(str).fillna(""))
+    joined = parts[0]
+    for part in parts[1:]:
+        joined = joined + "|" + part
+    return joined.tolist()
+
+
+def _render(df: pd.DataFrame, lines: List[str], columns: List[str]) -> str:
+    """Dictionary legends + header + **lines** (legends only cover **df**'s rows)."""
+    legends = []
+    for col, prefix in _DICT_COLUMNS.items():
+        if col not in columns:
+            continue
+        _, uniques = pd.factorize(df[col])
+        legends.append(f"{col}s: " + "; ".join(f"{prefix}{i}={v}" for i, v in enumerate(uniques)))
+    header = "|".join(_HEADER_NAMES.get(c, c) for c in columns)
+    return "\n".join(legends + [header] + lines)
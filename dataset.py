@@ -0,0 +1,402 @@
+"""dataset.py – in‑memory transaction dataset shared by the Dash callbacks
+=======================================================================
+
+Wraps the frame produced by :mod:`ingest` together with the indexes the
+callbacks need.  Rows are kept sorted by ``transactionTimestamp``, so every
+month – and any other time range – is one contiguous block of rows:
+
+* a range lookup is two binary searches over the timestamp array and the
+  rows come back as a zero‑copy ``iloc`` slice, O(log n + k);
+* a prefix sum of ``amount_base`` answers "how much between *a* and *b*" in
+  O(log n), which makes rolling windows cheap.
+
+Anomaly flags (see :mod:`anomalies`) are kept in a bit mask aligned with the
+rows, so a period's flags are a slice too.  Recurring charges (see
+:mod:`recurring`) are tracked per merchant, and shop coordinates are indexed
+by :mod:`geo` for nearby queries and the spend map.  Free‑text search goes
+through the inverted index of :mod:`search`, and tags are exploded into a
+``(row, tag)`` table by :mod:`tags` for tag spend and tag filters.
+
+Callbacks pass a **period** string wherever a month used to go:
+
+``YYYY-MM`` – a calendar month (served from the aggregate cube),
+``last-7d`` / ``last-30d`` / ``last-90d`` – trailing days up to the latest transaction,
+``YYYY-MM-DD..YYYY-MM-DD`` – a custom range, both days inclusive.
+
+Usage (inside app.py)
+---------------------
+```python
+from dataset import TransactionDataset
+dataset = TransactionDataset(df)
+month_df = dataset.month_frame("2024-02")
+recent = dataset.range_frame("2024-02-10", "2024-03-01")
+dataset.rolling_totals(30)          # trailing 30‑day spend for every day
+```
+"""
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregates import AggregateCube
+from anomalies import AnomalyDetector, describe
+from geo import WORLD, BBox, GeoIndex, bin_rows
+from recurring import RecurringDetector
+from search import SearchIndex
+from tags import TagIndex
+
+_NO_ROWS = np.empty(0, dtype=np.intp)
+_DAY_NS = 86_400 * 10**9
+
+RANGE_PRESETS: Dict[str, int] = {"last-7d": 7, "last-30d": 30, "last-90d": 90}
+_MONTH = re.compile(r"^\d{4}-\d{2}$")
+_CUSTOM = re.compile(r"^(\d{4}-\d{2}-\d{2})\.\.(\d{4}-\d{2}-\d{2})$")
+
+Bounds = Tuple[int, int]
+
+
+class TransactionDataset:
+    """Time‑sorted transaction frame plus the indexes and aggregates built at load time."""
+
+    def __init__(self, df: pd.DataFrame, *, key: str = "", search_path: Optional[Path] = None) -> None:
+        self.df = _sorted(df)
+        self.key = key
+        self._build_indexes()
+        self.cube = AggregateCube(self.df)
+        self.anomalies = AnomalyDetector(self.df)
+        self.recurring = RecurringDetector(self.df)
+        self.geo = GeoIndex(self.df)
+        self.search_index = SearchIndex.load_or_build(self.df, search_path)
+        self.tags = TagIndex(self.df)
+        self._appends = 0
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def empty(self) -> bool:
+        return self.df.empty
+
+    @property
+    def version(self) -> str:
+        """Cheap content token that changes whenever rows are appended (and per **key**)."""
+        return f"{self.key}:{len(self.df)}:{self._appends}"
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size: frame, time index, aggregate cube, anomaly flags, geo, search and tag indexes."""
+        nbytes = int(self.df.memory_usage(deep=True).sum())
+        nbytes += self._stamps.nbytes + self._cum_base.nbytes + self.anomalies.nbytes + self.geo.nbytes
+        nbytes += self.search_index.nbytes + self.tags.nbytes
+        return nbytes + int(self.cube.cells.memory_usage(deep=True).sum())
+
+    def months(self) -> List[str]:
+        """All months present in the data, oldest first."""
+        return list(self._month_bounds)
+
+    def bounds(self, period: Optional[str]) -> Bounds:
+        """``(start, stop)`` row slice of **period** (month, preset or custom range)."""
+        if not period:
+            return 0, 0
+        period = str(period)
+        if _MONTH.match(period):
+            return self._month_bounds.get(period, (0, 0))
+        if period in RANGE_PRESETS:
+            return self.last_days(RANGE_PRESETS[period])
+        custom = _CUSTOM.match(period)
+        if custom:
+            return self.range_bounds(custom.group(1), pd.Timestamp(custom.group(2)) + pd.Timedelta(days=1))
+        return 0, 0
+
+    def range_bounds(self, start: Any = None, end: Any = None) -> Bounds:
+        """Rows with ``start <= transactionTimestamp < end`` (``None`` = open end), by binary search.
+
+        **start** / **end** are anything :class:`pandas.Timestamp` accepts, or int nanoseconds.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self._stamps, _ns(start), side="left"))
+        hi = len(self._stamps) if end is None else int(np.searchsorted(self._stamps, _ns(end), side="left"))
+        return lo, max(lo, hi)
+
+    def last_days(self, days: int) -> Bounds:
+        """The trailing **days** calendar days up to and including the latest transaction's day."""
+        if not len(self._stamps):
+            return 0, 0
+        end = (self._stamps[-1] // _DAY_NS + 1) * _DAY_NS
+        return self.range_bounds(end - int(days) * _DAY_NS, None)
+
+    def range_frame(self, start: Any = None, end: Any = None) -> pd.DataFrame:
+        """Zero‑copy slice of the rows in ``[start, end)``."""
+        lo, hi = self.range_bounds(start, end)
+        return self.df.iloc[lo:hi]
+
+    def month_positions(self, month: Optional[str]) -> np.ndarray:
+        """Row positions (into :attr:`df`) for **month** (or any period), oldest first."""
+        lo, hi = self.bounds(month)
+        return np.arange(lo, hi) if hi > lo else _NO_ROWS
+
+    def month_frame(self, month: Optional[str]) -> pd.DataFrame:
+        """Rows for **month** (or any period) with a fresh 0..k‑1 index."""
+        lo, hi = self.bounds(month)
+        return self.df.iloc[lo:hi].reset_index(drop=True)
+
+    def month_page(self, month: Optional[str], page: int, page_size: int) -> pd.DataFrame:
+        """One page of **month**'s rows; the index holds the row's offset within the period."""
+        lo, hi = self.bounds(month)
+        start = max(page, 0) * page_size
+        rows = self.df.iloc[min(lo + start, hi):min(lo + start + page_size, hi)]
+        rows = rows.set_axis(pd.RangeIndex(start, start + len(rows)), axis=0)
+        return rows
+
+    def month_row(self, month: Optional[str], offset: int) -> Optional[pd.Series]:
+        """The **offset**‑th row of **month** (or any period), or ``None`` if out of range."""
+        lo, hi = self.bounds(month)
+        if not 0 <= offset < hi - lo:
+            return None
+        return self.df.iloc[lo + offset]
+
+    def row_at(self, position: int) -> Optional[pd.Series]:
+        """Row at absolute **position** (as returned by :meth:`search`), or ``None``."""
+        if not 0 <= position < len(self.df):
+            return None
+        return self.df.iloc[position]
+
+    def search(
+        self, query: str, page: int = 0, page_size: int = 25, *, tag: Optional[str] = None,
+    ) -> Tuple[int, pd.DataFrame]:
+        """``(total matches, one page of matching rows)``, newest first, optionally only rows tagged **tag**.
+
+        The page's index holds each row's absolute position (see :meth:`row_at`).
+        """
+        if tag is None:
+            total, positions = self.search_index.search(query, page, page_size)
+        else:
+            matches = np.intersect1d(self.search_index.matches(query), self.tags.rows_with(tag), assume_unique=True)
+            start = max(int(page), 0) * page_size
+            total, positions = len(matches), matches[::-1][start:start + page_size]
+        return total, self.df.iloc[positions].set_axis(pd.Index(positions), axis=0)
+
+    def tag_page(self, period: Optional[str], tag: str, page: int, page_size: int) -> Tuple[int, pd.DataFrame]:
+        """``(rows tagged **tag** in **period**, one page of them)``, newest first like :meth:`search`.
+
+        The index holds absolute positions.
+        """
+        lo, hi = self.bounds(period)
+        positions = self.tags.rows_with(tag)
+        positions = positions[np.searchsorted(positions, lo):np.searchsorted(positions, hi)][::-1]
+        start = max(int(page), 0) * page_size
+        page_positions = positions[start:start + page_size]
+        return len(positions), self.df.iloc[page_positions].set_axis(pd.Index(page_positions), axis=0)
+
+    def row_tags(self, position: int) -> List[str]:
+        """Parsed tags of the row at absolute **position**."""
+        return self.tags.tags_of(position)
+
+    def tag_labels(self, positions: Sequence[int]) -> List[str]:
+        """``"A, B"`` tag strings for the rows at absolute **positions**."""
+        return self.tags.labels(positions)
+
+    def anomaly_flags(self, period: Optional[str]) -> np.ndarray:
+        """Anomaly bit mask of **period**'s rows (index it like :meth:`month_page` offsets)."""
+        lo, hi = self.bounds(period)
+        return self.anomalies.flags[lo:hi]
+
+    def flagged(self, period: Optional[str], limit: Optional[int] = None) -> pd.DataFrame:
+        """**period**'s flagged rows, most anomalous first, with ``reasons`` and ``score`` columns."""
+        lo, hi = self.bounds(period)
+        positions = lo + np.flatnonzero(self.anomalies.flags[lo:hi])
+        positions = positions[np.argsort(-self.anomalies.scores[positions], kind="stable")][:limit]
+        rows = self.df.take(positions).reset_index(drop=True)
+        rows["reasons"] = [", ".join(describe(f)) for f in self.anomalies.flags[positions]]
+        rows["score"] = self.anomalies.scores[positions].round(1)
+        return rows
+
+    def subscriptions(self, *, active_only: bool = True) -> pd.DataFrame:
+        """Recurring charges (subscriptions), largest monthly cost first."""
+        return self.recurring.subscriptions(active_only=active_only)
+
+    def nearby(self, lat: float, long: float, radius_km: float = 1.0, limit: int = 10) -> pd.DataFrame:
+        """Merchants within **radius_km** of a point, nearest first."""
+        return self.geo.nearby(self.df, lat, long, radius_km, limit)
+
+    def spend_tiles(self, period: Optional[str], bbox: BBox = WORLD) -> Tuple[int, pd.DataFrame]:
+        """``(level, tiles)`` of the spend map over **bbox** for **period** (``None`` = all time).
+
+        Months (and all time) come from the pre‑binned tiles; other periods
+        bin their slice of rows, which is O(rows in the period).
+        """
+        if not period:
+            return self.geo.viewport(bbox)
+        if _MONTH.match(str(period)):
+            return self.geo.viewport(bbox, months=[str(period)])
+        level = self.geo.level_for(bbox)
+        lo, hi = self.bounds(period)
+        return level, bin_rows(self.df.iloc[lo:hi], level, bbox)
+
+    # ------------------------------------------------------------------ aggregates
+    def summary(self, period: Optional[str]) -> Dict[str, Any]:
+        """Like :meth:`AggregateCube.month_summary`, for any period."""
+        if period and _MONTH.match(str(period)):
+            return self.cube.month_summary(period)
+        lo, hi = self.bounds(period)
+        if hi <= lo:
+            return self.cube.month_summary(None)
+        rows = self.df.iloc[lo:hi]
+        base = rows["amount_base"].to_numpy(dtype=float)
+        return {
+            "total": float(self._cum_base[hi] - self._cum_base[lo]),
+            "count": hi - lo,
+            "min": float(np.nanmin(base)),
+            "max": float(np.nanmax(base)),
+            "co2": float(np.nansum(rows["co2_kg"].to_numpy(dtype=float))),
+            "unconverted": int(np.count_nonzero(np.isnan(base) & rows["amount"].notna().to_numpy())),
+        }
+
+    def category_totals(self, period: Optional[str]) -> pd.Series:
+        """Base‑currency spend per category in **period**, largest first."""
+        return self._totals(period, "category")
+
+    def tag_totals(self, period: Optional[str]) -> pd.DataFrame:
+        """Base‑currency ``total`` and row ``count`` per tag in **period** (``None`` = all rows), largest first.
+
+        A transaction counts towards each of its tags, so totals overlap.
+        """
+        lo, hi = self.bounds(period) if period else (0, len(self.df))
+        return self.tags.totals(lo, hi, self.df["amount_base"].to_numpy(dtype=float))
+
+    def currency_totals(self, period: Optional[str]) -> pd.Series:
+        """Native spend per currency in **period**, largest first."""
+        return self._totals(period, "currency")
+
+    def co2_totals(self, period: Optional[str], by: str = "category") -> pd.Series:
+        """CO₂ footprint (kg) per ``category`` or ``merchant`` in **period**, largest first."""
+        if period and _MONTH.match(str(period)):
+            return getattr(self.cube, f"co2_by_{by}")(period)
+        return self._totals(period, by, "co2_kg")
+
+    def rolling_totals(self, window_days: int, start: Any = None, end: Any = None) -> pd.Series:
+        """Trailing **window_days** spend at the end of each day in ``[start, end]``.
+
+        Each point is two binary searches into the prefix sum, so a whole
+        series costs O(days · log n) however many rows each window holds.
+        """
+        if not len(self._stamps):
+            return pd.Series(dtype="float64")
+        first = pd.Timestamp(start if start is not None else self._stamps[0]).normalize()
+        last = pd.Timestamp(end if end is not None else self._stamps[-1]).normalize()
+        days = pd.date_range(first, last, freq="D")
+        ends = days.to_numpy(dtype="datetime64[ns]").view(np.int64) + _DAY_NS
+        hi = np.searchsorted(self._stamps, ends, side="left")
+        lo = np.searchsorted(self._stamps, ends - int(window_days) * _DAY_NS, side="left")
+        return pd.Series(self._cum_base[hi] - self._cum_base[lo], index=days, name=f"spend_{window_days}d")
+
+    # ------------------------------------------------------------------ updates
+    def append(self, rows: pd.DataFrame) -> None:
+        """Append **rows** (same schema as :attr:`df`) and update indexes in place."""
+        if rows.empty:
+            return
+        rows = _sorted(rows)
+        start = len(self.df)
+        in_order = not len(self._stamps) or _stamp_array(rows)[0] >= self._stamps[-1]
+        self.df = _concat(self.df, rows)
+        if not in_order:  # back‑dated rows: one stable re‑sort keeps ranges contiguous
+            self.df = _sorted(self.df)
+        self._build_indexes()
+        self.cube.append(rows)
+        self.recurring.append(self.df, rows)
+        if in_order:
+            self.anomalies.append(self.df, start)
+            self.geo.append(self.df, start)
+            self.search_index.append(self.df, start)
+            self.tags.append(self.df, start)
+        else:  # row positions moved, rescore and reindex from scratch
+            self.anomalies = AnomalyDetector(self.df)
+            self.geo = GeoIndex(self.df)
+            self.search_index = SearchIndex.build(self.df)
+            self.tags = TagIndex(self.df)
+        self._appends += 1
+
+    # ------------------------------------------------------------------ helpers
+    def _build_indexes(self) -> None:
+        self._stamps = _stamp_array(self.df)
+        base_col = "amount_base" if "amount_base" in self.df.columns else "amount"
+        base = np.nan_to_num(self.df[base_col].to_numpy(dtype=float)) if len(self.df) else np.empty(0)
+        self._cum_base = np.concatenate([[0.0], np.cumsum(base)])
+        self._month_bounds: Dict[str, Bounds] = _build_month_index(self._stamps)
+
+    def _totals(self, period: Optional[str], column: str, value: Optional[str] = None) -> pd.Series:
+        if value is None and period and _MONTH.match(str(period)):
+            return getattr(self.cube, f"{column}_totals")(period)
+        lo, hi = self.bounds(period)
+        rows = self.df.iloc[lo:hi]
+        value = value or ("amount" if column == "currency" else "amount_base")
+        totals = rows.groupby(rows[column].astype(object).fillna("Unknown").astype(str))[value].sum()
+        return totals.sort_values(ascending=False)
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def period_label(period: Optional[str]) -> str:
+    """Human label for a period string (``"January 2024"``, ``"Last 30 days"``, …)."""
+    if not period:
+        return ""
+    period = str(period)
+    if _MONTH.match(period):
+        return pd.Period(period, freq="M").strftime("%B %Y")
+    if period in RANGE_PRESETS:
+        return f"Last {RANGE_PRESETS[period]} days"
+    custom = _CUSTOM.match(period)
+    if custom:
+        start, end = (pd.Timestamp(d) for d in custom.groups())
+        return f"{start:%b %d, %Y} – {end:%b %d, %Y}"
+    return period
+
+
+def _ns(value: Any) -> np.int64:
+    if isinstance(value, (int, np.integer)):
+        return np.int64(value)
+    return np.int64(pd.Timestamp(value).to_datetime64().astype("datetime64[ns]").view(np.int64))
+
+
+def _stamp_array(df: pd.DataFrame) -> np.ndarray:
+    """Timestamps as int64 nanoseconds (NaT sorts first)."""
+    if df.empty:
+        return np.empty(0, dtype=np.int64)
+    return df["transactionTimestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    """**df** ordered by timestamp (stable); returned as is if it already is."""
+    stamps = _stamp_array(df)
+    if len(stamps) < 2 or (stamps[1:] >= stamps[:-1]).all():
+        return df
+    return df.take(np.argsort(stamps, kind="stable")).reset_index(drop=True)
+
+
+def _concat(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """Concatenate keeping categorical columns categorical (codes are not remapped)."""
+    rows = rows.copy()
+    df = df.copy(deep=False)
+    for col in df.columns[df.dtypes == "category"]:
+        if col not in rows.columns:
+            continue
+        incoming = pd.Index(rows[col].dropna().unique()).astype(str)
+        extra = incoming.difference(df[col].cat.categories)
+        df[col] = df[col].cat.add_categories(extra) if len(extra) else df[col]
+        rows[col] = pd.Categorical(rows[col].astype(object), categories=df[col].cat.categories,
+                                   ordered=df[col].cat.ordered)
+    return pd.concat([df, rows], ignore_index=True)
+
+
+def _build_month_index(stamps: np.ndarray) -> Dict[str, Bounds]:
+    """Month → contiguous ``(start, stop)`` rows of the sorted timestamps, in one pass."""
+    if not len(stamps):
+        return {}
+    months = stamps.view("datetime64[ns]").astype("datetime64[M]")
+    starts = np.concatenate([[0], np.flatnonzero(months[1:] != months[:-1]) + 1])
+    stops = np.append(starts[1:], len(months))
+    labels = np.datetime_as_string(months[starts], unit="M")
+    return {str(label): (int(lo), int(hi)) for label, lo, hi in zip(labels, starts, stops)}
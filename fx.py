@@ -0,0 +1,164 @@
+"""fx.py – per‑day FX rates and vectorised conversion to one base currency
+=========================================================================
+
+Tapix exports mix currencies (EUR, HUF, RON, …), so sums of the raw
+``amount`` column are meaningless across rows.  :mod:`ingest` therefore adds
+an ``amount_base`` column at parse time – every amount converted to
+:data:`BASE_CURRENCY` at the rate of its transaction day – and all aggregates
+are built on that.
+
+Rates are a :class:`RateTable`: per currency, a sorted array of days and the
+matching rates quoted against one currency (EUR for ECB data).  A lookup is a
+``searchsorted`` for the last rate on or before the day, so weekends and
+holidays use Friday's rate.  Rates are loaded from ``TAPIX_FX_RATES`` when
+set, either
+
+* long format – ``date,currency,rate`` rows, or
+* wide format – ECB's ``eurofxref-hist.csv`` (``Date,USD,JPY,…``),
+
+with rates as *units of currency per 1 unit of the quote currency*.  Without a
+file a built‑in table of 2024 ECB averages is used.  A currency without any
+rate converts to NaN; it is logged once, and the aggregates count such rows
+(``unconverted``) so totals don't undercount silently.
+
+Environment
+-----------
+``TAPIX_BASE_CURRENCY`` – optional, default ``EUR``.
+``TAPIX_FX_RATES`` – optional path to a rates file.
+``TAPIX_FX_QUOTE`` – quote currency of that file, default ``EUR``.
+
+Usage (inside ingest.py)
+------------------------
+```python
+df["amount_base"] = default_rate_table().to_base(df["amount"], df["currency"], df["transactionTimestamp"])
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+BASE_CURRENCY = os.getenv("TAPIX_BASE_CURRENCY", "EUR").upper()
+RATES_PATH: Optional[Path] = Path(os.environ["TAPIX_FX_RATES"]) if os.getenv("TAPIX_FX_RATES") else None
+QUOTE_CURRENCY = os.getenv("TAPIX_FX_QUOTE", "EUR").upper()
+
+# ECB reference rates, 2024 annual averages (units per 1 EUR).  Approximate –
+# point TAPIX_FX_RATES at a daily file for exact conversion.
+BUILTIN_RATES: Dict[str, float] = {
+    "USD": 1.0824, "GBP": 0.8466, "CZK": 25.120, "PLN": 4.3058, "HUF": 395.30,
+    "RON": 4.9746, "AUD": 1.6397, "CAD": 1.4821, "CHF": 0.9526, "SEK": 11.433,
+    "NOK": 11.629, "DKK": 7.4589, "JPY": 163.85, "CNY": 7.7875, "SGD": 1.4458,
+    "INR": 90.556, "BGN": 1.9558, "TRY": 35.571,
+}
+
+Series = Tuple[np.ndarray, np.ndarray]  # (days as int64, rates), sorted by day
+
+log = logging.getLogger(__name__)
+_warned: Set[str] = set()  # currencies already logged as unconvertible
+
+
+class RateTable:
+    """Per‑day rates of each currency against **quote**, searched by binary search."""
+
+    def __init__(self, series: Dict[str, Series], quote: str, fingerprint: str) -> None:
+        self.series = series
+        self.quote = quote.upper()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def builtin(cls) -> "RateTable":
+        epoch = np.array([0], dtype=np.int64)
+        series = {cur: (epoch, np.array([rate])) for cur, rate in BUILTIN_RATES.items()}
+        return cls(series, "EUR", "builtin-2024")
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path], quote: str = QUOTE_CURRENCY) -> "RateTable":
+        """Load a long (``date,currency,rate``) or wide (ECB) rates CSV."""
+        raw = pd.read_csv(path, na_values=["N/A", ""], skipinitialspace=True)
+        raw.columns = raw.columns.str.strip()
+        lower = {c.lower(): c for c in raw.columns}
+        if {"date", "currency", "rate"} <= set(lower):
+            long = raw.rename(columns={lower["date"]: "date", lower["currency"]: "currency", lower["rate"]: "rate"})
+        else:
+            date_col = lower.get("date", raw.columns[0])
+            long = raw.melt(id_vars=[date_col], var_name="currency", value_name="rate")
+            long = long.rename(columns={date_col: "date"})
+        long = long.dropna(subset=["rate"])
+        long["day"] = _days(pd.to_datetime(long["date"], errors="coerce"))
+        long = long[long["rate"] > 0].sort_values(["currency", "day"], kind="stable")
+        series: Dict[str, Series] = {}
+        for currency, group in long.groupby(long["currency"].astype(str).str.strip().str.upper(), sort=False):
+            series[currency] = (group["day"].to_numpy(np.int64), group["rate"].to_numpy(np.float64))
+        with open(path, "rb") as fh:
+            fingerprint = hashlib.sha256(fh.read()).hexdigest()[:16]
+        return cls(series, quote, fingerprint)
+
+    # ------------------------------------------------------------------ lookups
+    def rates(self, currency: str, days: np.ndarray) -> np.ndarray:
+        """Units of **currency** per 1 quote unit on each of **days** (NaN if unknown)."""
+        currency = str(currency).upper()
+        if currency == self.quote:
+            return np.ones(len(days))
+        series = self.series.get(currency)
+        if series is None:
+            return np.full(len(days), np.nan)
+        known_days, values = series
+        # Each distinct day is searched once, however many rows share it
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        idx = np.searchsorted(known_days, unique_days, side="right") - 1
+        return values[np.clip(idx, 0, None)][inverse.ravel()]
+
+    def to_base(
+        self, amounts: pd.Series, currencies: pd.Series, stamps: pd.Series, base: str = BASE_CURRENCY,
+    ) -> np.ndarray:
+        """Vectorised conversion of **amounts** to **base**; missing currency counts as base."""
+        values = pd.to_numeric(amounts, errors="coerce").to_numpy(np.float64)
+        out = values.copy()
+        if not len(values):
+            return out
+        codes, uniques = pd.factorize(currencies.astype(object).str.strip().str.upper())
+        foreign = [(i, cur) for i, cur in enumerate(uniques) if cur != base]
+        if not foreign:
+            return out
+        days = _days(stamps)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        for i, currency in foreign:
+            rows = order[bounds[i]:bounds[i + 1]]
+            row_days = days[rows]
+            out[rows] = values[rows] * self.rates(base, row_days) / self.rates(currency, row_days)
+            if currency not in _warned and np.isnan(out[rows]).any() and np.isfinite(values[rows]).any():
+                _warned.add(currency)
+                missing = int(np.count_nonzero(np.isnan(out[rows]) & np.isfinite(values[rows])))
+                log.warning("No FX rate from %s to %s: %d rows left out of totals", currency, base, missing)
+        return out
+
+
+@lru_cache(maxsize=1)
+def default_rate_table() -> RateTable:
+    """The table from ``TAPIX_FX_RATES``, or the built‑in averages."""
+    if RATES_PATH is not None:
+        return RateTable.from_file(RATES_PATH)
+    return RateTable.builtin()
+
+
+def fx_fingerprint() -> str:
+    """Identifies the base currency + rates, for keying caches of converted data."""
+    return f"{BASE_CURRENCY}-{default_rate_table().fingerprint}"
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _days(stamps: pd.Series) -> np.ndarray:
+    """Days since the epoch (NaT → 0) as int64."""
+    days = pd.Series(stamps).to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    return np.where(np.isnat(days), np.datetime64(0, "D"), days).astype(np.int64)
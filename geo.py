@@ -0,0 +1,274 @@
+"""geo.py – grid index over shop coordinates and pre‑binned spend tiles
+====================================================================
+
+Every Tapix row carries the shop's ``lat`` / ``long``.  :class:`GeoIndex`
+builds two structures from them when the dataset is loaded:
+
+* a **point index** – row positions sorted by their cell in the finest grid
+  level, so the rows of any cell (or a run of neighbouring cells in one grid
+  row) are a single ``searchsorted`` range.  :meth:`GeoIndex.nearby` only
+  measures distances for the cells around the query point;
+* a **tile pyramid** – for every level in :data:`LEVELS` (cells of 8° down
+  to 1/32°, about 3.5 km), spend, count and centroid per ``(month, cell)``.
+  :meth:`GeoIndex.viewport` picks the finest level that keeps a view under
+  :data:`MAX_TILES` tiles and reads the pre‑binned cells, so panning and
+  zooming cost O(tiles in view) rather than O(points).
+
+Both are additive: appended rows are binned on their own and merged into the
+touched tiles.  Cells are plain lat/long grid squares (an equirectangular
+geohash), and bounding boxes do not wrap around the antimeridian.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+geo = GeoIndex(df)
+geo.viewport((45.0, 5.0, 55.0, 20.0), months=["2024-02"])   # south, west, north, east
+geo.nearby(df, 50.08, 14.42, radius_km=2)
+geo.append(df, start=old_len)
+```
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Cell size in degrees per level, coarse → fine
+LEVELS: List[float] = [8.0, 2.0, 0.5, 0.125, 1 / 32]
+MAX_TILES = 2048
+_EARTH_KM = 6371.0
+_KM_PER_DEGREE = 111.195
+
+BBox = Tuple[float, float, float, float]  # south, west, north, east
+WORLD: BBox = (-90.0, -180.0, 90.0, 180.0)
+_MEASURES = {"spend": "sum", "count": "sum", "lat_sum": "sum", "long_sum": "sum", "place": "first"}
+
+
+class GeoIndex:
+    """Point index and per‑month tile pyramid over one dataset's coordinates."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        lat, long, positions = _points(df, 0)
+        cells = _cell_ids(lat, long, LEVELS[-1])
+        order = np.argsort(cells, kind="stable")
+        self._cells = cells[order]
+        self._positions = positions[order]
+        self._tiles = _bin_levels(df, positions, LEVELS)
+        self._history: Dict[int, pd.DataFrame] = {}
+        self._monthly: Dict[int, Dict[str, pd.DataFrame]] = {}
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def nbytes(self) -> int:
+        tiles = sum(int(t.memory_usage(deep=True).sum()) for t in self._tiles)
+        return self._cells.nbytes + self._positions.nbytes + tiles
+
+    def level_for(self, bbox: BBox, max_tiles: int = MAX_TILES) -> int:
+        """Finest level whose grid over **bbox** stays within **max_tiles** cells."""
+        south, west, north, east = bbox
+        for level in range(len(LEVELS) - 1, 0, -1):
+            size = LEVELS[level]
+            if ((north - south) / size + 1) * ((east - west) / size + 1) <= max_tiles:
+                return level
+        return 0
+
+    def tiles(self, level: int, months: Optional[Iterable[str]] = None, bbox: Optional[BBox] = None) -> pd.DataFrame:
+        """Non‑empty tiles of **level** (optionally for **months** and inside **bbox**).
+
+        Columns: ``lat``/``long`` (spend centroid), ``spend``, ``count``,
+        ``place`` (a city in the tile), ``south``/``west`` (tile corner).
+        """
+        if months is None:
+            cells = self._history.get(level)
+            if cells is None:
+                cells = self._history[level] = self._tiles[level].groupby(level="cell").agg(_MEASURES)
+        else:
+            months = list(months)
+            if len(months) == 1:
+                cells = self._month_cells(level, months[0])
+            else:
+                tiles = self._tiles[level]
+                tiles = tiles[tiles.index.get_level_values("month").isin(months)]
+                cells = tiles.groupby(level="cell").agg(_MEASURES)
+        return _tile_frame(cells, LEVELS[level], bbox)
+
+    def viewport(
+        self, bbox: BBox = WORLD, months: Optional[Iterable[str]] = None, max_tiles: int = MAX_TILES,
+    ) -> Tuple[int, pd.DataFrame]:
+        """``(level, tiles)`` for a map view of **bbox**, from the pre‑binned pyramid."""
+        level = self.level_for(bbox, max_tiles)
+        return level, self.tiles(level, months, bbox)
+
+    def bbox_totals(self, bbox: BBox, months: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Spend and count inside **bbox**, to the precision of the finest tiles."""
+        tiles = self.tiles(len(LEVELS) - 1, months, bbox)
+        return {"spend": float(tiles["spend"].sum()), "count": int(tiles["count"].sum())}
+
+    def nearby(
+        self, df: pd.DataFrame, lat: float, long: float, radius_km: float = 1.0, limit: int = 10,
+    ) -> pd.DataFrame:
+        """Merchants within **radius_km** of a point, nearest first, with visits and spend."""
+        positions = self._positions_near(lat, long, radius_km)
+        if not len(positions):
+            return pd.DataFrame(columns=["merchant", "category", "distance_km", "visits", "spend"])
+        rows = df.take(positions)
+        distance = distance_km(rows["lat"].to_numpy(dtype=float), rows["long"].to_numpy(dtype=float), lat, long)
+        inside = distance <= radius_km
+        rows = rows[inside].assign(distance_km=distance[inside])
+        keys = rows["merchantUid"].astype(object).fillna(rows["merchant"].astype(object))
+        grouped = rows.groupby(keys.to_numpy(), sort=False).agg(
+            merchant=("merchant", "first"), category=("category", "first"),
+            distance_km=("distance_km", "min"), visits=("distance_km", "size"), spend=("amount_base", "sum"),
+        )
+        grouped["merchant"] = grouped["merchant"].astype(object)
+        grouped["category"] = grouped["category"].astype(object)
+        return grouped.sort_values("distance_km").head(max(int(limit), 1)).reset_index(drop=True)
+
+    # ------------------------------------------------------------------ updates
+    def append(self, df: pd.DataFrame, start: int) -> None:
+        """Index ``df.iloc[start:]`` – rows just appended to **df**."""
+        lat, long, positions = _points(df, start)
+        if not len(positions):
+            return
+        cells = _cell_ids(lat, long, LEVELS[-1])
+        order = np.argsort(cells, kind="stable")
+        at = np.searchsorted(self._cells, cells[order], side="right")
+        self._cells = np.insert(self._cells, at, cells[order])
+        self._positions = np.insert(self._positions, at, positions[order])
+        for level, new in enumerate(_bin_levels(df, positions, LEVELS)):
+            touched = self._tiles[level].index.isin(new.index)
+            merged = pd.concat([self._tiles[level][touched], new]).groupby(level=["month", "cell"], sort=False).agg(_MEASURES)
+            self._tiles[level] = pd.concat([self._tiles[level][~touched], merged])
+        self._history.clear()
+        self._monthly.clear()
+
+    # ------------------------------------------------------------------ helpers
+    def _month_cells(self, level: int, month: str) -> pd.DataFrame:
+        """Cells of one month at **level**; the level is split by month once, not per view."""
+        monthly = self._monthly.get(level)
+        if monthly is None:
+            monthly = self._monthly[level] = {
+                str(key): cells.droplevel("month")
+                for key, cells in self._tiles[level].groupby(level="month", sort=False)
+            }
+        cells = monthly.get(str(month))
+        return cells if cells is not None else self._tiles[level].iloc[:0].droplevel("month")
+
+    def _positions_near(self, lat: float, long: float, radius_km: float) -> np.ndarray:
+        """Row positions in the finest cells overlapping the radius' bounding box."""
+        size = LEVELS[-1]
+        dlat = radius_km / _KM_PER_DEGREE
+        dlong = min(radius_km / (_KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6)), 180.0)
+        south, west, north, east = _clip((lat - dlat, long - dlong, lat + dlat, long + dlong))
+        (r0, c0), (r1, c1) = _row_col(south, west, size), _row_col(north, east, size)
+        ncols = _ncols(size)
+        starts = np.arange(r0, r1 + 1, dtype=np.int64) * ncols
+        lo = np.searchsorted(self._cells, starts + c0, side="left")
+        hi = np.searchsorted(self._cells, starts + c1, side="right")
+        if not (hi > lo).any():
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._positions[a:b] for a, b in zip(lo, hi) if b > a])
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def bin_rows(rows: pd.DataFrame, level: int, bbox: Optional[BBox] = None) -> pd.DataFrame:
+    """Tiles of an arbitrary row slice (e.g. a custom date range), same columns as :meth:`GeoIndex.tiles`."""
+    _, _, positions = _points(rows, 0)
+    cells = _bin_levels(rows, positions, [LEVELS[level]])[0].groupby(level="cell").agg(_MEASURES)
+    return _tile_frame(cells, LEVELS[level], bbox)
+
+
+def distance_km(lat: np.ndarray, long: np.ndarray, lat0: float, long0: float) -> np.ndarray:
+    """Haversine distance of every point from ``(lat0, long0)`` (NaN without coordinates)."""
+    lat1, long1, lat2, long2 = map(np.radians, (lat, long, lat0, long0))
+    a = np.sin((lat1 - lat2) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long1 - long2) / 2) ** 2
+    return 2 * _EARTH_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def tile_bbox(south: float, west: float, level: int, pad: int = 1) -> BBox:
+    """Bounding box of one tile, grown by **pad** tiles on every side."""
+    size = LEVELS[level]
+    return _clip((south - pad * size, west - pad * size, south + (pad + 1) * size, west + (pad + 1) * size))
+
+
+def tile_grid(bbox: BBox, level: int) -> Tuple[np.ndarray, np.ndarray]:
+    """South edges of the tile rows and west edges of the tile columns covering **bbox**."""
+    size = LEVELS[level]
+    south, west, north, east = _clip(bbox)
+    (r0, c0), (r1, c1) = _row_col(south, west, size), _row_col(north, east, size)
+    return np.arange(int(r0), int(r1) + 1) * size - 90, np.arange(int(c0), int(c1) + 1) * size - 180
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _points(df: pd.DataFrame, start: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """``lat``, ``long`` and row positions of rows ``start:`` with usable coordinates."""
+    lat = df["lat"].to_numpy(dtype=float)[start:]
+    long = df["long"].to_numpy(dtype=float)[start:]
+    valid = np.isfinite(lat) & np.isfinite(long) & (np.abs(lat) <= 90) & (np.abs(long) <= 180)
+    positions = np.flatnonzero(valid).astype(np.int64) + start
+    return lat[valid], long[valid], positions
+
+
+def _ncols(size: float) -> int:
+    return int(round(360 / size))
+
+
+def _row_col(lat, long, size: float):
+    rows = np.clip(np.floor((np.asarray(lat) + 90) / size), 0, int(round(180 / size)) - 1).astype(np.int64)
+    cols = np.clip(np.floor((np.asarray(long) + 180) / size), 0, _ncols(size) - 1).astype(np.int64)
+    return rows, cols
+
+
+def _cell_ids(lat: np.ndarray, long: np.ndarray, size: float) -> np.ndarray:
+    rows, cols = _row_col(lat, long, size)
+    return rows * _ncols(size) + cols
+
+
+def _bin_levels(df: pd.DataFrame, positions: np.ndarray, sizes: List[float]) -> List[pd.DataFrame]:
+    """Spend, count, coordinate sums and a place name per ``(month, cell)``, for each cell size."""
+    rows = df.take(positions)
+    lat, long = rows["lat"].to_numpy(dtype=float), rows["long"].to_numpy(dtype=float)
+    frame = pd.DataFrame({
+        "month": rows["month"].astype(str).to_numpy(),
+        "spend": np.nan_to_num(rows["amount_base"].to_numpy(dtype=float)),
+        "count": np.ones(len(rows), dtype=np.int64),
+        "lat_sum": lat,
+        "long_sum": long,
+        "place": rows["city"].astype(object).fillna(rows["country"].astype(object)).to_numpy(),
+    })
+    return [
+        frame.assign(cell=_cell_ids(lat, long, size)).groupby(["month", "cell"], sort=False).agg(_MEASURES)
+        for size in sizes
+    ]
+
+
+def _tile_frame(cells: pd.DataFrame, size: float, bbox: Optional[BBox]) -> pd.DataFrame:
+    ids = cells.index.to_numpy(dtype=np.int64)
+    rows, cols = np.divmod(ids, _ncols(size))
+    south, west = rows * size - 90, cols * size - 180
+    if bbox is not None:
+        b_south, b_west, b_north, b_east = bbox
+        keep = (south + size > b_south) & (south < b_north) & (west + size > b_west) & (west < b_east)
+        cells, south, west = cells[keep], south[keep], west[keep]
+    count = cells["count"].to_numpy(dtype=float)
+    return pd.DataFrame({
+        "lat": cells["lat_sum"].to_numpy() / count,
+        "long": cells["long_sum"].to_numpy() / count,
+        "spend": cells["spend"].to_numpy(dtype=float),
+        "count": count.astype(np.int64),
+        "place": cells["place"].to_numpy(),
+        "south": south,
+        "west": west,
+    }, index=cells.index)
+
+
+def _clip(bbox: BBox) -> BBox:
+    south, west, north, east = bbox
+    return max(south, -90.0), max(west, -180.0), min(north, 90.0), min(east, 180.0)
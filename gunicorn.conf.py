@@ -0,0 +1,63 @@
+"""gunicorn.conf.py – production server config for the Tapix Dash app
+===================================================================
+
+Serves ``app:server`` from several worker processes while keeping one copy of
+the transaction data per node:
+
+* ``preload_app`` imports *app.py* in the master, so the CSV → Arrow load, the
+  month index and the aggregate cube are built **once** before forking.
+* The frame's columns are views of the read‑only, memory‑mapped Arrow cache
+  (see *ingest.py*); workers inherit the mapping and share its pages through
+  the OS page cache instead of holding private copies.
+* ``gc.freeze()`` moves everything loaded so far out of the collector's reach,
+  so garbage collections in the workers don't write to (and copy) the
+  inherited pages.
+* Chat replies stream on the worker that received the message, but the
+  browser's polls can land on any worker; *chat_jobs.py* mirrors each job to
+  a file under the cache dir so every worker can answer them (no sticky
+  routing needed).
+* ``post_fork`` drops the OpenAI clients so no worker reuses connections
+  opened by the master, and lets the first worker prewarm the reply cache
+  (no threads run in the master while it forks).
+
+Environment
+-----------
+``PORT`` – listen port, default ``8050``.
+``WEB_CONCURRENCY`` – worker processes, default ``2 × CPUs + 1``.
+``TAPIX_WORKER_THREADS`` – threads per worker, default ``4``.
+
+Usage
+-----
+```bash
+gunicorn app:server          # picks up ./gunicorn.conf.py automatically
+```
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8050')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Callbacks are short (LLM replies run on chat_jobs' loop), threads cover the polling
+worker_class = "gthread"
+threads = int(os.getenv("TAPIX_WORKER_THREADS", "4"))
+preload_app = True
+timeout = 60
+accesslog = "-"
+
+
+def when_ready(server):
+    """Master has imported the app: freeze its heap before the first fork."""
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Give each worker its own HTTP clients; the dataset stays shared."""
+    from backend import reset_client
+
+    reset_client()
+    if worker.age == 1:  # first worker only, respawns don't repeat it
+        from app import start_prewarm
+
+        start_prewarm()
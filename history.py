@@ -0,0 +1,183 @@
+"""history.py – bounded conversation memory with a rolling summary
+=================================================================
+
+``chat-store`` keeps the whole session, but sending all of it every turn
+makes prompts (and latency) grow with session length.  :class:`ConversationMemory`
+keeps the last N turns verbatim and folds everything older into a summary.
+
+The summary is **incremental**: summaries are cached by a chained hash of the
+message prefix they cover, so a turn only summarises the few messages that
+just fell out of the window, on top of the previous summary.  Token counts
+are cached under the same hashes, so a turn only tokenizes new messages.
+When the summarizer fails, the turn uses an offline fallback summary that is
+not cached, so the next turn retries summarisation.
+
+Environment
+-----------
+``TAPIX_HISTORY_TURNS`` – user/assistant turns kept verbatim, default ``4``.
+``TAPIX_HISTORY_TOKENS`` – token cap for summary + kept messages, default ``1500``.
+
+Usage (inside app.py)
+---------------------
+```python
+memory = ConversationMemory(summarize_conversation, asummarize_conversation)
+compact_history = await memory.acompact(chat_history)
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from context import count_tokens
+
+HISTORY_TURNS = int(os.getenv("TAPIX_HISTORY_TURNS", "4"))
+HISTORY_TOKENS = int(os.getenv("TAPIX_HISTORY_TOKENS", "1500"))
+# Room reserved for the summary inside the token cap
+SUMMARY_TOKENS = 256
+# Characters per message kept by the offline fallback summary
+FALLBACK_SNIPPET = 160
+# Messages whose token count is remembered (across all sessions)
+COST_CACHE_SIZE = 16384
+
+Message = Dict[str, str]
+Summarizer = Callable[[str, List[Message]], str]
+AsyncSummarizer = Callable[[str, List[Message]], Awaitable[str]]
+
+
+class ConversationMemory:
+    """Window + rolling summary over a chat history, with a prefix‑hash cache."""
+
+    def __init__(
+        self,
+        summarize: Optional[Summarizer] = None,
+        asummarize: Optional[AsyncSummarizer] = None,
+        *,
+        turns: int = HISTORY_TURNS,
+        token_cap: int = HISTORY_TOKENS,
+        cache_size: int = 1024,
+    ) -> None:
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.turns = turns
+        self.token_cap = token_cap
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._costs: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ public
+    def compact(self, chat_history: List[Message]) -> List[Message]:
+        """Return the bounded history to send to the model."""
+        cutoff, base, summary, hashes = self._plan(chat_history)
+        if base < cutoff:
+            folded = chat_history[base:cutoff]
+            try:
+                new_summary = self.summarize(summary, folded) if self.summarize else ""
+            except Exception:
+                new_summary = ""
+            summary = self._settle(hashes[cutoff], new_summary, summary, folded, self.summarize is not None)
+        return _assemble(summary, chat_history[cutoff:])
+
+    async def acompact(self, chat_history: List[Message]) -> List[Message]:
+        """Async :meth:`compact`, summarising with **asummarize** if given."""
+        if self.asummarize is None:
+            return self.compact(chat_history)
+        cutoff, base, summary, hashes = self._plan(chat_history)
+        if base < cutoff:
+            folded = chat_history[base:cutoff]
+            try:
+                new_summary = await self.asummarize(summary, folded)
+            except Exception:
+                new_summary = ""
+            summary = self._settle(hashes[cutoff], new_summary, summary, folded, True)
+        return _assemble(summary, chat_history[cutoff:])
+
+    # ------------------------------------------------------------------ helpers
+    def _plan(self, chat_history: List[Message]) -> Tuple[int, int, str, List[str]]:
+        """Pick the window cutoff and the longest already‑summarised prefix."""
+        n = len(chat_history)
+        cutoff = max(0, n - 2 * self.turns)
+        hashes = _prefix_hashes(chat_history)
+        costs = self._costs_of(chat_history, hashes)
+        budget = self.token_cap - SUMMARY_TOKENS
+        window_cost = sum(costs[cutoff:])
+        # Always keep the latest message, even if it alone exceeds the cap
+        while cutoff < n - 1 and window_cost > budget:
+            window_cost -= costs[cutoff]
+            cutoff += 1
+
+        with self._lock:
+            for base in range(cutoff, 0, -1):
+                summary = self._summaries.get(hashes[base])
+                if summary is not None:
+                    self._summaries.move_to_end(hashes[base])
+                    return cutoff, base, summary, hashes
+        return cutoff, 0, "", hashes
+
+    def _costs_of(self, chat_history: List[Message], hashes: List[str]) -> List[int]:
+        """Token cost of every message, keyed by the prefix hash ending at it."""
+        with self._lock:
+            costs = [self._costs.get(key) for key in hashes[1:]]
+        fresh = {}
+        for i, cost in enumerate(costs):
+            if cost is None:
+                costs[i] = fresh[hashes[i + 1]] = count_tokens(chat_history[i].get("content", "")) + 4
+        with self._lock:
+            for key in hashes[1:]:
+                if key in self._costs:
+                    self._costs.move_to_end(key)
+            self._costs.update(fresh)
+            while len(self._costs) > COST_CACHE_SIZE:
+                self._costs.popitem(last=False)
+        return costs
+
+    def _settle(self, key: str, new_summary: str, previous: str, folded: List[Message], retry: bool) -> str:
+        """The summary to use this turn; a fallback standing in for a failed summarizer is not cached."""
+        if new_summary:
+            self._remember(key, new_summary)
+            return new_summary
+        summary = _fallback_summary(previous, folded)
+        if not retry:
+            self._remember(key, summary)
+        return summary
+
+    def _remember(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._summaries[key] = summary
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+
+
+def _prefix_hashes(chat_history: List[Message]) -> List[str]:
+    """``hashes[k]`` identifies ``chat_history[:k]`` – O(n) via a hash chain."""
+    hashes = [""]
+    for msg in chat_history:
+        digest = hashlib.sha256()
+        digest.update(hashes[-1].encode())
+        digest.update(f"\x00{msg.get('role')}\x00{msg.get('content')}".encode("utf-8"))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def _assemble(summary: str, window: List[Message]) -> List[Message]:
+    if not summary:
+        return list(window)
+    return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] + list(window)
+
+
+def _fallback_summary(previous: str, folded: List[Message]) -> str:
+    """Offline summary: previous summary plus clipped lines, capped in size."""
+    lines = [previous] if previous else []
+    for msg in folded:
+        text = " ".join(str(msg.get("content", "")).split())
+        if len(text) > FALLBACK_SNIPPET:
+            text = text[:FALLBACK_SNIPPET] + "…"
+        lines.append(f"- {msg.get('role')}: {text}")
+    summary = "\n".join(lines)
+    while count_tokens(summary) > SUMMARY_TOKENS and "\n" in summary:
+        summary = summary.split("\n", 1)[1]
+    return summary
@@ -0,0 +1,303 @@
+"""ingest.py – Tapix enriched export → typed, cached columnar frame
+=================================================================
+
+The raw Tapix export is awkward to read directly: it starts with a banner
+line (``Tapix's enriched data,,,,``) before the real header, some header
+names carry trailing spaces (``city ``, ``zip ``, ``country ``) and the column
+names do not match what the Dash callbacks expect.  Amounts also come in
+mixed currencies; ``amount_base`` holds each one converted to the base
+currency (see :mod:`fx`), and ``co2_kg`` the CO₂ footprint normalised to
+kilograms whatever ``co2FootprintUnit`` says (g, kg, t).  ``tags`` keeps the
+raw array literal as a categorical, so :mod:`tags` parses each distinct
+literal once.
+
+This module parses the export **once** into typed columns and writes the
+result to an Arrow IPC (Feather v2) file keyed on the SHA‑256 of the source
+file's content.  Later startups memory‑map that file instead of re‑parsing the
+CSV.
+
+Numeric, timestamp and string columns of the returned frame are zero‑copy
+views of that read‑only mapping, so every process that loads the same
+export (or inherits it across ``fork``, see *gunicorn.conf.py*) shares one copy
+in the OS page cache.  Only the codes of categoricals with missing values are
+materialised per process.
+
+Environment
+-----------
+``TAPIX_CACHE_DIR`` – optional, default ``.cache`` next to this file.
+
+Usage (inside app.py)
+---------------------
+```python
+from ingest import load_transactions
+df = load_transactions("Tapix enriched data sample.csv")
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from fx import default_rate_table, fx_fingerprint
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.feather as feather  # type: ignore
+except ImportError:  # pragma: no cover - cache is an optimisation only
+    pa = None
+    feather = None
+
+# ----------------------------------------------------------------------------------
+# Schema
+# ----------------------------------------------------------------------------------
+
+# Bump whenever the derived schema changes so stale caches are ignored.
+SCHEMA_VERSION = 6
+
+DEFAULT_CACHE_DIR = Path(os.getenv("TAPIX_CACHE_DIR", Path(__file__).with_name(".cache")))
+
+# Raw Tapix header → name used by the app
+COLUMN_RENAMES: Dict[str, str] = {
+    "name": "merchant",
+    "categoryName": "category",
+    "logo": "merchant_logo",
+    "categoryLogo": "category_logo",
+}
+
+# Low‑cardinality text columns, stored as dictionaries in memory and on disk
+CATEGORICAL_COLUMNS: List[str] = [
+    "merchantUid", "merchant", "shopType", "category", "category_logo",
+    "merchant_logo", "city", "country", "coordinatesType", "co2FootprintUnit",
+    "currency", "tags",
+]
+FLOAT_COLUMNS: List[str] = ["lat", "long", "co2FootprintValue", "co2_kg", "amount", "amount_base"]
+# Built here rather than read from the export
+DERIVED_COLUMNS: List[str] = ["transactionTimestamp", "month", "address", "amount_base", "co2_kg"]
+
+# co2FootprintUnit (lower‑cased) → kilograms; a missing unit means kg
+CO2_UNIT_FACTORS: Dict[str, float] = {
+    "g": 1e-3, "gram": 1e-3, "grams": 1e-3, "gco2": 1e-3, "gco2e": 1e-3,
+    "kg": 1.0, "kilogram": 1.0, "kilograms": 1.0, "kgco2": 1.0, "kgco2e": 1.0,
+    "t": 1e3, "ton": 1e3, "tons": 1e3, "tonne": 1e3, "tonnes": 1e3, "tco2": 1e3, "tco2e": 1e3,
+}
+
+# Column order of the frame handed to app.py
+OUTPUT_COLUMNS: List[str] = [
+    "transactionTimestamp", "month", "amount", "currency", "amount_base", "merchant",
+    "merchantUid", "shopUid", "shopType", "category", "tags", "merchant_logo",
+    "category_logo", "address", "street", "city", "zip", "country",
+    "coordinatesType", "lat", "long", "url", "googlePlaceId",
+    "co2FootprintValue", "co2FootprintUnit", "co2_kg", "sourceId",
+]
+
+_TZ_SUFFIX = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+def empty_transactions() -> pd.DataFrame:
+    """Return an empty frame with the same columns/dtypes as a parsed export."""
+    df = pd.DataFrame({col: pd.Series(dtype="object") for col in OUTPUT_COLUMNS})
+    df["transactionTimestamp"] = pd.Series(dtype="datetime64[ns]")
+    df["month"] = pd.Series(dtype="str")
+    for col in FLOAT_COLUMNS:
+        df[col] = pd.Series(dtype="float64")
+    return df
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def load_transactions(
+    csv_path: Union[str, Path],
+    *,
+    cache_dir: Optional[Union[str, Path]] = DEFAULT_CACHE_DIR,
+    stem: Optional[Path] = None,
+) -> pd.DataFrame:
+    """Return the typed transaction frame for **csv_path**, using the cache.
+
+    Parameters
+    ----------
+    csv_path
+        Path to the raw Tapix enriched export.
+    cache_dir
+        Where Arrow caches live.  ``None`` disables caching entirely.
+    stem
+        :func:`cache_stem` of **csv_path** if the caller already has it, so
+        the export is not hashed again.
+    """
+    csv_path = Path(csv_path)
+    if cache_dir is None or feather is None:
+        return parse_transactions(csv_path)
+
+    stem = stem or cache_stem(csv_path, cache_dir=cache_dir)
+    cache_path = stem.with_name(f"{stem.name}.arrow")
+    if cache_path.exists():
+        try:
+            return _read_cache(cache_path)
+        except (OSError, pa.ArrowInvalid):
+            cache_path.unlink(missing_ok=True)
+
+    df = parse_transactions(csv_path)
+    _write_cache(df, cache_path)
+    return df
+
+
+def parse_transactions(csv_path: Union[str, Path]) -> pd.DataFrame:
+    """Parse the raw export into the schema the app expects (no caching)."""
+    csv_path = Path(csv_path)
+    with open(csv_path, encoding="utf-8-sig") as fh:
+        first_line = fh.readline()
+    skiprows = 0 if "transactionTimestamp" in first_line else 1
+
+    raw = pd.read_csv(
+        csv_path,
+        skiprows=skiprows,
+        encoding="utf-8-sig",
+        dtype=str,
+        keep_default_na=False,
+        na_values=[""],
+    )
+    raw.columns = raw.columns.str.strip()
+    raw = raw.rename(columns=COLUMN_RENAMES)
+    for col in OUTPUT_COLUMNS:
+        if col not in raw.columns and col not in DERIVED_COLUMNS:
+            raw[col] = None
+
+    # Timestamps keep the local wall‑clock time of the purchase; the offset only
+    # differs per merchant country and would shift month boundaries otherwise.
+    stamps = raw["transactionTimestamp"].str.replace(_TZ_SUFFIX, "", regex=True)
+    raw["transactionTimestamp"] = pd.to_datetime(stamps, format="ISO8601", errors="coerce")
+    # Sorted by time so every month / date range is one contiguous block (dataset.py)
+    raw = (
+        raw[raw["transactionTimestamp"].notna()]
+        .sort_values("transactionTimestamp", kind="stable")
+        .reset_index(drop=True)
+    )
+    raw["month"] = _month_labels(raw["transactionTimestamp"])
+
+    for col in FLOAT_COLUMNS:
+        if col not in DERIVED_COLUMNS:
+            raw[col] = pd.to_numeric(raw[col], errors="coerce")
+    # Every amount in the base currency at its day's rate, so sums across currencies hold
+    raw["amount_base"] = default_rate_table().to_base(raw["amount"], raw["currency"], raw["transactionTimestamp"])
+    raw["address"] = _join_address(raw)
+    for col in CATEGORICAL_COLUMNS:
+        raw[col] = raw[col].astype("category")
+    raw["co2_kg"] = raw["co2FootprintValue"].to_numpy(dtype="float64") * _co2_factors(raw["co2FootprintUnit"])
+
+    return raw[OUTPUT_COLUMNS]
+
+
+def cache_stem(
+    csv_path: Union[str, Path],
+    *,
+    cache_dir: Optional[Union[str, Path]] = DEFAULT_CACHE_DIR,
+) -> Optional[Path]:
+    """Cache key of **csv_path** as a path without suffix; ``None`` when caching is disabled.
+
+    Hashes the whole export, so callers needing both the frame and a sidecar
+    compute it once and pass it to :func:`load_transactions` and
+    :func:`sidecar_path`.
+    """
+    if cache_dir is None:
+        return None
+    # Converted amounts depend on the rate table too, so it is part of the key
+    return Path(cache_dir) / f"transactions-v{SCHEMA_VERSION}-{file_digest(csv_path)}-{fx_fingerprint()}"
+
+
+def sidecar_path(
+    csv_path: Union[str, Path],
+    name: str,
+    *,
+    cache_dir: Optional[Union[str, Path]] = DEFAULT_CACHE_DIR,
+    stem: Optional[Path] = None,
+) -> Optional[Path]:
+    """Where an index derived from **csv_path**'s rows is cached, next to the Arrow cache.
+
+    The path carries the same key as the Arrow cache, so it goes stale together
+    with it.  ``None`` when caching is disabled.
+    """
+    stem = stem or cache_stem(csv_path, cache_dir=cache_dir)
+    if stem is None:
+        return None
+    return stem.with_name(f"{stem.name}.{name}")
+
+
+def file_digest(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """Return the hex SHA‑256 of **path**'s content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _month_labels(stamps: pd.Series) -> pd.Categorical:
+    """Vectorised ``YYYY-MM`` labels as an ordered categorical."""
+    months = stamps.to_numpy(dtype="datetime64[ns]").astype("datetime64[M]")
+    uniques, codes = np.unique(months, return_inverse=True)
+    labels = np.datetime_as_string(uniques, unit="M").tolist()
+    return pd.Categorical.from_codes(codes.ravel(), categories=labels, ordered=True)
+
+
+def _co2_factors(units: pd.Series) -> np.ndarray:
+    """Per‑row kg factor of a categorical unit column (unknown units → NaN)."""
+    names = units.cat.categories.astype(str).str.lower().str.replace("₂", "2").str.replace(r"\s+", "", regex=True)
+    per_category = np.array([CO2_UNIT_FACTORS.get(name, np.nan) for name in names] + [1.0])
+    # Code -1 (missing unit) picks the trailing 1.0
+    return per_category[units.cat.codes.to_numpy()]
+
+
+def _join_address(df: pd.DataFrame) -> pd.Series:
+    """Build ``street, zip city, country`` without per‑row Python."""
+    locality = (df["zip"].fillna("") + " " + df["city"].fillna("")).str.strip()
+    address = df["street"].fillna("") + ", " + locality + ", " + df["country"].fillna("")
+    address = address.str.replace(r"(?:, ){2,}", ", ", regex=True).str.strip(", ")
+    return address.where(address != "", None)
+
+
+def _read_cache(cache_path: Path) -> pd.DataFrame:
+    table = feather.read_table(cache_path, memory_map=True)
+    return table.to_pandas(split_blocks=True, types_mapper=_arrow_types)
+
+
+def _arrow_types(arrow_type: "pa.DataType") -> Optional[pd.api.extensions.ExtensionDtype]:
+    """Keep strings Arrow‑backed (views into the mapping) instead of Python objects."""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return _STRING_DTYPE
+    return None
+
+
+def _string_dtype() -> pd.api.extensions.ExtensionDtype:
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)  # pandas ≥ 2.3
+    except TypeError:  # pragma: no cover - pandas 2.2
+        return pd.StringDtype("pyarrow_numpy")
+
+
+_STRING_DTYPE = _string_dtype()
+
+
+def _write_cache(df: pd.DataFrame, cache_path: Path) -> None:
+    """Atomically write **df** as uncompressed Arrow IPC (mmap‑friendly)."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # NaN stays a value rather than a null so floats read back zero‑copy
+        for col in FLOAT_COLUMNS:
+            values = pa.array(df[col].to_numpy(dtype="float64"), from_pandas=False)
+            table = table.set_column(table.schema.get_field_index(col), col, values)
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, cache_path)
+    except OSError:  # pragma: no cover - read‑only deploys just skip the cache
+        pass
@@ -0,0 +1,289 @@
+"""logos.py – local merchant / category logo thumbnails
+=====================================================
+
+Transaction rows used to embed the full‑size S3 ``merchant_logo`` and
+``category_logo`` URLs, so the browser downloaded dozens of remote images on
+every month switch only to draw them at 2em.  :func:`logo_url` now points the
+``html.Img`` at ``/logos/<kind>/<key>`` on the app, where:
+
+* each distinct logo (per ``merchantUid`` or category) is fetched **once**
+  through a pluggable :class:`LogoFetcher`,
+* resized to every size in :data:`THUMB_SIZES` (the smallest of PNG, WebP
+  and JPEG, via Pillow if installed; otherwise the original bytes are kept),
+* stored on disk under the SHA‑256 of the source URL, and
+* served with ``ETag`` and a year‑long ``Cache-Control``.  The URL carries a
+  short hash of the source (``?v=``), so a changed logo gets a new URL rather
+  than a stale cached image.
+
+Logos come from the app's own origin, and an SVG can carry script, so every
+response is sent with a locked‑down ``Content-Security-Policy`` and
+``X-Content-Type-Options: nosniff`` (:data:`SECURITY_HEADERS`).
+
+Environment
+-----------
+``TAPIX_LOGO_CACHE_DIR`` – default ``.cache/logos`` next to this file.
+``TAPIX_LOGO_DIR`` – optional local mirror of the logo host (offline/tests).
+``TAPIX_LOGO_PROXY`` – ``0`` to link the remote URLs directly, default ``1``.
+
+Usage (inside app.py)
+---------------------
+```python
+register_routes(server, lambda kind, key: logo_sources(tenants.current().dataset).get((kind, key)))
+html.Img(src=logo_url("merchant", row["merchantUid"], row["merchant_logo"]))
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Protocol, Tuple
+
+from flask import Response, abort, request
+
+from dataset import TransactionDataset
+
+try:
+    from PIL import Image  # type: ignore
+except ImportError:  # pragma: no cover - thumbnails fall back to the original bytes
+    Image = None
+
+THUMB_SIZES = (64, 128)
+DEFAULT_SIZE = 64
+ROUTE = "/logos"
+KINDS = {"merchant": ("merchantUid", "merchant_logo"), "category": ("category", "category_logo")}
+# Don't retry a failing logo host on every row render
+FAILURE_TTL_SECONDS = 600
+
+PROXY_ENABLED = os.getenv("TAPIX_LOGO_PROXY", "1") == "1"
+CACHE_DIR = Path(os.getenv("TAPIX_LOGO_CACHE_DIR", Path(__file__).with_name(".cache") / "logos"))
+MIRROR_DIR: Optional[Path] = Path(os.environ["TAPIX_LOGO_DIR"]) if os.getenv("TAPIX_LOGO_DIR") else None
+
+Resolver = Callable[[str, str], Optional[str]]
+
+# A fetched SVG opened directly must not run script or load anything
+SECURITY_HEADERS = {
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'",
+    "X-Content-Type-Options": "nosniff",
+}
+
+_IMAGE_SIGNATURES = [
+    (b"\x89PNG", "image/png"), (b"\xff\xd8", "image/jpeg"), (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"), (b"<svg", "image/svg+xml"), (b"<?xml", "image/svg+xml"),
+]
+
+
+class LogoFetcher(Protocol):
+    """Returns the raw bytes behind a logo URL."""
+
+    def fetch(self, url: str) -> bytes: ...
+
+
+class HttpLogoFetcher:
+    """Fetch logos from their remote host."""
+
+    def __init__(self, *, timeout: float = 10.0) -> None:
+        self.timeout = timeout
+
+    def fetch(self, url: str) -> bytes:
+        req = urllib.request.Request(url, headers={"User-Agent": "tapix-logo-cache/1.0"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return response.read()
+
+
+class DirectoryLogoFetcher:
+    """Read logos from a local mirror laid out like the remote URL paths."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root).resolve()
+
+    def fetch(self, url: str) -> bytes:
+        path = (self.root / urllib.parse.urlsplit(url).path.lstrip("/")).resolve()
+        if self.root not in path.parents:
+            raise FileNotFoundError(url)
+        return path.read_bytes()
+
+
+class LogoCache:
+    """Disk cache of resized logos keyed by the SHA‑256 of the source URL."""
+
+    def __init__(self, fetcher: LogoFetcher, directory: Path = CACHE_DIR) -> None:
+        self.fetcher = fetcher
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._fetching: Dict[str, threading.Lock] = {}
+        self._failures: Dict[str, float] = {}
+
+    def get(self, source: str, size: int = DEFAULT_SIZE) -> Tuple[bytes, str]:
+        """``(bytes, content type)`` of **source** at **size**, fetching it at most once."""
+        digest = source_digest(source)
+        cached = self._read(digest, size)
+        if cached is not None:
+            return cached
+        with self._lock:
+            if time.monotonic() - self._failures.get(digest, -FAILURE_TTL_SECONDS) < FAILURE_TTL_SECONDS:
+                raise LookupError(f"logo recently failed: {source}")
+            fetch_lock = self._fetching.setdefault(digest, threading.Lock())
+        try:
+            with fetch_lock:
+                cached = self._read(digest, size)
+                if cached is None:
+                    try:
+                        original = self.fetcher.fetch(source)
+                    except Exception:
+                        with self._lock:
+                            self._failures[digest] = time.monotonic()
+                        raise
+                    for thumb_size, data in _thumbnails(original).items():
+                        self._write(self._path(digest, thumb_size), data)
+                    cached = self._read(digest, size)
+        finally:
+            with self._lock:
+                self._fetching.pop(digest, None)
+        if cached is None:  # pragma: no cover - cache dir not writable
+            raise LookupError(f"logo could not be cached: {source}")
+        return cached
+
+    # ------------------------------------------------------------------ helpers
+    def _path(self, digest: str, size: int) -> Path:
+        return self.directory / digest[:2] / f"{digest}-{size}"
+
+    def _read(self, digest: str, size: int) -> Optional[Tuple[bytes, str]]:
+        try:
+            data = self._path(digest, size).read_bytes()
+        except OSError:
+            return None
+        return data, _content_type(data)
+
+    def _write(self, path: Path, data: bytes) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:  # pragma: no cover - read‑only deploys serve nothing
+            pass
+
+
+logo_cache = LogoCache(DirectoryLogoFetcher(MIRROR_DIR) if MIRROR_DIR else HttpLogoFetcher())
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def source_digest(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def logo_url(kind: str, key, source, size: int = DEFAULT_SIZE):
+    """App URL of the **size** px thumbnail of **source**; **source** itself if proxying is off."""
+    if not PROXY_ENABLED or not isinstance(source, str) or not source or not isinstance(key, str):
+        return source
+    quoted = urllib.parse.quote(key, safe="")
+    return f"{ROUTE}/{kind}/{quoted}?v={source_digest(source)[:12]}&size={size}"
+
+
+_sources: "weakref.WeakKeyDictionary[TransactionDataset, Tuple[str, Dict[Tuple[str, str], str]]]" = (
+    weakref.WeakKeyDictionary()
+)
+_sources_lock = threading.Lock()
+
+
+def logo_sources(dataset: TransactionDataset) -> Dict[Tuple[str, str], str]:
+    """``(kind, key) → source URL`` for **dataset**, rebuilt only when its version changes."""
+    with _sources_lock:
+        cached = _sources.get(dataset)
+        if cached is not None and cached[0] == dataset.version:
+            return cached[1]
+    sources: Dict[Tuple[str, str], str] = {}
+    for kind, (key_col, logo_col) in KINDS.items():
+        pairs = dataset.df[[key_col, logo_col]].dropna().drop_duplicates(key_col)
+        sources.update(((kind, str(k)), str(v)) for k, v in zip(pairs[key_col], pairs[logo_col]))
+    with _sources_lock:
+        _sources[dataset] = (dataset.version, sources)
+    return sources
+
+
+def register_routes(server, resolve: Resolver) -> None:
+    """Add ``/logos/<kind>/<key>`` to the Flask **server**; **resolve** maps it to a source URL."""
+
+    @server.route(f"{ROUTE}/<kind>/<path:key>")
+    def logo(kind: str, key: str):
+        size = request.args.get("size", DEFAULT_SIZE, type=int)
+        if kind not in KINDS or size not in THUMB_SIZES:
+            abort(404)
+        source = resolve(kind, key)
+        if not source:
+            abort(404)
+        etag = f"{source_digest(source)[:16]}-{size}"
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        try:
+            data, content_type = logo_cache.get(source, size)
+        except Exception:
+            abort(502)
+        # Versioned URLs never change content; unversioned ones revalidate daily
+        immutable = request.args.get("v") == source_digest(source)[:12]
+        return Response(data, mimetype=content_type, headers={
+            "Cache-Control": "public, max-age=31536000, immutable" if immutable else "public, max-age=86400",
+            "ETag": f'"{etag}"',
+            **SECURITY_HEADERS,
+        })
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _thumbnails(original: bytes) -> Dict[int, bytes]:
+    """Thumbnails for every :data:`THUMB_SIZES` entry (the original if undecodable).
+
+    Each is the smallest of the resized image as PNG, WebP or – when fully
+    opaque – JPEG.  The original is kept only if it already fits the size and
+    is smaller still; a large logo is never served in place of its thumbnail.
+    """
+    if Image is None:
+        return {size: original for size in THUMB_SIZES}
+    try:
+        image = Image.open(io.BytesIO(original))
+        image.load()
+    except Exception:  # SVG or a broken file: serve it as is
+        return {size: original for size in THUMB_SIZES}
+    fits = max(image.size)
+    image = image.convert("RGBA")
+    thumbs = {}
+    for size in THUMB_SIZES:
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        encoded = min(_encodings(thumb), key=len)
+        thumbs[size] = original if fits <= size and len(original) <= len(encoded) else encoded
+    return thumbs
+
+
+def _encodings(thumb: "Image.Image") -> List[bytes]:
+    formats = [("PNG", thumb, {"optimize": True}), ("WEBP", thumb, {"quality": 85, "method": 6})]
+    if thumb.getextrema()[3][0] == 255:  # no transparency: JPEG is fine
+        formats.append(("JPEG", thumb.convert("RGB"), {"quality": 85, "optimize": True}))
+    encoded = []
+    for name, image, options in formats:
+        out = io.BytesIO()
+        try:
+            image.save(out, format=name, **options)
+        except (KeyError, OSError):  # pragma: no cover - Pillow built without this codec
+            continue
+        encoded.append(out.getvalue())
+    return encoded
+
+
+def _content_type(data: bytes) -> str:
+    head = data[:64].lstrip()
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return "application/octet-stream"
@@ -0,0 +1,351 @@
+"""maps.py – server‑side static map images with a disk LRU cache
+===============================================================
+
+The transaction modal used to point the browser at the Google Static Maps
+API, so every modal open waited on a third‑party round trip (and shipped the
+API key to the client).  The modal now loads ``/maps/static?...`` from the app
+itself, which serves the image from a content‑addressed disk cache and only
+asks the :class:`MapProvider` on a miss.
+
+Cache keys are the provider name plus the **rounded** request – coordinates to
+:data:`COORD_DECIMALS` places (≈ 11 m), zoom and size – so repeat visits to the
+same shop share one file.  Files live at ``<dir>/<key[:2]>/<key>.<ext>``; hits
+touch the file's mtime and the oldest files are removed once the cache grows
+past its size limit.
+
+:func:`prefetch_maps` renders maps for a batch of coordinates on a small thread
+pool, e.g. every shop of the month the user just selected.
+
+The route renders with the server's API key, so it is not an open proxy: it
+only serves coordinates of shops in the requesting user's data (see
+:func:`map_locations`), at zoom levels :data:`MIN_ZOOM`–:data:`MAX_ZOOM` and
+no larger than :data:`DEFAULT_SIZE`.
+
+Providers
+---------
+``google`` – Google Static Maps, needs ``GOOGLE_MAPS_API_KEY``.
+``offline`` – :class:`OfflineMapRenderer`, a local SVG grid + marker (tests, demos).
+
+Environment
+-----------
+``TAPIX_MAP_PROVIDER`` – ``google`` / ``offline``; default ``google`` if a key is set, else maps are off.
+``TAPIX_MAP_CACHE_DIR`` – default ``.cache/maps`` next to this file.
+``TAPIX_MAP_CACHE_MB`` – disk budget, default ``256``.
+
+Usage (inside app.py)
+---------------------
+```python
+register_routes(server, lambda lat, long: (lat, long) in map_locations(tenants.current().dataset))
+html.Img(src=static_map_url(lat, long))
+prefetch_maps(zip(month_df["lat"], month_df["long"]))
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import threading
+import urllib.parse
+import urllib.request
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Protocol, Tuple
+
+from flask import Response, abort, request
+
+COORD_DECIMALS = 4
+DEFAULT_ZOOM = 15
+DEFAULT_SIZE = (416, 234)
+MAX_SIDE = 640  # Google Static Maps limit without a premium plan
+# What the public route will render (the modal only asks for the defaults)
+MIN_ZOOM, MAX_ZOOM = 10, 18
+ROUTE = "/maps/static"
+
+PROVIDER_NAME = os.getenv("TAPIX_MAP_PROVIDER") or ("google" if os.getenv("GOOGLE_MAPS_API_KEY") else "")
+CACHE_DIR = Path(os.getenv("TAPIX_MAP_CACHE_DIR", Path(__file__).with_name(".cache") / "maps"))
+CACHE_BYTES = int(float(os.getenv("TAPIX_MAP_CACHE_MB", "256")) * 2**20)
+PREFETCH_WORKERS = 4
+
+MapKey = Tuple[float, float, int, int, int]
+# Is (rounded lat, rounded long) a place the requesting user has shopped?
+KnownLocation = Callable[[float, float], bool]
+
+
+class MapProvider(Protocol):
+    """Renders one map image; plug in another service or a local renderer."""
+
+    name: str
+    extension: str
+    content_type: str
+
+    def render(self, lat: float, long: float, zoom: int, width: int, height: int) -> bytes: ...
+
+
+class GoogleStaticMaps:
+    """Google Static Maps API, fetched server‑side."""
+
+    name = "google"
+    extension = "png"
+    content_type = "image/png"
+
+    def __init__(self, api_key: str, *, timeout: float = 10.0) -> None:
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def render(self, lat: float, long: float, zoom: int, width: int, height: int) -> bytes:
+        query = urllib.parse.urlencode({
+            "center": f"{lat},{long}", "zoom": zoom, "size": f"{width}x{height}",
+            "markers": f"color:red|{lat},{long}", "key": self.api_key,
+        })
+        url = f"https://maps.googleapis.com/maps/api/staticmap?{query}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return response.read()
+
+
+class OfflineMapRenderer:
+    """Network‑free stand‑in: an SVG graticule around a marker, deterministic per key."""
+
+    name = "offline"
+    extension = "svg"
+    content_type = "image/svg+xml"
+
+    def render(self, lat: float, long: float, zoom: int, width: int, height: int) -> bytes:
+        # Grid spacing shrinks with zoom like map tiles do; offset keeps it geo‑anchored
+        step = max(256 / 2 ** max(zoom - 12, 0), 16)
+        dx = (long * 2 ** zoom) % step
+        dy = (lat * 2 ** zoom) % step
+        lines = [
+            f'<line x1="{x:.1f}" y1="0" x2="{x:.1f}" y2="{height}"/>'
+            for x in _ticks(width, step, dx)
+        ] + [
+            f'<line x1="0" y1="{y:.1f}" x2="{width}" y2="{y:.1f}"/>'
+            for y in _ticks(height, step, dy)
+        ]
+        cx, cy = width / 2, height / 2
+        svg = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">'
+            f'<rect width="100%" height="100%" fill="#1e293b"/>'
+            f'<g stroke="#38d99633" stroke-width="1">{"".join(lines)}</g>'
+            f'<circle cx="{cx}" cy="{cy}" r="7" fill="#ef4444" stroke="#fff" stroke-width="2"/>'
+            f'<text x="8" y="{height - 8}" fill="#b0c4de" font-family="sans-serif" font-size="11">'
+            f'{lat:.{COORD_DECIMALS}f}, {long:.{COORD_DECIMALS}f} · z{zoom}</text></svg>'
+        )
+        return svg.encode("utf-8")
+
+
+class MapCache:
+    """Content‑addressed disk cache of rendered maps, evicting least recently used files."""
+
+    def __init__(self, provider: MapProvider, directory: Path = CACHE_DIR, max_bytes: int = CACHE_BYTES) -> None:
+        self.provider = provider
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._rendering: Dict[str, threading.Lock] = {}
+        self._bytes: Optional[int] = None
+
+    def get(self, lat: float, long: float, zoom: int = DEFAULT_ZOOM,
+            size: Tuple[int, int] = DEFAULT_SIZE) -> bytes:
+        """Image bytes for the rounded request, rendering it at most once."""
+        path = self.path(*map_key(lat, long, zoom, size))
+        data = self._read(path)
+        if data is not None:
+            return data
+        with self._lock:
+            render_lock = self._rendering.setdefault(path.name, threading.Lock())
+        with render_lock:
+            data = self._read(path)
+            if data is None:
+                lat_r, long_r, zoom, width, height = map_key(lat, long, zoom, size)
+                data = self.provider.render(lat_r, long_r, zoom, width, height)
+                self._write(path, data)
+            with self._lock:
+                self._rendering.pop(path.name, None)
+        return data
+
+    def path(self, lat: float, long: float, zoom: int, width: int, height: int) -> Path:
+        key = f"{self.provider.name}|{lat:.{COORD_DECIMALS}f}|{long:.{COORD_DECIMALS}f}|{zoom}|{width}x{height}"
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.{self.provider.extension}"
+
+    # ------------------------------------------------------------------ helpers
+    def _read(self, path: Path) -> Optional[bytes]:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path: Path, data: bytes) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:  # pragma: no cover - read‑only deploys just don't cache
+            return
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(f.stat().st_size for f in self._files())
+            else:
+                self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove the oldest files until the cache is back under 90 % of its budget."""
+        files = sorted(((f.stat(), f) for f in self._files()), key=lambda item: item[0].st_mtime)
+        total = sum(st.st_size for st, _ in files)
+        for st, f in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            f.unlink(missing_ok=True)
+            total -= st.st_size
+        self._bytes = total
+
+    def _files(self):
+        return (f for f in self.directory.glob(f"??/*.{self.provider.extension}") if f.is_file())
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def map_key(lat: float, long: float, zoom: int, size: Tuple[int, int]) -> MapKey:
+    """Round a request to its cache key; raises ``ValueError`` if out of range."""
+    lat, long, zoom = float(lat), float(long), int(zoom)
+    width, height = (int(v) for v in size)
+    if not (math.isfinite(lat) and math.isfinite(long)) or abs(lat) > 90 or abs(long) > 180:
+        raise ValueError("coordinates out of range")
+    if not 1 <= zoom <= 20 or not (1 <= width <= MAX_SIDE and 1 <= height <= MAX_SIDE):
+        raise ValueError("zoom or size out of range")
+    return round(lat, COORD_DECIMALS), round(long, COORD_DECIMALS), zoom, width, height
+
+
+def provider_from_env() -> Optional[MapProvider]:
+    if PROVIDER_NAME == "google" and os.getenv("GOOGLE_MAPS_API_KEY"):
+        return GoogleStaticMaps(os.environ["GOOGLE_MAPS_API_KEY"])
+    if PROVIDER_NAME == "offline":
+        return OfflineMapRenderer()
+    return None
+
+
+_provider = provider_from_env()
+map_cache: Optional[MapCache] = MapCache(_provider) if _provider is not None else None
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetch_lock = threading.Lock()
+
+
+_locations: "weakref.WeakKeyDictionary[Any, Tuple[str, FrozenSet[Tuple[float, float]]]]" = weakref.WeakKeyDictionary()
+_locations_lock = threading.Lock()
+
+
+def map_locations(dataset) -> FrozenSet[Tuple[float, float]]:
+    """Rounded ``(lat, long)`` of every shop in **dataset**, rebuilt only when its version changes."""
+    with _locations_lock:
+        cached = _locations.get(dataset)
+        if cached is not None and cached[0] == dataset.version:
+            return cached[1]
+    pairs = dataset.df[["lat", "long"]].dropna().drop_duplicates()
+    locations = frozenset(
+        (round(float(lat), COORD_DECIMALS), round(float(long), COORD_DECIMALS))
+        for lat, long in zip(pairs["lat"], pairs["long"])
+    )
+    with _locations_lock:
+        _locations[dataset] = (dataset.version, locations)
+    return locations
+
+
+def maps_enabled() -> bool:
+    return map_cache is not None
+
+
+def static_map_url(lat: float, long: float, zoom: int = DEFAULT_ZOOM,
+                   size: Tuple[int, int] = DEFAULT_SIZE) -> Optional[str]:
+    """App‑relative URL of the cached map image, or ``None`` if maps are off/invalid."""
+    if map_cache is None:
+        return None
+    try:
+        lat, long, zoom, width, height = map_key(lat, long, zoom, size)
+    except (TypeError, ValueError):
+        return None
+    return f"{ROUTE}?lat={lat}&long={long}&zoom={zoom}&size={width}x{height}"
+
+
+def prefetch_maps(coordinates: Iterable[Tuple[float, float]], zoom: int = DEFAULT_ZOOM,
+                  size: Tuple[int, int] = DEFAULT_SIZE) -> int:
+    """Render the distinct maps for **coordinates** in the background; returns how many were queued."""
+    global _prefetch_pool
+    if map_cache is None:
+        return 0
+    keys = set()
+    for lat, long in coordinates:
+        try:
+            keys.add(map_key(lat, long, zoom, size))
+        except (TypeError, ValueError):
+            continue
+    pending = [key for key in keys if not map_cache.path(*key).exists()]
+    if not pending:
+        return 0
+    with _prefetch_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="map-prefetch")
+        for lat, long, zoom, width, height in pending:
+            _prefetch_pool.submit(_prefetch_one, lat, long, zoom, (width, height))
+    return len(pending)
+
+
+def register_routes(server, known: KnownLocation) -> None:
+    """Add the ``/maps/static`` endpoint to the Flask **server**; only **known** locations are served."""
+
+    @server.route(ROUTE)
+    def static_map():
+        if map_cache is None:
+            abort(404)
+        try:
+            size = request.args.get("size")
+            key = map_key(request.args["lat"], request.args["long"], request.args.get("zoom", DEFAULT_ZOOM),
+                          size.split("x") if size else DEFAULT_SIZE)
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        lat, long, zoom, width, height = key
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM or width > DEFAULT_SIZE[0] or height > DEFAULT_SIZE[1]:
+            abort(400)
+        if not known(lat, long):  # never spend the API key on arbitrary coordinates
+            abort(404)
+        etag = map_cache.path(*key).stem
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        try:
+            data = map_cache.get(key[0], key[1], key[2], key[3:])
+        except Exception:  # provider down: let the browser show the alt text
+            abort(502)
+        return Response(data, mimetype=map_cache.provider.content_type, headers={
+            "Cache-Control": "public, max-age=2592000, immutable",
+            "ETag": f'"{etag}"',
+        })
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _prefetch_one(lat: float, long: float, zoom: int, size: Tuple[int, int]) -> None:
+    try:
+        map_cache.get(lat, long, zoom, size)  # type: ignore[union-attr]
+    except Exception:  # best effort; the modal will retry on open
+        pass
+
+
+def _ticks(length: int, step: float, offset: float):
+    x = step - offset
+    while x < length:
+        yield x
+        x += step
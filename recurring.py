@@ -0,0 +1,208 @@
+"""recurring.py – vectorised detection of subscriptions and other recurring charges
+================================================================================
+
+Finds merchants that charge on a schedule – weekly, monthly or yearly – from
+the transactions alone.  All merchants are analysed in one pass:
+
+1. rows are ordered by ``(merchant, timestamp)`` with one ``lexsort``;
+2. the gaps between consecutive charges of the same merchant are a single
+   ``diff`` over that order;
+3. per merchant, the share of gaps that match each :data:`CADENCES` period
+   and the spread of the base‑currency amounts are grouped reductions.
+
+A merchant is recurring when at least :data:`MIN_REGULARITY` of its gaps fit
+one cadence and its amounts stay within :data:`AMOUNT_TOLERANCE` of their
+median (so a small price rise does not hide a subscription).  When rows are
+appended only the merchants they touch are re‑analysed.
+
+Environment
+-----------
+``TAPIX_RECURRING_MIN_CHARGES`` – charges needed (yearly needs one less), default ``3``.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+detector = RecurringDetector(df)
+detector.subscriptions()              # one row per recurring merchant
+detector.append(df, new_rows)
+```
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# name → (period in days, tolerance in days)
+CADENCES: Dict[str, Tuple[float, float]] = {
+    "weekly": (7.0, 2.0),
+    "monthly": (30.44, 4.0),
+    "yearly": (365.25, 15.0),
+}
+MIN_CHARGES = int(os.getenv("TAPIX_RECURRING_MIN_CHARGES", "3"))
+MIN_REGULARITY = 0.75
+AMOUNT_TOLERANCE = 0.15
+_DAYS_PER_MONTH = 30.44
+
+_DAY_NS = 86_400 * 10**9
+COLUMNS: List[str] = [
+    "merchant", "category", "cadence", "charges", "amount", "currency", "amount_base",
+    "monthly_cost", "first_charge", "last_charge", "next_charge",
+]
+
+
+class RecurringDetector:
+    """Recurring merchants of one dataset, kept current as rows are appended."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self._table = detect_recurring(df)
+        self._as_of = _last_stamp(df)
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """Every recurring merchant (active or not), indexed by merchant key."""
+        return self._table
+
+    def subscriptions(self, *, active_only: bool = True) -> pd.DataFrame:
+        """Recurring merchants, largest monthly cost first.
+
+        Active ones are those whose next charge is not overdue by more than
+        the cadence's tolerance, relative to the latest transaction.
+        """
+        table = self._table.copy()
+        tolerance = pd.to_timedelta(table["cadence"].map(lambda c: CADENCES[c][1]).astype(float), unit="D")
+        table["active"] = (table["next_charge"] + tolerance) >= self._as_of if self._as_of is not None else False
+        if active_only:
+            table = table[table["active"]]
+        return table.sort_values("monthly_cost", ascending=False)
+
+    def append(self, df: pd.DataFrame, rows: pd.DataFrame) -> None:
+        """Re‑analyse the merchants of **rows**, which were just appended to **df**."""
+        if rows.empty:
+            return
+        keys = _merchant_keys(df)
+        touched = pd.unique(_merchant_keys(rows).dropna())
+        subset = keys.isin(touched).to_numpy()
+        fresh = detect_recurring(df[subset])
+        kept = self._table.drop(touched, errors="ignore")
+        self._table = pd.concat([kept, fresh]) if not kept.empty else fresh
+        self._as_of = _last_stamp(df)
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def detect_recurring(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per recurring merchant in **df** (see module docs), indexed by merchant key."""
+    keys = _merchant_keys(df)
+    codes, uniques = pd.factorize(keys)
+    stamps = df["transactionTimestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    base = df["amount_base"].to_numpy(dtype=float)
+    valid = (codes >= 0) & ~np.isnat(stamps.view("datetime64[ns]")) & np.isfinite(base)
+    if valid.sum() < 2:
+        return _empty()
+    rows = np.flatnonzero(valid)
+    rows = rows[np.lexsort((stamps[rows], codes[rows]))]
+    group = codes[rows]
+
+    # Gaps between consecutive charges of the same merchant
+    same = group[1:] == group[:-1]
+    gaps = np.diff(stamps[rows]) / _DAY_NS
+    gap_group, gaps = group[1:][same], gaps[same]
+    periods = np.array([p for p, _ in CADENCES.values()])
+    tolerances = np.array([t for _, t in CADENCES.values()])
+    fits = np.abs(gaps[:, None] - periods[None, :]) <= tolerances[None, :]
+    regularity = pd.DataFrame(fits, columns=list(CADENCES)).groupby(gap_group).mean()
+    median_gap = pd.Series(gaps).groupby(gap_group).median()
+
+    amounts = pd.Series(base[rows])
+    by_group = amounts.groupby(group)
+    median_amount = by_group.median()
+    spread = (amounts - by_group.transform("median")).abs().groupby(group).median()
+    charges = by_group.size()
+
+    # Best cadence per merchant: the one the median gap falls into
+    cadence_idx = np.abs(median_gap.to_numpy()[:, None] - periods[None, :]).argmin(axis=1)
+    stats = pd.DataFrame({
+        "cadence_idx": cadence_idx,
+        "median_gap": median_gap.to_numpy(),
+    }, index=median_gap.index)
+    stats["regularity"] = regularity.to_numpy()[np.arange(len(stats)), cadence_idx]
+    stats["charges"] = charges.reindex(stats.index)
+    stats["median_amount"] = median_amount.reindex(stats.index)
+    stats["spread"] = spread.reindex(stats.index)
+    needed = np.where(stats["cadence_idx"].to_numpy() == list(CADENCES).index("yearly"), MIN_CHARGES - 1, MIN_CHARGES)
+    recurring = (
+        (np.abs(stats["median_gap"] - periods[cadence_idx]) <= tolerances[cadence_idx])
+        & (stats["regularity"] >= MIN_REGULARITY)
+        & (stats["charges"] >= np.maximum(needed, 2))
+        & (stats["spread"] <= AMOUNT_TOLERANCE * stats["median_amount"].abs())
+    )
+    stats = stats[recurring]
+    if stats.empty:
+        return _empty()
+
+    # Latest charge of each recurring merchant describes the subscription
+    last_pos = pd.Series(np.arange(len(rows))).groupby(group).max().reindex(stats.index).to_numpy()
+    first_pos = pd.Series(np.arange(len(rows))).groupby(group).min().reindex(stats.index).to_numpy()
+    last_rows = df.iloc[rows[last_pos]]
+    period_days = periods[stats["cadence_idx"].to_numpy()]
+    last_charge = last_rows["transactionTimestamp"].to_numpy(dtype="datetime64[ns]")
+    table = pd.DataFrame({
+        "merchant": last_rows["merchant"].astype(object).to_numpy(),
+        "category": last_rows["category"].astype(object).to_numpy(),
+        "cadence": np.array(list(CADENCES))[stats["cadence_idx"].to_numpy()],
+        "charges": stats["charges"].to_numpy(dtype=int),
+        "amount": last_rows["amount"].to_numpy(dtype=float),
+        "currency": last_rows["currency"].astype(object).to_numpy(),
+        "amount_base": stats["median_amount"].to_numpy(dtype=float),
+        "monthly_cost": stats["median_amount"].to_numpy(dtype=float) * _DAYS_PER_MONTH / period_days,
+        "first_charge": df["transactionTimestamp"].to_numpy(dtype="datetime64[ns]")[rows[first_pos]],
+        "last_charge": last_charge,
+        "next_charge": last_charge + (period_days * _DAY_NS).astype("timedelta64[ns]"),
+    }, index=pd.Index(uniques[stats.index.to_numpy()], name="merchant_key"))
+    return table[COLUMNS]
+
+
+def describe_subscriptions(subscriptions: pd.DataFrame, currency: str, limit: Optional[int] = None) -> str:
+    """Compact one‑line‑per‑merchant facts for the AI context."""
+    if subscriptions.empty:
+        return ""
+    total = subscriptions["monthly_cost"].sum()
+    lines = [f"{len(subscriptions)} recurring, ~{total:,.2f} {currency}/month in total"]
+    lines += [
+        f"{merchant}|{cadence}|{amount:.2f} {cur}|next {next_charge:%Y-%m-%d}"
+        for merchant, cadence, amount, cur, next_charge in zip(
+            subscriptions["merchant"], subscriptions["cadence"], subscriptions["amount"],
+            subscriptions["currency"], subscriptions["next_charge"],
+        )
+    ][:limit]
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _merchant_keys(df: pd.DataFrame) -> pd.Series:
+    """``merchantUid``, or the merchant name for rows without one."""
+    return df["merchantUid"].astype(object).fillna(df["merchant"].astype(object))
+
+
+def _last_stamp(df: pd.DataFrame) -> Optional[pd.Timestamp]:
+    stamp = df["transactionTimestamp"].max() if len(df) else None
+    return None if stamp is None or pd.isna(stamp) else pd.Timestamp(stamp)
+
+
+def _empty() -> pd.DataFrame:
+    table = pd.DataFrame({col: pd.Series(dtype="object") for col in COLUMNS})
+    for col in ("amount", "amount_base", "monthly_cost"):
+        table[col] = table[col].astype(float)
+    table["charges"] = table["charges"].astype(int)
+    for col in ("first_charge", "last_charge", "next_charge"):
+        table[col] = table[col].astype("datetime64[ns]")
+    table.index.name = "merchant_key"
+    return table
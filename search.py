@@ -0,0 +1,233 @@
+"""search.py – inverted index over merchants, tags, categories and addresses
+=========================================================================
+
+Backs the transaction search box.  Every value of :data:`SEARCH_COLUMNS` is
+split into **terms** – lower‑cased, with diacritics folded (``Bucureşti`` →
+``bucuresti``, ``Váci út`` → ``vaci ut``) – and the index maps each term to
+the sorted row positions containing it:
+
+* ``terms`` – the sorted vocabulary,
+* ``offsets`` / ``postings`` – CSR posting lists, ``postings[offsets[i]:offsets[i+1]]``.
+
+Terms are extracted from each column's *distinct* values, so building costs
+O(unique values) in Python plus vectorised work per row.  A query term
+matches every vocabulary term it is a prefix of (one ``searchsorted`` range);
+a term with no prefix match falls back to fuzzy matching – vocabulary terms
+within one edit, found through a symmetric‑delete table – so ``tescco`` still
+finds Tesco.  All query terms must match (AND).  Results are newest first.
+
+The arrays are saved as ``.npz`` next to the ingest cache (see
+:func:`ingest.sidecar_path`) and loaded on the next start instead of being
+rebuilt.  Appended rows go to a small delta index that is searched alongside.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+index = SearchIndex.load_or_build(df, path)
+total, positions = index.search("bucur", page=0, page_size=25)
+```
+"""
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+SEARCH_COLUMNS: List[str] = ["merchant", "tags", "category", "street", "city"]
+MIN_FUZZY_LENGTH = 4
+INDEX_VERSION = 1
+
+_TOKEN = re.compile(r"[0-9a-z]+")
+_NO_ROWS = np.empty(0, dtype=np.int64)
+
+
+class SearchIndex:
+    """Term → row positions, with prefix and one‑edit fuzzy lookups."""
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, postings: np.ndarray, n_rows: int) -> None:
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.n_rows = n_rows
+        self._deletes: Optional[Dict[str, List[int]]] = None
+        self._delta: Optional[SearchIndex] = None
+        self._delta_start = n_rows
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, start: int = 0) -> "SearchIndex":
+        """Index rows ``start:`` of **df** (positions stay relative to **df**)."""
+        term_ids: Dict[str, int] = {}
+        pair_terms, pair_rows = [], []
+        for col in SEARCH_COLUMNS:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col].iloc[start:].astype(object))
+            if not len(uniques):
+                continue
+            # Terms of each distinct value, then expanded to that value's rows
+            value_idx, value_terms = [], []
+            for i, value in enumerate(uniques):
+                for term in set(tokenize(str(value))):
+                    value_idx.append(i)
+                    value_terms.append(term_ids.setdefault(term, len(term_ids)))
+            if not value_idx:
+                continue
+            value_idx = np.asarray(value_idx, dtype=np.int64)
+            order = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            firsts = np.searchsorted(codes[order], np.arange(len(uniques)))
+            repeat = counts[value_idx]
+            pair_terms.append(np.repeat(np.asarray(value_terms, dtype=np.int64), repeat))
+            within = np.arange(repeat.sum()) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+            pair_rows.append(order[np.repeat(firsts[value_idx], repeat) + within] + start)
+        vocabulary = np.array(sorted(term_ids), dtype=object)
+        if not pair_terms:
+            return cls(vocabulary.astype(str), np.zeros(1, dtype=np.int64), _NO_ROWS, len(df))
+        # Renumber terms alphabetically, then sort (term, row) pairs into CSR
+        rank = np.empty(len(term_ids), dtype=np.int64)
+        rank[[term_ids[t] for t in vocabulary]] = np.arange(len(vocabulary))
+        terms = rank[np.concatenate(pair_terms)]
+        rows = np.concatenate(pair_rows)
+        order = np.lexsort((rows, terms))
+        terms, rows = terms[order], rows[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (terms[1:] != terms[:-1]) | (rows[1:] != rows[:-1])
+        terms, rows = terms[keep], rows[keep]
+        offsets = np.searchsorted(terms, np.arange(len(vocabulary) + 1)).astype(np.int64)
+        return cls(vocabulary.astype(str), offsets, rows.astype(np.int64), len(df))
+
+    @classmethod
+    def load_or_build(cls, df: pd.DataFrame, path: Optional[Path] = None) -> "SearchIndex":
+        """Load the index saved at **path** if it matches **df**, else build (and save) it."""
+        if path is not None:
+            index = cls.load(path)
+            if index is not None and index.n_rows == len(df):
+                return index
+        index = cls.build(df)
+        if path is not None:
+            index.save(path)
+        return index
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["SearchIndex"]:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    return None
+                return cls(data["terms"], data["offsets"], data["postings"], int(data["n_rows"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path: Path) -> None:
+        """Atomically write the arrays as an uncompressed ``.npz``."""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as fh:
+                np.savez(fh, version=INDEX_VERSION, terms=self.terms, offsets=self.offsets,
+                         postings=self.postings, n_rows=self.n_rows)
+            os.replace(tmp_path, path)
+        except OSError:  # pragma: no cover - read‑only deploys rebuild on start
+            pass
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def nbytes(self) -> int:
+        delta = self._delta.nbytes if self._delta is not None else 0
+        return self.terms.nbytes + self.offsets.nbytes + self.postings.nbytes + delta
+
+    def search(self, query: str, page: int = 0, page_size: int = 25) -> Tuple[int, np.ndarray]:
+        """``(total matches, row positions of one page)``, newest first."""
+        matches = self.matches(query)
+        start = max(int(page), 0) * page_size
+        return len(matches), matches[::-1][start:start + page_size]
+
+    def matches(self, query: str) -> np.ndarray:
+        """Sorted row positions matching every term of **query**."""
+        words = tokenize(query)
+        if not words:
+            return _NO_ROWS
+        result: Optional[np.ndarray] = None
+        for word in dict.fromkeys(words):
+            rows = self._rows_for(word)
+            if self._delta is not None:
+                rows = np.union1d(rows, self._delta._rows_for(word))
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    # ------------------------------------------------------------------ updates
+    def append(self, df: pd.DataFrame, start: int) -> None:
+        """Index rows appended to **df** since ``start`` into the delta index."""
+        self._delta_start = min(start, self._delta_start)
+        self._delta = SearchIndex.build(df, self._delta_start)
+
+    # ------------------------------------------------------------------ helpers
+    def _rows_for(self, word: str) -> np.ndarray:
+        lo = int(np.searchsorted(self.terms, word, side="left"))
+        hi = int(np.searchsorted(self.terms, word + "\uffff", side="left"))
+        term_ids = np.arange(lo, hi)
+        if not len(term_ids) and len(word) >= MIN_FUZZY_LENGTH:
+            term_ids = np.asarray(self._fuzzy(word), dtype=np.int64)
+        if not len(term_ids):
+            return _NO_ROWS
+        if len(term_ids) == 1:
+            return self.postings[self.offsets[term_ids[0]]:self.offsets[term_ids[0] + 1]]
+        return np.unique(np.concatenate([self.postings[self.offsets[t]:self.offsets[t + 1]] for t in term_ids]))
+
+    def _fuzzy(self, word: str) -> List[int]:
+        """Vocabulary terms within one edit of **word** (symmetric delete lookup)."""
+        if self._deletes is None:
+            deletes: Dict[str, List[int]] = defaultdict(list)
+            for i, term in enumerate(self.terms.tolist()):
+                if len(term) >= MIN_FUZZY_LENGTH - 1:
+                    for variant in _deletes(term):
+                        deletes[variant].append(i)
+            self._deletes = dict(deletes)
+        candidates = {i for variant in _deletes(word) for i in self._deletes.get(variant, ())}
+        return sorted(i for i in candidates if _within_one_edit(word, str(self.terms[i])))
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def fold(text: str) -> str:
+    """Lower‑case **text** and strip diacritics (``Váci út`` → ``vaci ut``)."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return folded.replace("ß", "ss").replace("ø", "o").replace("ł", "l").replace("đ", "d").replace("æ", "ae")
+
+
+def tokenize(text: str) -> List[str]:
+    """Search terms of **text**."""
+    return _TOKEN.findall(fold(text))
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _deletes(term: str) -> List[str]:
+    return [term] + [term[:i] + term[i + 1:] for i in range(len(term))]
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Levenshtein distance ≤ 1 (insert, delete or substitute one character)."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
@@ -0,0 +1,151 @@
+"""tags.py – merchant tags parsed once into an exploded, categorical table
+=====================================================================
+
+The export stores a transaction's tags as a Postgres array literal, e.g.
+``{"Eshop With Everything","Shopping Online"}`` or ``{Hyper-Supermarket}``.
+There are only a few hundred distinct literals, so :func:`explode_tags`
+parses each *distinct* literal once (the ``tags`` column is categorical, see
+:mod:`ingest`) and expands the result to every row with vectorised
+``repeat``s.  The outcome is one ``(row, tag)`` pair per tag of every
+transaction, with ``tag`` categorical.
+
+:class:`TagIndex` keeps that table sorted two ways:
+
+* by row – CSR ``offsets`` give the tags of any row, and since rows are
+  time‑sorted a period's tag spend is a ``bincount`` over one slice;
+* by tag – the rows carrying a tag, ascending, for tag filters.
+
+Usage (inside dataset.py)
+-------------------------
+```python
+index = TagIndex(df)
+index.tags_of(42)                     # ["Shopping Online", ...]
+index.totals(lo, hi, amounts)         # spend per tag for rows lo:hi
+index.rows_with("Shopping Online")    # row positions, ascending
+```
+"""
+from __future__ import annotations
+
+import re
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+
+# A quoted element (with backslash escapes) or a bare one
+_ELEMENT = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,{}\[\]"]+)')
+_ESCAPE = re.compile(r"\\(.)")
+_NO_ROWS = np.empty(0, dtype=np.int64)
+
+
+class TagIndex:
+    """Exploded ``(row, tag)`` table of one dataset, indexed by row and by tag."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.table = explode_tags(df["tags"]) if "tags" in df.columns else _empty()
+        self._n_rows = len(df)
+        self._build()
+
+    # ------------------------------------------------------------------ queries
+    @property
+    def nbytes(self) -> int:
+        return int(self.table.memory_usage(deep=True).sum()) + self.offsets.nbytes + self._by_tag.nbytes
+
+    @property
+    def names(self) -> pd.Index:
+        """Every tag, alphabetically."""
+        return self.table["tag"].cat.categories
+
+    def tags_of(self, position: int) -> List[str]:
+        """Tags of the row at **position**, in export order."""
+        lo, hi = self.offsets[position], self.offsets[position + 1]
+        return self.table["tag"].iloc[lo:hi].astype(str).tolist()
+
+    def labels(self, positions: Sequence[int]) -> List[str]:
+        """``"A, B"`` display strings for the rows at **positions**."""
+        return [", ".join(self.tags_of(int(p))) for p in positions]
+
+    def rows_with(self, tag: str) -> np.ndarray:
+        """Row positions carrying **tag**, ascending."""
+        code = self.names.get_indexer([tag])[0]
+        if code < 0:
+            return _NO_ROWS
+        lo, hi = self._tag_offsets[code], self._tag_offsets[code + 1]
+        return self._rows[self._by_tag[lo:hi]]
+
+    def totals(self, lo: int, hi: int, values: np.ndarray) -> pd.DataFrame:
+        """``total`` of **values** and ``count`` of rows per tag, over rows ``lo:hi``, largest first."""
+        start, stop = self.offsets[lo], self.offsets[hi]
+        codes = self._codes[start:stop]
+        weights = np.nan_to_num(values[self._rows[start:stop]])
+        totals = pd.DataFrame({
+            "total": np.bincount(codes, weights=weights, minlength=len(self.names)),
+            "count": np.bincount(codes, minlength=len(self.names)),
+        }, index=self.names)
+        return totals[totals["count"] > 0].sort_values("total", ascending=False)
+
+    # ------------------------------------------------------------------ updates
+    def append(self, df: pd.DataFrame, start: int) -> None:
+        """Explode the tags of ``df.iloc[start:]`` – rows just appended to **df**."""
+        if len(df) <= start:
+            return
+        fresh = explode_tags(df["tags"].iloc[start:], start=start)
+        table = pd.concat([self.table, fresh], ignore_index=True)
+        table["tag"] = table["tag"].astype(str).astype("category")  # new tags extend the categories
+        self.table = table
+        self._n_rows = len(df)
+        self._build()
+
+    # ------------------------------------------------------------------ helpers
+    def _build(self) -> None:
+        self._rows = self.table["row"].to_numpy(dtype=np.int64)
+        self._codes = self.table["tag"].cat.codes.to_numpy(dtype=np.int64)
+        self.offsets = np.searchsorted(self._rows, np.arange(self._n_rows + 1)).astype(np.int64)
+        self._by_tag = np.lexsort((self._rows, self._codes))
+        self._tag_offsets = np.searchsorted(self._codes[self._by_tag], np.arange(len(self.names) + 1))
+
+
+# ----------------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------------
+
+def parse_tags(literal: object) -> List[str]:
+    """Elements of one Postgres array literal (``{a,"b c"}`` → ``["a", "b c"]``)."""
+    if not isinstance(literal, str):
+        return []
+    tags = []
+    for quoted, bare in _ELEMENT.findall(literal):
+        tag = _ESCAPE.sub(r"\1", quoted) if quoted else bare
+        tag = tag.strip()
+        if tag and not (bare and tag.upper() == "NULL"):
+            tags.append(tag)
+    return tags
+
+
+def explode_tags(tags: pd.Series, *, start: int = 0) -> pd.DataFrame:
+    """One ``(row, tag)`` pair per tag, rows numbered from **start**; ``tag`` is categorical."""
+    codes, literals = pd.factorize(tags)
+    parsed = [parse_tags(literal) for literal in literals]
+    names = sorted({tag for values in parsed for tag in values})
+    lookup = {name: i for i, name in enumerate(names)}
+    # Flattened tag codes of every distinct literal, and where each literal's run starts
+    parsed = [list(dict.fromkeys(values)) for values in parsed]  # a tag once per row
+    flat = np.array([lookup[tag] for values in parsed for tag in values], dtype=np.int64)
+    sizes = np.array([len(values) for values in parsed] + [0], dtype=np.int64)
+    firsts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    per_row = sizes[codes]  # code −1 (no tags) picks the trailing 0
+    rows = np.repeat(np.arange(len(codes), dtype=np.int64), per_row)
+    within = np.arange(per_row.sum()) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    tag_codes = flat[firsts[codes[rows]] + within] if len(rows) else _NO_ROWS
+    return pd.DataFrame({
+        "row": rows + start,
+        "tag": pd.Categorical.from_codes(tag_codes, categories=pd.Index(names, dtype=object)),
+    })
+
+
+# ----------------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------------
+
+def _empty() -> pd.DataFrame:
+    return pd.DataFrame({"row": _NO_ROWS, "tag": pd.Categorical.from_codes(_NO_ROWS, categories=pd.Index([], dtype=object))})
@@ -0,0 +1,228 @@
+"""tenants.py – per‑user transaction datasets behind a memory‑bounded LRU
+=======================================================================
+
+Every customer has their own Tapix history.  The histories live in a
+partitioned on‑disk store – one raw export per user or account,
+``<TAPIX_TENANT_DIR>/<tenant id>.csv`` – and are loaded on first use through
+:func:`ingest.load_transactions` (so repeat loads memory‑map the Arrow cache).
+
+:class:`TenantCache` keeps the most recently used tenants resident, each with
+its indexes, aggregate cube and query tools, and evicts the least recently
+used ones once their combined size passes a memory ceiling.  Hit, miss, load
+and eviction counters are available from :meth:`TenantCache.stats`.
+
+Loads are single‑flight: the first request for a tenant loads it, and
+concurrent requests for the same tenant wait for that load and share its
+result – or its exception, so a failing partition is read once per burst,
+not once per waiting thread.  The next request after a failure tries again.
+
+The tenant id comes from a request header set by the auth proxy in front of
+the app.  Without ``TAPIX_TENANT_DIR`` the app is single‑tenant: everyone is
+:data:`DEFAULT_TENANT` and sees the file at ``TAPIX_DATA_PATH``.
+
+Environment
+-----------
+``TAPIX_TENANT_DIR`` – optional, enables per‑user partitions.
+``TAPIX_TENANT_HEADER`` – request header with the tenant id, default ``X-Tapix-User``.
+``TAPIX_TENANT_MEMORY_MB`` – ceiling for resident datasets, default ``1024``.
+
+Usage (inside app.py)
+---------------------
+```python
+tenants = TenantCache(partition_loader(TENANT_DIR, DATA_PATH), toolbox_factory=TransactionTools)
+tenant = tenants.current()
+tenant.dataset.month_frame("2024-02")
+```
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from flask import has_request_context, request  # type: ignore
+except ImportError:  # pragma: no cover - outside the Dash server
+    has_request_context = lambda: False  # noqa: E731
+    request = None
+
+from dataset import TransactionDataset
+from ingest import cache_stem, empty_transactions, load_transactions, sidecar_path
+
+TENANT_DIR: Optional[Path] = Path(os.environ["TAPIX_TENANT_DIR"]) if os.getenv("TAPIX_TENANT_DIR") else None
+TENANT_HEADER = os.getenv("TAPIX_TENANT_HEADER", "X-Tapix-User")
+MEMORY_CEILING = int(float(os.getenv("TAPIX_TENANT_MEMORY_MB", "1024")) * 2**20)
+
+DEFAULT_TENANT = "default"
+
+# Tenant ids double as file names, so keep them to a safe alphabet
+_TENANT_ID = re.compile(r"^[A-Za-z0-9_@-][A-Za-z0-9_.@-]{0,127}$")
+
+Loader = Callable[[str], TransactionDataset]
+ToolboxFactory = Callable[[TransactionDataset], Any]
+
+
+class Tenant:
+    """One resident tenant: dataset, optional query tools and its accounted size."""
+
+    __slots__ = ("tenant_id", "dataset", "toolbox", "nbytes")
+
+    def __init__(self, tenant_id: str, dataset: TransactionDataset, toolbox: Any, nbytes: int) -> None:
+        self.tenant_id = tenant_id
+        self.dataset = dataset
+        self.toolbox = toolbox
+        self.nbytes = nbytes
+
+
+class _Load:
+    """One in‑flight load; waiters block on **done**, then share **tenant** or **error**."""
+
+    __slots__ = ("done", "tenant", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.tenant: Optional[Tenant] = None
+        self.error: Optional[BaseException] = None
+
+
+class TenantCache:
+    """LRU of loaded tenants with a byte ceiling and single‑flight loading."""
+
+    def __init__(
+        self,
+        loader: Loader,
+        *,
+        toolbox_factory: Optional[ToolboxFactory] = None,
+        max_bytes: int = MEMORY_CEILING,
+    ) -> None:
+        self.loader = loader
+        self.toolbox_factory = toolbox_factory
+        self.max_bytes = max_bytes
+        self._tenants: "OrderedDict[str, Tenant]" = OrderedDict()
+        self._loading: Dict[str, _Load] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "evicted_bytes": 0}
+        self._load_seconds = 0.0
+
+    # ------------------------------------------------------------------ public
+    def current(self) -> Tenant:
+        """The tenant of the request being served."""
+        return self.get(current_tenant_id())
+
+    def get(self, tenant_id: str) -> Tenant:
+        """Return **tenant_id**'s data, loading it (once, even under concurrency) if needed."""
+        tenant = self._lookup(tenant_id)
+        if tenant is not None:
+            return tenant
+        with self._lock:
+            load = self._loading.get(tenant_id)
+            owner = load is None
+            if owner:
+                load = self._loading[tenant_id] = _Load()
+        if not owner:  # someone else is loading it: share their outcome
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.tenant
+        try:
+            tenant = self._lookup(tenant_id, count=False)
+            if tenant is None:  # (else another thread finished loading it just before us)
+                tenant = self._load(tenant_id)
+            load.tenant = tenant
+            return tenant
+        except BaseException as e:
+            load.error = e
+            raise
+        finally:  # the next request after a failure starts a fresh load
+            with self._lock:
+                self._loading.pop(tenant_id, None)
+            load.done.set()
+
+    def evict(self, tenant_id: str) -> bool:
+        """Drop **tenant_id** (e.g. after its partition was rewritten)."""
+        with self._lock:
+            tenant = self._tenants.pop(tenant_id, None)
+            if tenant is not None:
+                self._bytes -= tenant.nbytes
+            return tenant is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current residency, for the metrics endpoint."""
+        with self._lock:
+            return {
+                **self._counters,
+                "resident_tenants": len(self._tenants),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "load_seconds": round(self._load_seconds, 3),
+            }
+
+    # ------------------------------------------------------------------ helpers
+    def _load(self, tenant_id: str) -> Tenant:
+        started = time.perf_counter()
+        dataset = self.loader(tenant_id)
+        toolbox = self.toolbox_factory(dataset) if self.toolbox_factory else None
+        tenant = Tenant(tenant_id, dataset, toolbox, dataset.nbytes)
+        with self._lock:
+            self._load_seconds += time.perf_counter() - started
+            self._counters["loads"] += 1
+            self._tenants[tenant_id] = tenant
+            self._bytes += tenant.nbytes
+            self._evict()
+        return tenant
+
+    def _lookup(self, tenant_id: str, count: bool = True) -> Optional[Tenant]:
+        with self._lock:
+            tenant = self._tenants.get(tenant_id)
+            if tenant is not None:
+                self._tenants.move_to_end(tenant_id)
+            if count:
+                self._counters["hits" if tenant is not None else "misses"] += 1
+            return tenant
+
+    def _evict(self) -> None:
+        """Drop least recently used tenants over the ceiling (never the newest)."""
+        while self._bytes > self.max_bytes and len(self._tenants) > 1:
+            _, tenant = self._tenants.popitem(last=False)
+            self._bytes -= tenant.nbytes
+            self._counters["evictions"] += 1
+            self._counters["evicted_bytes"] += tenant.nbytes
+
+
+# ----------------------------------------------------------------------------------
+# Tenant resolution
+# ----------------------------------------------------------------------------------
+
+def current_tenant_id() -> str:
+    """Tenant id from the request header; :data:`DEFAULT_TENANT` if single‑tenant or absent."""
+    if TENANT_DIR is None or not has_request_context():
+        return DEFAULT_TENANT
+    tenant_id = (request.headers.get(TENANT_HEADER) or "").strip()
+    return tenant_id if _TENANT_ID.match(tenant_id) else DEFAULT_TENANT
+
+
+def partition_loader(root: Optional[Path], default_path: Path) -> Loader:
+    """Loader reading ``root/<tenant id>.csv``, or **default_path** when **root** is ``None``."""
+
+    def load(tenant_id: str) -> TransactionDataset:
+        if root is None:
+            path = Path(default_path)
+        elif _TENANT_ID.match(tenant_id):
+            path = Path(root) / f"{tenant_id}.csv"
+        else:
+            raise ValueError(f"invalid tenant id {tenant_id!r}")
+        try:
+            stem = cache_stem(path)  # hash the export once for both caches
+            df = load_transactions(path, stem=stem)
+            search_path = sidecar_path(path, "search.npz", stem=stem)
+        except FileNotFoundError:  # a user without history yet
+            df, search_path = empty_transactions(), None
+        return TransactionDataset(df, key=tenant_id, search_path=search_path)
+
+    return load
+
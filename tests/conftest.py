@@ -0,0 +1,47 @@
+"""Shared fixtures: the repo root on ``sys.path`` and the bundled sample export."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+SAMPLE_CSV = ROOT / "Tapix enriched data sample.csv"
+
+
+@pytest.fixture(scope="session")
+def sample_df():
+    from ingest import parse_transactions
+
+    return parse_transactions(SAMPLE_CSV)
+
+
+@pytest.fixture(scope="session")
+def dataset(sample_df):
+    from dataset import TransactionDataset
+
+    return TransactionDataset(sample_df, key="test")
+
+
+@pytest.fixture
+def tenant_app(monkeypatch, sample_df):
+    """The Dash server with two tenants, ``alice`` (older half of the sample) and ``bob`` (newer half).
+
+    Returns ``(test client, {tenant id: dataset})``; pick a tenant with the
+    :data:`tenants.TENANT_HEADER` header.
+    """
+    import app
+    import tenants
+    from dataset import TransactionDataset
+
+    half = len(sample_df) // 2
+    datasets = {
+        "alice": TransactionDataset(sample_df.iloc[:half].reset_index(drop=True), key="alice"),
+        "bob": TransactionDataset(sample_df.iloc[half:].reset_index(drop=True), key="bob"),
+    }
+    monkeypatch.setattr(tenants, "TENANT_DIR", ROOT)
+    monkeypatch.setattr(app, "tenants", tenants.TenantCache(datasets.__getitem__))
+    return app.server.test_client(), datasets
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomalies import (
+    AMOUNT_GROUPS, FLAG_AMOUNT, FLAG_DUPLICATE, FLAG_LOCATION, OVERALL, ROLLING_WINDOW, SKETCH_ERROR,
+    AnomalyDetector,
+)
+
+
+def _frame(amounts, *, merchant="m1", category="Groceries", lat=48.15, long=17.11, start="2024-01-01"):
+    n = len(amounts)
+    return pd.DataFrame({
+        "transactionTimestamp": pd.Timestamp(start) + pd.to_timedelta(np.arange(n), unit="D"),
+        "merchantUid": merchant, "category": category, "currency": "EUR",
+        "amount": np.asarray(amounts, dtype=float), "amount_base": np.asarray(amounts, dtype=float),
+        "lat": lat, "long": long,
+    })
+
+
+@pytest.mark.parametrize("split", [1, 100, 150, 212])
+def test_statistics_after_appends_equal_a_fresh_build(sample_df, split):
+    fresh = AnomalyDetector(sample_df)
+    streamed = AnomalyDetector(sample_df.iloc[:split])
+    streamed.append(sample_df, split)
+    for level in AMOUNT_GROUPS + [OVERALL]:
+        pd.testing.assert_frame_equal(streamed.stats(level).sort_index(), fresh.stats(level).sort_index())
+    assert streamed.home == fresh.home
+
+
+def test_appends_never_change_earlier_flags(sample_df):
+    detector = AnomalyDetector(sample_df.iloc[:150])
+    flags, scores = detector.flags.copy(), detector.scores.copy()
+    detector.append(sample_df, 150)
+    assert len(detector.flags) == len(sample_df)
+    np.testing.assert_array_equal(detector.flags[:150], flags)
+    np.testing.assert_array_equal(detector.scores[:150], scores)
+
+
+def test_bucketed_medians_are_within_the_sketch_error(sample_df):
+    exact = sample_df.groupby("category", observed=True)["amount_base"].median()
+    approx = AnomalyDetector(sample_df).stats("category")["median"]
+    counts = sample_df.groupby("category", observed=True)["amount_base"].count()
+    odd = counts[counts % 2 == 1].index  # even counts: exact median averages two amounts
+    np.testing.assert_allclose(approx[odd].astype(float), exact[odd], rtol=SKETCH_ERROR)
+
+
+def test_outlier_amount_is_flagged():
+    detector = AnomalyDetector(_frame([10, 11, 9, 10, 12, 10, 11, 9, 10, 250]))
+    assert detector.flags[-1] & FLAG_AMOUNT and not detector.flags[:-1].any()
+
+
+def test_recently_usual_amount_is_not_flagged():
+    # Years of ~10 EUR, then the price rose to 60 for the last window: 60 is far from the median,
+    # but no longer unusual against the rolling quantile
+    history = [10.0] * 200 + [60.0] * ROLLING_WINDOW
+    detector = AnomalyDetector(_frame(history))
+    assert detector.flags[200] & FLAG_AMOUNT  # the first raised charge still stood out
+    detector.append(_frame(history + [60.0]), len(history))
+    assert not detector.flags[-1] & FLAG_AMOUNT
+    detector.append(_frame(history + [60.0, 400.0]), len(history) + 1)
+    assert detector.flags[-1] & FLAG_AMOUNT
+
+
+def test_far_away_shop_is_flagged():
+    home = _frame([10.0] * 30)
+    away = _frame([10.0], lat=40.71, long=-74.0, start="2024-03-01")
+    detector = AnomalyDetector(home)
+    detector.append(pd.concat([home, away], ignore_index=True), len(home))
+    assert detector.flags[-1] & FLAG_LOCATION
+
+
+def test_duplicate_across_the_append_boundary():
+    first = _frame([10.0] * 6)
+    repeat = first.iloc[[-1]].assign(transactionTimestamp=first["transactionTimestamp"].iloc[-1] + pd.Timedelta(minutes=2))
+    detector = AnomalyDetector(first)
+    detector.append(pd.concat([first, repeat], ignore_index=True), len(first))
+    assert detector.flags[-1] & FLAG_DUPLICATE
+
+
+def test_rolling_windows_stay_bounded(sample_df):
+    detector = AnomalyDetector(sample_df.iloc[:50])
+    detector.append(sample_df, 50)
+    assert max(len(ring) for table in detector._recent.values() for ring in table.values()) == ROLLING_WINDOW
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import pytest
+
+from answers import answer_locally
+
+SELECTED = "2024-01"
+
+
+@pytest.mark.parametrize("question", [
+    "How much did I spend in March 2024?",
+    "How much did I spend last year?",
+    "How much did I spend in May?",
+    "How much did I spend in the last 30 days?",
+    "What did I spend the most on in 2023?",
+    "What did I spend the most on between 2024-02-01 and 2024-02-10?",
+    "Show me my largest transactions of all time",
+    "Top 5 transactions at Lidl",
+    "Biggest purchases from Tesco",
+    "Compare March vs last month",
+    "Top categories per month",
+])
+def test_questions_with_their_own_scope_go_to_the_model(dataset, question):
+    assert answer_locally(question, dataset, SELECTED) is None
+
+
+@pytest.mark.parametrize("question, start", [
+    ("What did I spend the most on this month?", "In January 2024 you spent the most on"),
+    ("Show me my largest transactions", "Your 5 largest transactions in January 2024"),
+    ("Top 3 purchases", "Your 3 largest transactions in January 2024"),
+    ("How does this month compare to last month?", "You spent"),
+    ("How much did I spend?", "In January 2024 you spent"),
+    ("How much did I spend in total this month?", "In January 2024 you spent"),
+])
+def test_questions_about_the_selected_period_are_answered_locally(dataset, question, start):
+    reply = answer_locally(question, dataset, SELECTED)
+    assert reply is not None and reply.startswith(start)
+
+
+def test_open_ended_questions_go_to_the_model(dataset):
+    assert answer_locally("What categories should I focus on reducing?", dataset, SELECTED) is None
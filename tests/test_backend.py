@@ -0,0 +1,148 @@
+"""backend.py against a stub ``OPENAI_BASE_URL`` served by an httpx MockTransport (no network)."""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from openai import APIConnectionError, InternalServerError
+
+import backend
+
+STUB_URL = "http://stub.local/v1"
+_real_sleep = time.sleep  # the fixture replaces time.sleep to record backoff delays
+
+
+def _completion(content: str = "hi") -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "stub",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+
+class Stub:
+    """Answers requests from a queue of responses (or exceptions), recording concurrency."""
+
+    def __init__(self, *responses, delay: float = 0.0) -> None:
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            response = self.responses.pop(0) if self.responses else _completion()
+        try:
+            if self.delay:
+                _real_sleep(self.delay)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Route the backend's clients to a :class:`Stub`; set ``stub.responses`` per test."""
+    handler = Stub()
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(backend, "BASE_URL", STUB_URL)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(backend, "_http_client", lambda async_=False: (
+        httpx.AsyncClient(transport=transport) if async_ else httpx.Client(transport=transport)))
+    monkeypatch.setattr(backend, "response_cache", backend.ResponseCache(64, 60))
+    sleeps = []
+    monkeypatch.setattr(backend.time, "sleep", sleeps.append)
+    handler.sleeps = sleeps
+    backend.reset_client()
+    yield handler
+    backend.reset_client()
+
+
+def _create():
+    return backend._get_client().chat.completions.create(model="stub", messages=[{"role": "user", "content": "x"}])
+
+
+def test_rate_limit_honours_retry_after(stub):
+    stub.responses = [httpx.Response(429, headers={"retry-after": "2"}, json={"error": {"message": "slow down"}})]
+    response = backend._with_retries(_create)
+    assert response.choices[0].message.content == "hi"
+    assert stub.calls == 2 and stub.sleeps == [2.0]
+
+
+def test_retry_after_is_capped(stub):
+    stub.responses = [httpx.Response(429, headers={"retry-after": "600"}, json={})]
+    backend._with_retries(_create)
+    assert stub.sleeps == [backend.RETRY_MAX_DELAY]
+
+
+def test_server_errors_are_retried_then_raised(stub, monkeypatch):
+    monkeypatch.setattr(backend, "MAX_RETRIES", 2)
+    stub.responses = [httpx.Response(503, json={})] * 3
+    with pytest.raises(InternalServerError):
+        backend._with_retries(_create)
+    assert stub.calls == 3 and len(stub.sleeps) == 2
+
+
+def test_connection_errors_are_retried_then_raised(stub, monkeypatch):
+    monkeypatch.setattr(backend, "MAX_RETRIES", 1)
+    stub.responses = [httpx.ConnectError("refused")] * 2
+    with pytest.raises(APIConnectionError):
+        backend._with_retries(_create)
+    assert stub.calls == 2 and len(stub.sleeps) == 1
+
+
+def test_transient_error_then_success(stub):
+    stub.responses = [httpx.Response(500, json={}), httpx.ConnectError("reset")]
+    assert backend.generate_ai_response([{"role": "user", "content": "hello"}]) == "hi"
+    assert stub.calls == 3
+
+
+def test_async_retries_back_off_without_blocking(stub, monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(backend.asyncio, "sleep", fake_sleep)
+    stub.responses = [httpx.Response(429, headers={"retry-after": "1"}, json={})]
+
+    async def run():
+        client = backend._get_async_client()
+        return await backend._awith_retries(
+            lambda: client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "x"}]))
+
+    assert asyncio.run(run()).choices[0].message.content == "hi"
+    assert delays == [1.0] and stub.sleeps == []
+
+
+def test_semaphore_bounds_in_flight_requests(stub, monkeypatch):
+    monkeypatch.setattr(backend, "_inflight", threading.BoundedSemaphore(2))
+    stub.delay = 0.05
+    threads = [
+        threading.Thread(target=backend.generate_ai_response, args=([{"role": "user", "content": f"q{i}"}],))
+        for i in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stub.calls == 6 and stub.max_active == 2
+
+
+def test_client_is_pooled_and_reset_replaces_it(stub):
+    client = backend._get_client()
+    assert backend._get_client() is client
+    backend.reset_client()
+    fresh = backend._get_client()
+    assert fresh is not client and backend._get_client() is fresh
+
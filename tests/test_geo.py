@@ -0,0 +1,85 @@
+"""geo.py's tile pyramid and the spend map callback that renders it."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import tenants
+from geo import LEVELS, WORLD, GeoIndex, tile_grid
+
+MAP_OUTPUT = "..spend-map.option...spend-map-summary.children...spend-map-modal.is_open...spend-map-view.data.."
+
+
+def test_month_tiles_match_a_fresh_grouping_and_follow_appends(sample_df):
+    half = len(sample_df) // 2
+    month = str(sample_df["month"].iloc[half - 1])
+    geo = GeoIndex(sample_df.iloc[:half].reset_index(drop=True))
+    before = geo.tiles(2, [month])
+    assert before["spend"].sum() == pytest.approx(geo.tiles(2, [month, "1900-01"])["spend"].sum())
+    geo.append(sample_df, start=half)
+    fresh = GeoIndex(sample_df).tiles(2, [month]).sort_index()
+    assert geo.tiles(2, [month]).sort_index()["spend"].to_numpy() == pytest.approx(fresh["spend"].to_numpy())
+    assert geo.tiles(2, ["1900-01"]).empty
+
+
+def test_tile_grid_covers_the_bbox():
+    souths, wests = tile_grid((49.9, 14.1, 50.3, 14.6), 3)
+    size = LEVELS[3]
+    assert souths[0] <= 49.9 < souths[0] + size and souths[-1] <= 50.3 < souths[-1] + size
+    assert wests[0] <= 14.1 < wests[0] + size and wests[-1] <= 14.6 < wests[-1] + size
+    assert len(tile_grid(WORLD, 0)[1]) == 360 / LEVELS[0]
+
+
+def _render(client, changed, value=None, view=None, month="2024-01"):
+    inputs = {"spend-map-btn": ("n_clicks", 1), "spend-map-reset-btn": ("n_clicks", 0),
+              "spend-map": ("click_data", None)}
+    payload = {
+        "output": MAP_OUTPUT,
+        "outputs": [{"id": "spend-map", "property": "option"}, {"id": "spend-map-summary", "property": "children"},
+                    {"id": "spend-map-modal", "property": "is_open"}, {"id": "spend-map-view", "property": "data"}],
+        "inputs": [{"id": key, "property": prop, "value": val} for key, (prop, val) in inputs.items()]
+        + [{"id": "spend-map", "property": "brush_data", "value": None}],
+        "state": [{"id": "month-dropdown-store", "property": "data", "value": {"value": month}},
+                  {"id": "spend-map-view", "property": "data", "value": view}],
+        "changedPropIds": [changed],
+    }
+    for item in payload["inputs"]:
+        if f"{item['id']}.{item['property']}" == changed:
+            item["value"] = value
+    response = client.post("/_dash-update-component", json=payload, headers={tenants.TENANT_HEADER: "alice"})
+    return response
+
+
+def _outputs(response):
+    assert response.status_code == 200
+    body = json.loads(response.data)["response"]
+    return body["spend-map"]["option"], body["spend-map-summary"]["children"], body["spend-map-view"]["data"]
+
+
+def test_spend_map_is_a_heatmap_of_the_viewport_level(tenant_app):
+    client, datasets = tenant_app
+    month = str(datasets["alice"].df["month"].iloc[0])
+    option, summary, view = _outputs(_render(client, "spend-map-btn.n_clicks", 1, month=month))
+    series = option["series"][0]
+    assert series["type"] == "heatmap" and option["xAxis"]["type"] == "category"
+    level, tiles = datasets["alice"].spend_tiles(month, WORLD)
+    assert len(series["data"]) > 0 and view["level"] >= level
+    assert sum(cell["value"][2] for cell in series["data"]) == pytest.approx(tiles["spend"].sum(), rel=1e-6)
+    for cell in series["data"]:
+        column, row = cell["value"][:2]
+        assert option["xAxis"]["data"][column] == f"{cell['value'][5]:g}"
+        assert option["yAxis"]["data"][row] == f"{cell['value'][4]:g}"
+
+    # Clicking a tile zooms to its neighbourhood on a finer level
+    cell = max(series["data"], key=lambda item: item["value"][2])
+    zoomed, _, zoomed_view = _outputs(_render(client, "spend-map.click_data", {"data": cell}, view, month))
+    assert zoomed_view["level"] > view["level"]
+
+    # Brushing a rectangle zooms to it, with the level chosen from its size
+    column, row = cell["value"][:2]
+    brush = {"areas": [{"coordRange": [[column, column], [row, row]]}]}
+    _, _, brushed_view = _outputs(_render(client, "spend-map.brush_data", brush, view, month))
+    assert brushed_view["level"] > view["level"]
+    assert brushed_view["south"] <= cell["value"][4] and brushed_view["west"] <= cell["value"][5]
+    assert _render(client, "spend-map.brush_data", {"areas": []}, view, month).status_code == 204
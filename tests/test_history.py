@@ -0,0 +1,54 @@
+"""history.py's rolling summary cache."""
+from __future__ import annotations
+
+import asyncio
+
+from history import ConversationMemory
+
+
+def _chat(n: int):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+class FlakySummarizer:
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, previous, folded):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("summarizer unavailable")
+        return f"summary of {len(folded)}"
+
+    async def acall(self, previous, folded):
+        return self(previous, folded)
+
+
+def test_failed_summary_is_retried_on_the_next_compact():
+    summarize = FlakySummarizer(failures=1)
+    memory = ConversationMemory(summarize, turns=1)
+    chat = _chat(6)
+    first = memory.compact(chat)
+    assert "- user: message 0" in first[0]["content"]
+    second = memory.compact(chat)
+    assert second[0]["content"].endswith("summary of 4") and summarize.calls == 2
+    memory.compact(chat)
+    assert summarize.calls == 2
+
+
+def test_async_failed_summary_is_retried_on_the_next_compact():
+    summarize = FlakySummarizer(failures=1)
+    memory = ConversationMemory(asummarize=summarize.acall, turns=1)
+    chat = _chat(6)
+    asyncio.run(memory.acompact(chat))
+    assert asyncio.run(memory.acompact(chat))[0]["content"].endswith("summary of 4")
+    asyncio.run(memory.acompact(chat))
+    assert summarize.calls == 2
+
+
+def test_offline_summary_is_cached_without_a_summarizer():
+    memory = ConversationMemory(turns=1)
+    chat = _chat(6)
+    assert memory.compact(chat) == memory.compact(chat)
+    assert len(memory._summaries) == 1
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import io
+import urllib.parse
+
+import pytest
+from PIL import Image
+
+import logos
+import tenants
+from logos import DirectoryLogoFetcher, LogoCache, logo_sources, logo_url, source_digest
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+
+
+def _png(side: int) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGBA", (side, side), (200, 30, 30, 255)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _mirror(root, source: str, data: bytes) -> None:
+    path = root / urllib.parse.urlsplit(source).path.lstrip("/")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+class CountingFetcher(DirectoryLogoFetcher):
+    def __init__(self, root) -> None:
+        super().__init__(root)
+        self.fetches = 0
+
+    def fetch(self, url: str) -> bytes:
+        self.fetches += 1
+        return super().fetch(url)
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    root = tmp_path / "mirror"
+    root.mkdir()
+    fetcher = CountingFetcher(root)
+    monkeypatch.setattr(logos, "logo_cache", LogoCache(fetcher, tmp_path / "cache"))
+    return fetcher
+
+
+def test_thumbnails_stay_resized_even_when_png_is_larger_than_the_source():
+    import random
+    rng = random.Random(0)
+    noisy = Image.frombytes("RGB", (400, 400), bytes(rng.randrange(256) for _ in range(400 * 400 * 3)))
+    out = io.BytesIO()
+    noisy.save(out, format="JPEG", quality=30)
+    source = out.getvalue()
+    for size, data in logos._thumbnails(source).items():
+        thumb = Image.open(io.BytesIO(data))
+        assert data != source and max(thumb.size) == size and len(data) < len(source)
+
+
+def test_small_logos_are_never_enlarged():
+    source = _png(16)
+    for data in logos._thumbnails(source).values():
+        assert Image.open(io.BytesIO(data)).size == (16, 16) and len(data) <= len(source)
+
+
+def test_directory_fetcher_reads_the_mirror_and_stays_inside_it(tmp_path):
+    _mirror(tmp_path, "https://host/m/abc/l", b"logo")
+    fetcher = DirectoryLogoFetcher(tmp_path)
+    assert fetcher.fetch("https://host/m/abc/l") == b"logo"
+    (tmp_path.parent / "secret").write_bytes(b"nope")
+    with pytest.raises(FileNotFoundError):
+        fetcher.fetch("https://host/../secret")
+    with pytest.raises(FileNotFoundError):
+        fetcher.fetch("https://host/m/missing/l")
+
+
+def test_cache_fetches_each_source_once(mirror):
+    _mirror(mirror.root, "https://host/m/abc/l", _png(256))
+    data, content_type = logos.logo_cache.get("https://host/m/abc/l", 64)
+    assert content_type in {"image/png", "image/webp"} and Image.open(io.BytesIO(data)).size == (64, 64)
+    assert Image.open(io.BytesIO(logos.logo_cache.get("https://host/m/abc/l", 128)[0])).size == (128, 128)
+    assert mirror.fetches == 1
+
+
+def test_failed_fetch_is_not_retried_immediately(mirror):
+    with pytest.raises(FileNotFoundError):
+        logos.logo_cache.get("https://host/m/missing/l")
+    with pytest.raises(LookupError):
+        logos.logo_cache.get("https://host/m/missing/l")
+    assert mirror.fetches == 1 and not logos.logo_cache._fetching
+
+
+def test_route_serves_the_tenants_logos_with_security_headers(mirror, tenant_app):
+    client, datasets = tenant_app
+    sources = logo_sources(datasets["alice"])
+    (kind, key), source = next(
+        (item for item in sources.items() if item[0] not in logo_sources(datasets["bob"]) and item[0][0] == "merchant"))
+    _mirror(mirror.root, source, SVG)
+    url = logo_url(kind, key, source)
+    response = client.get(url, headers={tenants.TENANT_HEADER: "alice"})
+    assert response.status_code == 200 and response.data == SVG
+    assert response.headers["Content-Security-Policy"] == "default-src 'none'; style-src 'unsafe-inline'"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["ETag"] == f'"{source_digest(source)[:16]}-{logos.DEFAULT_SIZE}"'
+    etag = response.headers["ETag"]
+    assert client.get(url, headers={tenants.TENANT_HEADER: "alice", "If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={tenants.TENANT_HEADER: "bob"}).status_code == 404
+
+
+def test_route_rejects_unknown_kinds_and_sizes(mirror, tenant_app):
+    client, _ = tenant_app
+    assert client.get(f"{logos.ROUTE}/user/abc").status_code == 404
+    assert client.get(f"{logos.ROUTE}/merchant/abc?size=4096").status_code == 404
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import pytest
+
+import maps
+import tenants
+from maps import DEFAULT_SIZE, DEFAULT_ZOOM, MapCache, OfflineMapRenderer, map_key, map_locations
+
+
+class CountingRenderer(OfflineMapRenderer):
+    def __init__(self) -> None:
+        self.renders = 0
+
+    def render(self, *args) -> bytes:
+        self.renders += 1
+        return super().render(*args)
+
+
+@pytest.fixture
+def renderer(monkeypatch, tmp_path):
+    renderer = CountingRenderer()
+    monkeypatch.setattr(maps, "map_cache", MapCache(renderer, tmp_path))
+    return renderer
+
+
+def _url(lat, long, zoom=DEFAULT_ZOOM, size=DEFAULT_SIZE):
+    return f"{maps.ROUTE}?lat={lat}&long={long}&zoom={zoom}&size={size[0]}x{size[1]}"
+
+
+def _only_in(datasets, owner):
+    other = next(key for key in datasets if key != owner)
+    return sorted(map_locations(datasets[owner]) - map_locations(datasets[other]))[0]
+
+
+def test_offline_renderer_is_deterministic_svg():
+    renderer = OfflineMapRenderer()
+    svg = renderer.render(48.1486, 17.1077, 15, 416, 234)
+    assert svg == renderer.render(48.1486, 17.1077, 15, 416, 234)
+    assert svg.startswith(b"<svg") and b"48.1486, 17.1077" in svg and b"<circle" in svg
+    assert svg != renderer.render(48.1486, 17.1077, 16, 416, 234)
+
+
+def test_cache_renders_each_key_once(renderer, tmp_path):
+    first = maps.map_cache.get(48.14861, 17.10771)
+    assert maps.map_cache.get(48.14859, 17.10769) == first  # same rounded key
+    assert renderer.renders == 1
+    assert maps.map_cache.path(*map_key(48.1486, 17.1077, DEFAULT_ZOOM, DEFAULT_SIZE)).exists()
+
+
+def test_route_serves_only_the_tenants_own_shops(renderer, tenant_app):
+    client, datasets = tenant_app
+    lat, long = _only_in(datasets, "alice")
+    as_alice = {tenants.TENANT_HEADER: "alice"}
+    response = client.get(_url(lat, long), headers=as_alice)
+    assert response.status_code == 200 and response.mimetype == "image/svg+xml"
+    assert response.headers["Cache-Control"].startswith("public") and response.headers["ETag"]
+    assert client.get(_url(lat, long), headers={tenants.TENANT_HEADER: "bob"}).status_code == 404
+    assert client.get(_url(0.5, 0.5), headers=as_alice).status_code == 404
+    assert renderer.renders == 1
+
+
+def test_route_revalidates_with_etag(renderer, tenant_app):
+    client, datasets = tenant_app
+    lat, long = _only_in(datasets, "bob")
+    headers = {tenants.TENANT_HEADER: "bob"}
+    etag = client.get(_url(lat, long), headers=headers).headers["ETag"]
+    assert client.get(_url(lat, long), headers={**headers, "If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.parametrize("zoom, size", [(3, DEFAULT_SIZE), (20, DEFAULT_SIZE), (DEFAULT_ZOOM, (640, 640))])
+def test_route_caps_zoom_and_size(renderer, tenant_app, zoom, size):
+    client, datasets = tenant_app
+    lat, long = _only_in(datasets, "alice")
+    response = client.get(_url(lat, long, zoom, size), headers={tenants.TENANT_HEADER: "alice"})
+    assert response.status_code == 400 and renderer.renders == 0
+
+
+def test_route_rejects_malformed_requests(renderer, tenant_app):
+    client, _ = tenant_app
+    assert client.get(f"{maps.ROUTE}?lat=abc&long=1").status_code == 400
+    assert client.get(f"{maps.ROUTE}?lat=91&long=1").status_code == 400
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from tenants import TenantCache
+
+WAITERS = 6
+
+
+class Loader:
+    """Counts loads; each load takes a moment so concurrent requests pile up behind it."""
+
+    def __init__(self, dataset=None, error: Exception = None) -> None:
+        self.dataset = dataset
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, tenant_id):
+        self.calls += 1
+        time.sleep(0.1)
+        if self.error is not None:
+            raise self.error
+        return self.dataset
+
+
+def _get_concurrently(cache, tenant_id):
+    results, barrier = [None] * WAITERS, threading.Barrier(WAITERS)
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = cache.get(tenant_id)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(WAITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_share_one_load(dataset):
+    loader = Loader(dataset)
+    cache = TenantCache(loader)
+    results = _get_concurrently(cache, "alice")
+    assert loader.calls == 1
+    assert all(result is results[0] for result in results) and results[0].dataset is dataset
+    assert cache.stats()["loads"] == 1
+
+
+def test_a_failed_load_is_shared_not_repeated_by_every_waiter():
+    loader = Loader(error=OSError("partition unreadable"))
+    cache = TenantCache(loader)
+    results = _get_concurrently(cache, "alice")
+    assert loader.calls == 1
+    assert all(isinstance(result, OSError) for result in results)
+    assert not cache._loading
+
+
+def test_the_next_request_after_a_failure_retries(dataset):
+    loader = Loader(error=OSError("partition unreadable"))
+    cache = TenantCache(loader)
+    with pytest.raises(OSError):
+        cache.get("alice")
+    loader.error, loader.dataset = None, dataset
+    assert cache.get("alice").dataset is dataset and loader.calls == 2
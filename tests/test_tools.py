@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from tools import TransactionTools
+
+
+@pytest.fixture(scope="module")
+def toolbox(dataset):
+    return TransactionTools(dataset)
+
+
+def test_non_string_arguments_are_coerced(toolbox):
+    result = json.loads(toolbox.call("co2_total", json.dumps({"category": 5})))
+    assert result["category"] == "5" and result["transactions"] == 0
+    top = json.loads(toolbox.call("top_n_transactions", json.dumps({"n": "2", "merchant": 7})))
+    assert isinstance(top, list)
+
+
+def test_boolean_strings_are_parsed(toolbox):
+    active = json.loads(toolbox.call("list_subscriptions", "{}"))
+    assert json.loads(toolbox.call("list_subscriptions", json.dumps({"include_inactive": "false"}))) == active
+
+
+@pytest.mark.parametrize("name, arguments", [
+    ("top_n_transactions", json.dumps({"n": "many"})),
+    ("top_n_transactions", json.dumps([1, 2])),
+    ("spend_in_range", json.dumps({"start": "not a date", "end": "2024-01-01"})),
+    ("sum_by_category", "{not json"),
+    ("nope", "{}"),
+])
+def test_bad_calls_return_an_error_to_the_model(toolbox, name, arguments):
+    assert "error" in json.loads(toolbox.call(name, arguments))
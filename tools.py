@@ -0,0 +1,395 @@
+"""tools.py – local query tools the model can call instead of reading raw rows
+==============================================================================
+
+Rather than inlining transactions into the system prompt, the assistant gets
+a handful of functions (OpenAI tool calling) that run against the in‑memory
+dataset.  The prompt stays small however long the history is, and answers
+cover all of it.
+
+Arguments come from the model, so :meth:`TransactionTools.call` coerces
+them to the types declared in :data:`TOOL_SPECS` before dispatch, and any
+failure is returned to the model as ``{"error": ...}`` rather than raised.
+
+Usage (inside app.py)
+---------------------
+```python
+toolbox = TransactionTools(dataset)
+stream_ai_response(history, extra_context=ctx, tools=toolbox)
+```
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from dataset import TransactionDataset
+from fx import BASE_CURRENCY
+
+MAX_ROWS = 50
+
+_MONTH = {"type": "string", "description": "Month as YYYY-MM. Omit for the whole history."}
+
+TOOL_SPECS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "sum_by_category",
+            "description": f"Total spend ({BASE_CURRENCY}) and transaction count per category, largest first.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "month": _MONTH,
+                    "top": {"type": "integer", "description": "Max categories to return.", "default": 10},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "sum_by_tag",
+            "description": f"Total spend ({BASE_CURRENCY}) and transaction count per merchant tag (e.g. Shopping Online), largest first. A transaction counts towards each of its tags.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "month": _MONTH,
+                    "top": {"type": "integer", "description": "Max tags to return.", "default": 10},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "top_n_transactions",
+            "description": (f"Largest individual transactions by {BASE_CURRENCY} value, optionally filtered "
+                            "by month, category or merchant."),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "n": {"type": "integer", "default": 5},
+                    "month": _MONTH,
+                    "category": {"type": "string"},
+                    "merchant": {"type": "string"},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "compare_periods",
+            "description": f"Compare total and per-category spend ({BASE_CURRENCY}) between two months.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "month_a": {"type": "string", "description": "YYYY-MM"},
+                    "month_b": {"type": "string", "description": "YYYY-MM"},
+                },
+                "required": ["month_a", "month_b"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "spend_in_range",
+            "description": (f"Total spend ({BASE_CURRENCY}), count and top categories between two dates, "
+                            "both inclusive. Use for weeks, custom ranges or 'last N days'."),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "start": {"type": "string", "description": "YYYY-MM-DD"},
+                    "end": {"type": "string", "description": "YYYY-MM-DD"},
+                },
+                "required": ["start", "end"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_merchant",
+            "description": f"Find merchants whose name contains the query; returns {BASE_CURRENCY} totals and months seen.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "limit": {"type": "integer", "default": 10},
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_transactions",
+            "description": "Full-text search over merchant, tags, category, street and city (prefix and typo tolerant); newest matches first.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "limit": {"type": "integer", "default": 10},
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "merchants_nearby",
+            "description": "Merchants the user has paid within a radius of a point, nearest first, with visits and spend.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "lat": {"type": "number"},
+                    "long": {"type": "number"},
+                    "radius_km": {"type": "number", "default": 1.0},
+                    "limit": {"type": "integer", "default": 10},
+                },
+                "required": ["lat", "long"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "spend_in_area",
+            "description": (f"Spend ({BASE_CURRENCY}) and transaction count inside a lat/long bounding box, "
+                            "optionally for one month."),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "south": {"type": "number"}, "west": {"type": "number"},
+                    "north": {"type": "number"}, "east": {"type": "number"},
+                    "month": _MONTH,
+                },
+                "required": ["south", "west", "north", "east"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "list_subscriptions",
+            "description": ("Recurring charges (weekly, monthly, yearly subscriptions) detected from the "
+                            f"history, with typical amount, monthly cost in {BASE_CURRENCY} and next charge date."),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "include_inactive": {"type": "boolean", "default": False,
+                                         "description": "Also list subscriptions that seem cancelled."},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "co2_total",
+            "description": ("Total CO2 footprint in kg (normalised from g/kg/t at ingest), optionally for "
+                            "one month and/or category."),
+            "parameters": {
+                "type": "object",
+                "properties": {"month": _MONTH, "category": {"type": "string"}},
+            },
+        },
+    },
+]
+
+
+class TransactionTools:
+    """The tools in :data:`TOOL_SPECS`, bound to one :class:`TransactionDataset`."""
+
+    specs = TOOL_SPECS
+
+    def __init__(self, dataset: TransactionDataset) -> None:
+        self.dataset = dataset
+        self._handlers: Dict[str, Callable[..., Any]] = {
+            "sum_by_category": self.sum_by_category,
+            "sum_by_tag": self.sum_by_tag,
+            "top_n_transactions": self.top_n_transactions,
+            "compare_periods": self.compare_periods,
+            "spend_in_range": self.spend_in_range,
+            "find_merchant": self.find_merchant,
+            "search_transactions": self.search_transactions,
+            "merchants_nearby": self.merchants_nearby,
+            "spend_in_area": self.spend_in_area,
+            "list_subscriptions": self.list_subscriptions,
+            "co2_total": self.co2_total,
+        }
+        self._properties: Dict[str, Dict[str, Any]] = {
+            spec["function"]["name"]: spec["function"]["parameters"].get("properties", {}) for spec in self.specs
+        }
+
+    @property
+    def cache_key(self) -> str:
+        """Identifies tools + data, so cached replies don't outlive the data."""
+        return f"{','.join(self._handlers)}@{self.dataset.version}"
+
+    def call(self, name: str, arguments: str) -> str:
+        """Run tool **name** with JSON **arguments**; always returns a JSON string."""
+        handler = self._handlers.get(name)
+        if handler is None:
+            return json.dumps({"error": f"unknown tool {name!r}"})
+        try:
+            kwargs = _coerce(json.loads(arguments or "{}"), self._properties.get(name, {}))
+            return json.dumps(handler(**kwargs), ensure_ascii=False, default=str)
+        except Exception as e:  # a bad call must not abort the reply; the model can retry
+            return json.dumps({"error": f"{e.__class__.__name__}: {e}"})
+
+    # ------------------------------------------------------------------ tools
+    def sum_by_category(self, month: Optional[str] = None, top: int = 10) -> List[Dict[str, Any]]:
+        cells = self._cells(month)
+        grouped = cells.groupby(level="category")[["base_sum", "count"]].sum()
+        grouped = grouped.sort_values("base_sum", ascending=False).head(max(int(top), 1))
+        return [
+            {"category": name, "total": round(float(row["base_sum"]), 2), "count": int(row["count"])}
+            for name, row in grouped.iterrows()
+        ]
+
+    def sum_by_tag(self, month: Optional[str] = None, top: int = 10) -> List[Dict[str, Any]]:
+        totals = self.dataset.tag_totals(month).head(max(int(top), 1))
+        return [
+            {"tag": name, "total": round(float(row["total"]), 2), "count": int(row["count"])}
+            for name, row in totals.iterrows()
+        ]
+
+    def top_n_transactions(
+        self,
+        n: int = 5,
+        month: Optional[str] = None,
+        category: Optional[str] = None,
+        merchant: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        df = self.dataset.month_frame(month) if month else self.dataset.df
+        if category:
+            df = df[df["category"].astype(str).str.casefold() == category.casefold()]
+        if merchant:
+            df = df[df["merchant"].astype(str).str.casefold().str.contains(merchant.casefold(), regex=False)]
+        top = df.nlargest(min(max(int(n), 1), MAX_ROWS), "amount_base")
+        return _records(top)
+
+    def compare_periods(self, month_a: str, month_b: str) -> Dict[str, Any]:
+        cube = self.dataset.cube
+        by_cat = pd.DataFrame({
+            month_a: cube.category_totals(month_a),
+            month_b: cube.category_totals(month_b),
+        }).fillna(0.0)
+        by_cat["change"] = by_cat[month_b] - by_cat[month_a]
+        by_cat = by_cat.reindex(by_cat["change"].abs().sort_values(ascending=False).index)
+        return {
+            "totals": {
+                month_a: round(cube.month_summary(month_a)["total"], 2),
+                month_b: round(cube.month_summary(month_b)["total"], 2),
+            },
+            "by_category": [
+                {"category": name, month_a: round(row[month_a], 2), month_b: round(row[month_b], 2),
+                 "change": round(row["change"], 2)}
+                for name, row in by_cat.head(MAX_ROWS).iterrows()
+            ],
+        }
+
+    def spend_in_range(self, start: str, end: str) -> Dict[str, Any]:
+        period = f"{pd.Timestamp(start):%Y-%m-%d}..{pd.Timestamp(end):%Y-%m-%d}"
+        summary = self.dataset.summary(period)
+        by_cat = self.dataset.category_totals(period).head(10)
+        return {
+            "start": start, "end": end, "total": round(summary["total"], 2), "count": summary["count"],
+            "by_category": [{"category": name, "total": round(float(v), 2)} for name, v in by_cat.items()],
+        }
+
+    def find_merchant(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        cells = self.dataset.cube.cells
+        merchants = cells.index.get_level_values("merchant")
+        hits = cells[merchants.str.casefold().str.contains(str(query).casefold(), regex=False)]
+        if hits.empty:
+            return []
+        grouped = hits.groupby(level="merchant").agg(
+            total=("base_sum", "sum"), count=("count", "sum"),
+        ).sort_values("total", ascending=False).head(max(int(limit), 1))
+        months = hits.reset_index().groupby("merchant")["month"].agg(lambda m: sorted(set(m)))
+        categories = hits.reset_index().groupby("merchant")["category"].first()
+        return [
+            {"merchant": name, "category": categories[name], "total": round(float(row["total"]), 2),
+             "count": int(row["count"]), "months": months[name]}
+            for name, row in grouped.iterrows()
+        ]
+
+    def search_transactions(self, query: str, limit: int = 10) -> Dict[str, Any]:
+        total, rows = self.dataset.search(str(query), 0, min(max(int(limit), 1), MAX_ROWS))
+        return {"query": query, "total": total, "transactions": _records(rows)}
+
+    def merchants_nearby(self, lat: float, long: float, radius_km: float = 1.0, limit: int = 10) -> List[Dict[str, Any]]:
+        nearby = self.dataset.nearby(float(lat), float(long), float(radius_km), min(max(int(limit), 1), MAX_ROWS))
+        return [
+            {"merchant": m, "category": c, "distance_km": round(float(d), 2), "visits": int(v), "total": round(float(t), 2)}
+            for m, c, d, v, t in zip(nearby["merchant"], nearby["category"], nearby["distance_km"], nearby["visits"], nearby["spend"])
+        ]
+
+    def spend_in_area(
+        self, south: float, west: float, north: float, east: float, month: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        bbox = (float(south), float(west), float(north), float(east))
+        totals = self.dataset.geo.bbox_totals(bbox, months=[month] if month else None)
+        return {"bbox": bbox, "month": month, "total": round(totals["spend"], 2), "count": totals["count"]}
+
+    def list_subscriptions(self, include_inactive: bool = False) -> List[Dict[str, Any]]:
+        subs = self.dataset.subscriptions(active_only=not include_inactive).head(MAX_ROWS)
+        return [
+            {"merchant": row.merchant, "category": row.category, "cadence": row.cadence,
+             "charges": int(row.charges), "amount": round(float(row.amount), 2), "currency": row.currency,
+             "monthly_cost": round(float(row.monthly_cost), 2), "last_charge": f"{row.last_charge:%Y-%m-%d}",
+             "next_charge": f"{row.next_charge:%Y-%m-%d}", "active": bool(row.active)}
+            for row in subs.itertuples()
+        ]
+
+    def co2_total(self, month: Optional[str] = None, category: Optional[str] = None) -> Dict[str, Any]:
+        cells = self._cells(month)
+        if category:
+            cats = cells.index.get_level_values("category")
+            cells = cells[cats.str.casefold() == category.casefold()]
+        return {
+            "month": month, "category": category, "unit": "kg",
+            "co2": round(float(cells["co2_sum"].sum()), 2), "transactions": int(cells["count"].sum()),
+        }
+
+    # ------------------------------------------------------------------ helpers
+    def _cells(self, month: Optional[str]) -> pd.DataFrame:
+        cells = self.dataset.cube.cells
+        if month:
+            cells = cells[cells.index.get_level_values("month") == str(month)]
+        return cells
+
+
+def _boolean(value: Any) -> bool:
+    return value.strip().casefold() in ("true", "1", "yes") if isinstance(value, str) else bool(value)
+
+
+_COERCE: Dict[str, Callable[[Any], Any]] = {"string": str, "integer": int, "number": float, "boolean": _boolean}
+
+
+def _coerce(kwargs: Any, properties: Dict[str, Any]) -> Dict[str, Any]:
+    """**kwargs** with each value cast to the JSON schema type of its property (``None`` kept)."""
+    if not isinstance(kwargs, dict):
+        raise TypeError(f"arguments must be a JSON object, not {type(kwargs).__name__}")
+    coerced = {}
+    for key, value in kwargs.items():
+        cast = _COERCE.get(properties.get(key, {}).get("type"))
+        coerced[key] = cast(value) if cast is not None and value is not None else value
+    return coerced
+
+
+def _records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    return [
+        {"date": f"{stamp:%Y-%m-%d}", "merchant": merchant, "category": category,
+         "amount": round(float(amount), 2), "currency": currency, "amount_base": round(float(base), 2)}
+        for stamp, merchant, category, amount, currency, base in zip(
+            df["transactionTimestamp"], df["merchant"].astype(str), df["category"].astype(str),
+            df["amount"], df["currency"].astype(str), df["amount_base"],
+        )
+    ]